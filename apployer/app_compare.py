@@ -18,12 +18,13 @@
 Comparing an application from appstack to its counterpart in the live environment.
 """
 
+import functools
 import logging
-import pkg_resources
+import re
 
 import datadiff
-from requests.structures import CaseInsensitiveDict
 
+from . import blob_store
 from . import cf_api
 from . import cf_cli
 
@@ -48,7 +49,7 @@ def should_update(app):
                   "Will need to push it...", app.name)
         return True
     app_summary = cf_api.get_app_summary(app_guid)
-    app_properties = app.app_properties
+    app_properties = blob_store.resolve(app.app_properties)
 
     appstack_version, live_env_version = _get_app_versions(app_properties, app_summary)
     if appstack_version > live_env_version:
@@ -71,15 +72,152 @@ def _get_app_versions(app_properties, app_summary):
         app_summary (dict): Application's properties from Cloud Foundry.
 
     Returns:
-        (`pkg_resources.SetuptoolsVersion`, `pkg_resources.SetuptoolsVersion`): Tuple in form:
+        (`_AppVersion`, `_AppVersion`): Tuple in form:
             (app_version_in_appstack, app_version_in_live_env).
             If version isn't found, then the lowest possible version will be returned.
     """
     appstack_version = app_properties.get('env', {}).get('VERSION', '')
     live_env_version = app_summary.get('environment_json', {}).get('VERSION', '')
     # empty version string will be parsed to the lowest possible version
-    return (pkg_resources.parse_version(appstack_version),
-            pkg_resources.parse_version(live_env_version))
+    return _AppVersion(appstack_version), _AppVersion(live_env_version)
+
+
+@functools.total_ordering
+class _AppVersion(object):
+    """Version of an application that can be compared with other versions.
+    It's a lightweight replacement of `pkg_resources.parse_version` (which takes long to import),
+    ordering the versions the same way:
+
+    * versions following PEP 440 (like 1.0, 1.0rc1, 1.0.post1, 1.0.dev3) are compared according to
+      it, e.g. trailing zeros don't matter (1.0 == 1.0.0) and "c", "pre" and "preview" are the
+      same as "rc",
+    * other versions (like 1.0-SNAPSHOT) and the empty version are compared like setuptools'
+      legacy versions and are lower than all PEP 440 versions.
+
+    Args:
+        version (str): The version string.
+    """
+
+    __slots__ = ('version', '_key')
+
+    _PEP440_REGEX = re.compile(r"""
+        ^\s*v?
+        (?:(?P<epoch>[0-9]+)!)?
+        (?P<release>[0-9]+(?:\.[0-9]+)*)
+        (?P<pre>
+            [-_\.]?
+            (?P<pre_l>(a|b|c|rc|alpha|beta|pre|preview))
+            [-_\.]?
+            (?P<pre_n>[0-9]+)?
+        )?
+        (?P<post>
+            (?:-(?P<post_n1>[0-9]+))
+            |
+            (?:
+                [-_\.]?
+                (?P<post_l>post|rev|r)
+                [-_\.]?
+                (?P<post_n2>[0-9]+)?
+            )
+        )?
+        (?P<dev>
+            [-_\.]?
+            (?P<dev_l>dev)
+            [-_\.]?
+            (?P<dev_n>[0-9]+)?
+        )?
+        (?:\+(?P<local>[a-z0-9]+(?:[-_\.][a-z0-9]+)*))?
+        \s*$""", re.VERBOSE | re.IGNORECASE)
+    _LETTER_NORMALIZATION = {'alpha': 'a', 'beta': 'b', 'c': 'rc', 'pre': 'rc', 'preview': 'rc',
+                             'rev': 'post', 'r': 'post'}
+
+    _LEGACY_COMPONENT_REGEX = re.compile(r'(\d+|[a-z]+|\.|-)')
+    _LEGACY_REPLACEMENTS = {'pre': 'c', 'preview': 'c', '-': 'final-', 'rc': 'c', 'dev': '@'}
+
+    def __init__(self, version):
+        self.version = version
+        match = self._PEP440_REGEX.match(version)
+        self._key = self._get_key(match) if match else self._get_legacy_key(version)
+
+    @classmethod
+    def _get_key(cls, match):
+        release = [int(number) for number in match.group('release').split('.')]
+        while release and release[-1] == 0:
+            release.pop()
+        pre = cls._get_letter_number(match.group('pre_l'), match.group('pre_n'))
+        post = cls._get_letter_number(match.group('post_l'),
+                                      match.group('post_n1') or match.group('post_n2'))
+        dev = cls._get_letter_number(match.group('dev_l'), match.group('dev_n'))
+        local = match.group('local')
+
+        # Tuples below are ordered like infinities and values in setuptools' comparison keys.
+        if pre is None and post is None and dev is not None:
+            pre_key = (0,)
+        else:
+            pre_key = (1,) + pre if pre else (2,)
+        post_key = (1,) + post if post else (0,)
+        dev_key = (0,) + dev if dev else (1,)
+        local_key = () if local is None else tuple(
+            (1, int(part)) if part.isdigit() else (0, part.lower())
+            for part in re.split(r'[-_\.]', local))
+        return (int(match.group('epoch') or 0), tuple(release), pre_key, post_key, dev_key,
+                local_key)
+
+    @classmethod
+    def _get_letter_number(cls, letter, number):
+        if letter:
+            letter = letter.lower()
+            return cls._LETTER_NORMALIZATION.get(letter, letter), int(number or 0)
+        elif number:
+            # implicit post-release, like 1.0-1
+            return 'post', int(number)
+        return None
+
+    @classmethod
+    def _get_legacy_key(cls, version):
+        parts = []
+        for component in cls._LEGACY_COMPONENT_REGEX.split(version.lower()):
+            component = cls._LEGACY_REPLACEMENTS.get(component, component)
+            if not component or component == '.':
+                continue
+            if component[:1].isdigit():
+                part = component.zfill(8)
+            else:
+                part = '*' + component
+                if part < '*final':
+                    while parts and parts[-1] == '*final-':
+                        parts.pop()
+                while parts and parts[-1] == '00000000':
+                    parts.pop()
+            parts.append(part)
+        while parts and parts[-1] == '00000000':
+            parts.pop()
+        parts.append('*final')
+        # legacy versions are lower than all PEP 440 ones
+        return -1, tuple(parts)
+
+    def __eq__(self, other):
+        if not isinstance(other, _AppVersion):
+            return NotImplemented
+        return self._key == other._key # pylint: disable=protected-access
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __lt__(self, other):
+        if not isinstance(other, _AppVersion):
+            return NotImplemented
+        return self._key < other._key # pylint: disable=protected-access
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __str__(self):
+        return self.version
+
+    def __repr__(self):
+        return '_AppVersion({!r})'.format(self.version)
 
 
 def _properties_differ(app_properties, app_summary):
@@ -140,7 +278,8 @@ def _dict_is_part_of(dict_a, dict_b):
     Return:
         bool: True if dict_a contains dict_b.
     """
-    dict_a, dict_b = CaseInsensitiveDict(dict_a), CaseInsensitiveDict(dict_b)
+    dict_a = {key.lower(): value for key, value in dict_a.items()}
+    dict_b = {key.lower(): value for key, value in dict_b.items()}
     for key, value in dict_b.items():
         if key not in dict_a or dict_a[key] != value:
             return False
@@ -18,62 +18,95 @@
 Representations of appstack and things contained within it.
 """
 
-import copy
 import logging
 
 _log = logging.getLogger(__name__) # pylint: disable=invalid-name
 
+# Strings in appstack at least that long are deduplicated when it's loaded.
+SHARED_STRING_MIN_LENGTH = 256
+# Fields of `AppStack` that its indexes are built from.
+_INDEXED_FIELDS = frozenset(('apps', 'user_provided_services', 'brokers'))
+
 
 class DataContainer(object):
     """
     Base class for data containers.
+    Subclasses declare all of their fields in `__slots__` and the ones that should be serialized
+    in `_serialized_fields`.
     """
 
-    # Lambdas taking field/value pairs from __dict__ items.
-    # If any field returns True for one of the filters then it's not included in the dictionary
-    # being created in to_dict function.
-    _to_dict_filters = []
+    __slots__ = ()
+    # Fields put into the dictionary created by to_dict function (if they're not empty).
+    _serialized_fields = ()
 
-    @classmethod
-    def _obj_to_dict(cls, obj):
-        if hasattr(obj, 'to_dict'):
-            return obj.to_dict()
+    @staticmethod
+    def _obj_to_dict(obj, skip_empty=True):
+        if isinstance(obj, DataContainer):
+            return obj.to_dict(skip_empty)
         elif isinstance(obj, list):
-            return [cls._obj_to_dict(element) for element in obj]
+            return [DataContainer._obj_to_dict(element, skip_empty) for element in obj]
         else:
             return obj
 
+    def _field_values(self):
+        return tuple(getattr(self, field) for field in self._serialized_fields)
+
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+            return self._field_values() == other._field_values() # pylint: disable=protected-access
         else:
             return False
 
+    def __ne__(self, other):
+        return not self == other
+
     def __repr__(self):
         """
         Helps investigating failing tests.
         """
-        return '{}({})'.format(self.__class__.__name__, self.__dict__)
+        fields = dict(zip(self._serialized_fields, self._field_values()))
+        return '{}({})'.format(self.__class__.__name__, fields)
+
+    def copy(self, **changes):
+        """Creates a shallow copy of the object, optionally with some of its fields replaced.
+        Field values that aren't replaced are shared between the copy and the original, so
+        containers shouldn't be modified in place after being copied - replace them instead.
+
+        Args:
+            **changes: Fields that should get new values in the copy.
 
-    def copy(self):
-        """
         Returns:
-            DataContainer: A deep copy of self.
-        """
-        return copy.deepcopy(self)
+            DataContainer: A copy of self.
 
-    def to_dict(self):
+        Raises:
+            AttributeError: When trying to replace a field that the object doesn't have.
+        """
+        new_container = object.__new__(self.__class__)
+        for field in self.__slots__:
+            setattr(new_container, field, getattr(self, field))
+        for field, value in changes.items():
+            if field not in self.__slots__:
+                raise AttributeError('{} has no field {}'.format(self.__class__.__name__, field))
+            setattr(new_container, field, value)
+        return new_container
+
+    def to_dict(self, skip_empty=True):
         """Used when converting the object to dictionary before serialization to YAML.
 
+        Args:
+            skip_empty (bool): Omit empty fields (e.g. None, 0, empty strings and lists).
+                They have to be kept if the object is created again from the dictionary and
+                some of them matter, like "order: 0" of an application.
+
         Returns:
             dict: This object presented as a dictionary.
         """
-        non_filtered = {field: self._obj_to_dict(value) for field, value in self.__dict__.items()}
-        return {field: value for field, value in non_filtered.items()
-                if value and
-                not field.startswith('_') and
-                value not in (None, [], {}) and
-                not any([dict_filter(field, value) for dict_filter in self._to_dict_filters])}
+        obj_dict = {}
+        for field in self._serialized_fields:
+            value = self._obj_to_dict(getattr(self, field), skip_empty)
+            if value or not skip_empty:
+                obj_dict[field] = value
+        return obj_dict
 
 
 class AppStack(DataContainer):
@@ -91,8 +124,16 @@ class AppStack(DataContainer):
         buildpacks (list[str]): List of buildpacks (only their names) that need to be set up in CF.
         domain (str): Environment's address domain
             (e.g. for app.example.com, the domain is example.com).
+
+    Lookups of apps and services (`get_app`, `get_service_provider`, etc.) use indexes built
+    when the appstack is created. The appstack and its elements are treated as immutable:
+    instead of modifying them in place, create a changed copy with `copy`, which rebuilds
+    the indexes if apps, user-provided services or brokers are replaced.
     """
 
+    _serialized_fields = ('apps', 'user_provided_services', 'brokers', 'buildpacks', 'domain')
+    __slots__ = _serialized_fields + ('_index',)
+
     def __init__(self, apps=None, user_provided_services=None, # pylint: disable=too-many-arguments
                  brokers=None, buildpacks=None, domain=None):
         self.apps = apps or []
@@ -100,9 +141,30 @@ class AppStack(DataContainer):
         self.brokers = brokers or []
         self.buildpacks = buildpacks or []
         self.domain = domain or ''
+        self._index = _AppStackIndex(self)
 
         self._validate_register_in()
 
+    def __getstate__(self):
+        # The index isn't copied or pickled, it's rebuilt from the fields.
+        return {field: getattr(self, field) for field in self._serialized_fields}
+
+    def __setstate__(self, state):
+        for field, value in state.items():
+            setattr(self, field, value)
+        self._index = _AppStackIndex(self)
+
+    def copy(self, **changes):
+        """Creates a shallow copy of the appstack (see `DataContainer.copy`).
+        The copy shares the indexes with the original, unless apps, user-provided services or
+        brokers are replaced.
+        """
+        new_appstack = super(AppStack, self).copy(**changes)
+        if _INDEXED_FIELDS.intersection(changes):
+            new_appstack._index = _AppStackIndex( # pylint: disable=protected-access,assigning-non-slot
+                new_appstack)
+        return new_appstack
+
     @staticmethod
     def from_appstack_dict(appstack):
         """
@@ -111,7 +173,10 @@ class AppStack(DataContainer):
 
         Returns:
             `AppStack`: AppStack instance deserialized from a dictionary.
+                Equal long strings appearing in many places of the appstack (e.g. the same
+                configuration in env of many apps) are kept in memory only once.
         """
+        appstack = _share_equal_strings(appstack, {})
         apps = AppStack._get_apps(appstack)
         user_provided_services = [UserProvidedService(**service_dict) for service_dict
                                   in appstack.get('user_provided_services', [])]
@@ -159,13 +224,198 @@ class AppStack(DataContainer):
                        app.artifact_name, app.name)
             if app.artifact_name not in manifests:
                 _log.debug("Artifact %s doesn't have a manifest.", app.artifact_name)
-                manifests[app.artifact_name] = {}
-            merged_app = app.merge_manifest(manifests[app.artifact_name])
+            merged_app = app.merge_manifest(manifests.get(app.artifact_name, {}))
             apps.append(merged_app)
 
-        new_appstack = self.copy()
-        new_appstack.apps = apps
-        return new_appstack
+        return self.copy(apps=apps)
+
+    def select_apps(self, app_names, with_dependencies=False, with_dependents=False):
+        """Creates an appstack containing only a part of this appstack's applications.
+        Applications that selected apps need to be registered in are only included with
+        `with_dependencies`, otherwise they should be looked up in this appstack when registering.
+        Only the standalone user-provided services and brokers used by the included apps are kept.
+
+        Args:
+            app_names (list[str]): Names of applications to select.
+            with_dependencies (bool): Should the apps that selected apps depend on be selected too
+                (recursively).
+            with_dependents (bool): Should the apps depending on selected apps be selected too
+                (recursively).
+
+        Returns:
+            `AppStack`: Appstack with the selected applications (in their original order).
+
+        Raises:
+            KeyError: When one of the names doesn't belong to any app in the appstack.
+        """
+        selected_apps = set()
+        apps_to_visit = [self._index.apps_by_name[app_name] for app_name in app_names]
+        while apps_to_visit:
+            app = apps_to_visit.pop()
+            if app in selected_apps:
+                continue
+            selected_apps.add(app)
+            linked_apps = []
+            if with_dependencies:
+                linked_apps.extend(self.get_app_dependencies(app))
+            if with_dependents:
+                linked_apps.extend(self.get_app_dependents(app))
+            apps_to_visit.extend(linked_apps)
+
+        apps = [app for app in self.apps if app in selected_apps]
+        used_services = set()
+        for app in apps:
+            used_services.update(app.app_properties.get('services', []))
+        user_provided_services = [service for service in self.user_provided_services
+                                  if service.name in used_services]
+        brokers = [broker for broker in self.brokers
+                   if any(instance.name in used_services for instance in broker.service_instances)]
+        return self.copy(apps=apps, user_provided_services=user_provided_services, brokers=brokers)
+
+    def select_elements(self, app_names, user_provided_service_names=(), broker_names=()):
+        """Creates an appstack containing only a part of this appstack's elements.
+        Applications are selected like in `select_apps` (without dependencies or dependents).
+        The given standalone user-provided services and brokers are kept in addition to the ones
+        used by the selected apps.
+
+        Args:
+            app_names (list[str]): Names of applications to select.
+            user_provided_service_names (list[str]): Names of standalone user-provided services
+                to select.
+            broker_names (list[str]): Names of standalone brokers to select.
+
+        Returns:
+            `AppStack`: Appstack with the selected elements (in their original order).
+
+        Raises:
+            KeyError: When one of the names doesn't belong to any app in the appstack.
+        """
+        selected_appstack = self.select_apps(app_names)
+        used_service_names = set(user_provided_service_names)
+        used_service_names.update(service.name for service in
+                                  selected_appstack.user_provided_services) # pylint: disable=no-member
+        used_broker_names = set(broker_names)
+        used_broker_names.update(broker.name for broker in
+                                 selected_appstack.brokers) # pylint: disable=no-member
+        return selected_appstack.copy(
+            user_provided_services=[service for service in self.user_provided_services
+                                    if service.name in used_service_names],
+            brokers=[broker for broker in self.brokers if broker.name in used_broker_names])
+
+    def get_app_dependencies(self, app):
+        """
+        Args:
+            app (`AppConfig`): An application from this appstack.
+
+        Returns:
+            list[`AppConfig`]: Applications providing services that the app uses and
+                the application that it needs to be registered in (if it's in this appstack).
+        """
+        dependencies = []
+        for service_name in app.app_properties.get('services', []):
+            provider = self.get_service_provider(service_name)
+            if provider and provider not in dependencies:
+                dependencies.append(provider)
+        if app.register_in:
+            registrator = self.get_app(app.register_in)
+            if registrator and registrator not in dependencies:
+                dependencies.append(registrator)
+        return dependencies
+
+    def get_app_dependents(self, app):
+        """
+        Args:
+            app (`AppConfig`): An application from this appstack.
+
+        Returns:
+            list[`AppConfig`]: Applications using services that the app provides and
+                the applications that need to be registered in it.
+        """
+        provided_services = [service.name for service in app.user_provided_services]
+        if app.broker_config:
+            provided_services.extend(
+                instance.name for instance in app.broker_config.service_instances)
+
+        dependents = []
+        for service_name in provided_services:
+            for consumer in self.get_service_consumers(service_name):
+                if consumer not in dependents:
+                    dependents.append(consumer)
+        for registered_app in self.get_registered_apps(app.name):
+            if registered_app not in dependents:
+                dependents.append(registered_app)
+        return dependents
+
+    def get_app(self, app_name):
+        """
+        Args:
+            app_name (str): Name of an application.
+
+        Returns:
+            `AppConfig`: Application with the given name or None if there's no such app.
+        """
+        return self._index.apps_by_name.get(app_name)
+
+    def get_apps_by_artifact(self, artifact_name):
+        """
+        Args:
+            artifact_name (str): Name of an application artifact.
+
+        Returns:
+            list[`AppConfig`]: Applications created from the artifact.
+        """
+        return self._index.apps_by_artifact.get(artifact_name, [])
+
+    def get_service_provider(self, service_name):
+        """
+        Args:
+            service_name (str): Name of a service instance (user-provided or created from broker).
+
+        Returns:
+            `AppConfig`: Application that provides the service (creates it as a user-provided
+                service or as an instance of its broker). None if the service isn't provided by
+                any application.
+        """
+        return self._index.service_providers.get(service_name)
+
+    def get_service_consumers(self, service_name):
+        """
+        Args:
+            service_name (str): Name of a service instance.
+
+        Returns:
+            list[`AppConfig`]: Applications that have the service in their "services".
+        """
+        return self._index.service_consumers.get(service_name, [])
+
+    def get_registered_apps(self, registrator_name):
+        """
+        Args:
+            registrator_name (str): Name of an application that other apps are registered in.
+
+        Returns:
+            list[`AppConfig`]: Applications having "register_in" set to `registrator_name`.
+        """
+        return self._index.registered_apps.get(registrator_name, [])
+
+    def is_global_service(self, service_name):
+        """
+        Args:
+            service_name (str): Name of a service instance.
+
+        Returns:
+            bool: True if the service is one of appstack's standalone user-provided services or
+                an instance of one of appstack's standalone brokers.
+        """
+        return service_name in self._index.global_services
+
+    def get_services_provided_twice(self):
+        """
+        Returns:
+            list[str]: Sorted names of the services that are provided by more than one app.
+                `get_service_provider` returns the first of their providers.
+        """
+        return sorted(self._index.services_provided_twice)
 
     def _validate_register_in(self):
         """Checks if non-empty "register_in" fields in applications point to another application
@@ -174,14 +424,80 @@ class AppStack(DataContainer):
         Raises:
             MalformedAppStackError: When "register_in" field points to a nonexistent application.
         """
-        registrator_apps = [app.register_in for app in self.apps if app.register_in]
-        app_names = {app.name for app in self.apps}
-        for registrator_app in registrator_apps:
-            if registrator_app not in app_names:
+        for registrator_app in self._index.registered_apps:
+            if self.get_app(registrator_app) is None:
                 raise MalformedAppStackError('"register_in" field of some app points to a '
                                              'nonexistent app: {}'.format(registrator_app))
 
 
+def _share_equal_strings(data, string_pool):
+    """
+    Args:
+        data (object): Structure of dicts and lists loaded from YAML.
+        string_pool (dict[str,str]): Strings already encountered in data.
+
+    Returns:
+        object: Equal data in which all equal long strings are the same object.
+    """
+    if isinstance(data, basestring):
+        if len(data) >= SHARED_STRING_MIN_LENGTH:
+            return string_pool.setdefault(data, data)
+        return data
+    elif isinstance(data, dict):
+        return {key: _share_equal_strings(value, string_pool) for key, value in data.iteritems()}
+    elif isinstance(data, list):
+        return [_share_equal_strings(value, string_pool) for value in data]
+    return data
+
+
+class _AppStackIndex(object): # pylint: disable=too-few-public-methods
+    """Lookup tables for applications and services of an appstack.
+
+    Attributes:
+        apps_by_name (dict[str,`AppConfig`]): Applications by their names.
+        apps_by_artifact (dict[str,list[`AppConfig`]]): Applications by their artifact names.
+        service_providers (dict[str,`AppConfig`]): Applications by names of services they provide.
+        service_consumers (dict[str,list[`AppConfig`]]): Applications by names of services
+            they use.
+        registered_apps (dict[str,list[`AppConfig`]]): Applications by names of the apps they need
+            to be registered in.
+        global_services (set[str]): Names of standalone user-provided services and instances
+            of standalone brokers.
+        services_provided_twice (set[str]): Names of services provided by more than one app.
+    """
+
+    def __init__(self, appstack):
+        self.apps_by_name = {}
+        self.apps_by_artifact = {}
+        self.service_providers = {}
+        self.service_consumers = {}
+        self.registered_apps = {}
+        self.services_provided_twice = set()
+        self.global_services = {service.name for service in appstack.user_provided_services}
+        for broker in appstack.brokers:
+            self.global_services.update(instance.name for instance in broker.service_instances)
+
+        for app in appstack.apps:
+            self.apps_by_name[app.name] = app
+            self.apps_by_artifact.setdefault(app.artifact_name, []).append(app)
+            if app.register_in:
+                self.registered_apps.setdefault(app.register_in, []).append(app)
+            for service_name in app.app_properties.get('services', []):
+                self.service_consumers.setdefault(service_name, []).append(app)
+            for service in app.user_provided_services:
+                self._add_service_provider(service.name, app)
+            if app.broker_config:
+                for service_instance in app.broker_config.service_instances:
+                    self._add_service_provider(service_instance.name, app)
+
+    def _add_service_provider(self, service_name, app):
+        if service_name in self.service_providers:
+            self.services_provided_twice.add(service_name)
+            return
+        _log.debug('Marking app %s as provider for service %s', app.name, service_name)
+        self.service_providers[service_name] = app
+
+
 class MalformedAppStackError(Exception):
     """
     Appstack YAML was malformed.
@@ -213,7 +529,9 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
             consideration.
     """
 
-    _to_dict_filters = [lambda key, _: key in ['is_ordered']]
+    _serialized_fields = ('name', 'app_properties', 'user_provided_services', 'broker_config',
+                          'artifact_name', 'register_in', 'push_options', 'order')
+    __slots__ = _serialized_fields + ('is_ordered',)
 
     def __init__(self, name, app_properties=None,   # pylint: disable=too-many-arguments
                  user_provided_services=None, broker_config=None, artifact_name=None,
@@ -256,7 +574,7 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
         init_dict[upsis] = [UserProvidedService(**service_params)
                             for service_params in app_config_dict.get(upsis, [])]
         init_dict[push_options] = PushOptions(**app_config_dict.get(push_options, {}))
-        if broker_config in app_config_dict:
+        if app_config_dict.get(broker_config):
             init_dict[broker_config] = BrokerConfig.from_dict(
                 app_config_dict[broker_config])
 
@@ -272,10 +590,10 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
                 "memory") taken from it's "manifest.yml".
 
         Returns:
-            `AppConfig`: Application's config expanded by its manifest.
+            `AppConfig`: Application's config expanded by its manifest. It shares all the fields
+                that weren't changed by the merge with this config.
         """
-        merged_config = copy.deepcopy(self)
-        merged_app_properties = merged_config.app_properties
+        merged_app_properties = dict(self.app_properties)
 
         for key, value in app_manifest.items():
             # TODO if value in manifest has different type than in config raise an error
@@ -293,7 +611,7 @@ class AppConfig(DataContainer): # pylint: disable=too-many-instance-attributes
         if 'name' not in merged_app_properties:
             merged_app_properties['name'] = self.name
 
-        return merged_config
+        return self.copy(app_properties=merged_app_properties)
 
     # TODO add a function that expands the config with default CF parameters
     # those will only affect app_properties
@@ -307,6 +625,9 @@ class PushOptions(DataContainer):
         post_command (str): Shell command that will be run after pushing the application.
     """
 
+    __slots__ = ('params', 'post_command')
+    _serialized_fields = __slots__
+
     def __init__(self, params='', post_command=None):
         self.params = params
         self.post_command = post_command
@@ -324,6 +645,9 @@ class BrokerConfig(DataContainer):
             broker.
     """
 
+    __slots__ = ('name', 'url', 'auth_username', 'auth_password', 'service_instances')
+    _serialized_fields = __slots__
+
     def __init__(self, name, url,  # pylint: disable=too-many-arguments
                  auth_username, auth_password, service_instances=None):
         # TODO validate the fields
@@ -361,6 +685,9 @@ class ServiceInstance(DataContainer):
             broker.
     """
 
+    __slots__ = ('name', 'plan', 'label')
+    _serialized_fields = __slots__
+
     def __init__(self, name, plan, label=None):
         # TODO validate the fields
         self.name = name
@@ -377,6 +704,9 @@ class UserProvidedService(DataContainer):
             environment when binding the service.
     """
 
+    __slots__ = ('name', 'credentials')
+    _serialized_fields = __slots__
+
     def __init__(self, name, credentials):
         # TODO validate the fields
         self.name = name
@@ -18,32 +18,44 @@
 Appstack expansion - adding application manifests and sorting in deployment order.
 """
 
-from contextlib import contextmanager
+from collections import namedtuple
+import hashlib
 import itertools
+import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 from os import path
 import zipfile
 
-import yaml
-
+from . import variable_index, yaml_codec
 from .app_file import get_artifact_name
 from .appstack import AppConfig, AppStack, MalformedAppStackError
-
-# Code doing the deployment from a release package (already containing an expanded appstack)
-# has to be compatible with Python 2.6 - networkx is not compatible with it but it won't have to
-# be used.
-try:
-    import networkx
-finally:
-    pass
+from .dependency_graph import DependencyGraph
 
 _log = logging.getLogger(__name__) # pylint: disable=invalid-name
 
+MANIFEST_FILE_NAME = 'manifest.yml'
+MANIFEST_READING_WORKERS = 8
+DEPENDENCY_GRAPH_FILE = 'app_dependencies_graph.xml'
+EXPANSION_CACHE_SUFFIX = '.cache'
+EXPANSION_CACHE_VERSION = 3
+
+# Manifest of an application read from its artifact.
+# "digest" is a hash of manifest file's content, "fields" are application's fields from manifest.
+ArtifactManifest = namedtuple('ArtifactManifest', ['digest', 'fields'])
+
+# Manifests read from artifacts, by (path, size, modification time) of the artifact.
+_manifest_cache = {} # pylint: disable=invalid-name
+
 
 def expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path):
     """Creates an expanded appstack, that is appstack with merged app manifests and also
     sorted in the order in which the applications should be deployed.
+    Results of the expansion are cached next to the expanded appstack file, together with an index
+    of the places using each template variable (see `apployer.variable_index`).
+    Running the expansion again re-merges only the apps whose manifests have changed and re-sorts
+    the apps only if their dependencies have changed.
 
     Args:
         appstack_file_path (str): Location of appstack configuration file.
@@ -51,21 +63,162 @@ def expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_pa
         expanded_appstack_path (str): Where to store expanded appstack file.
     """
     with open(appstack_file_path) as appstack_file:
-        appstack_dict = yaml.load(appstack_file)
-        appstack = AppStack.from_appstack_dict(appstack_dict)
-    manifests = _get_artifact_manifests(artifacts_location)
+        appstack_content = appstack_file.read()
+    appstack = AppStack.from_appstack_dict(yaml_codec.load(appstack_content))
+    appstack_hash = hashlib.sha1(appstack_content).hexdigest()
+
+    cache_path = expanded_appstack_path + EXPANSION_CACHE_SUFFIX
+    cache = _load_expansion_cache(cache_path)
+    if cache['appstack_hash'] != appstack_hash:
+        _log.debug('Appstack file has changed since the last expansion, ignoring cached apps.')
+        cache['merged_apps'] = {}
+    _manifest_cache.update(cache['manifests'])
+    artifact_manifests = _read_artifact_manifests(artifacts_location)
 
     _log.info('Expanding appstack with application manifests...')
-    merged_appstack = appstack.merge_manifests(manifests)
-    expanded_appstack = _sort_appstack(merged_appstack)
+    merged_appstack = _merge_manifests(appstack, artifact_manifests, cache['merged_apps'])
+    app_dependencies = _get_app_dependencies(merged_appstack)
+    expanded_appstack = _sort_appstack_incrementally(merged_appstack, app_dependencies, cache)
+
+    _save_expanded_appstack(expanded_appstack, expanded_appstack_path)
 
+    _save_expansion_cache(cache_path, {
+        'version': EXPANSION_CACHE_VERSION,
+        'appstack_hash': appstack_hash,
+        'manifests': _get_cached_manifests(artifacts_location),
+        'merged_apps': {app.name: (_get_manifest_digest(app, artifact_manifests), app)
+                        for app in expanded_appstack.apps},
+        'app_dependencies': app_dependencies,
+        'sorted_app_names': [app.name for app in expanded_appstack.apps],
+    })
+
+
+def _save_expanded_appstack(expanded_appstack, expanded_appstack_path):
+    expanded_appstack_dict = expanded_appstack.to_dict()
     with open(expanded_appstack_path, 'w') as expanded_appstack_file:
         _log.info('Saving expanded appstack file to %s', path.abspath(expanded_appstack_path))
-        yaml.dump(
-            expanded_appstack.to_dict(),
-            expanded_appstack_file,
-            default_flow_style=False,
-            width=1000)
+        yaml_codec.dump(expanded_appstack_dict, expanded_appstack_file)
+    variable_index.save_variable_index(variable_index.build_variable_index(expanded_appstack_dict),
+                                       expanded_appstack_path)
+
+
+def _merge_manifests(appstack, artifact_manifests, cached_apps):
+    """Merges manifests of individual apps into appstack configuration, creating a new one.
+    Apps merged with the same manifests before are taken from the cache.
+
+    Args:
+        appstack (`AppStack`): Appstack without merged manifests.
+        artifact_manifests (dict[str,`ArtifactManifest`]): Manifests by artifact names.
+        cached_apps (dict[str,(str,`AppConfig`)]): Merged applications from the previous
+            expansion of the same appstack, by names. Each one is paired with the digest of the
+            manifest it was merged with.
+
+    Returns:
+        `AppStack`: Appstack with merged manifests.
+    """
+    apps = []
+    changed_app_names = []
+    for app in appstack.apps:
+        manifest_digest = _get_manifest_digest(app, artifact_manifests)
+        if app.name in cached_apps and cached_apps[app.name][0] == manifest_digest:
+            apps.append(cached_apps[app.name][1])
+        else:
+            changed_app_names.append(app.name)
+            apps.append(app)
+    if not changed_app_names:
+        return appstack.copy(apps=apps)
+    _log.debug('Merging manifests of apps: %s', ', '.join(changed_app_names))
+
+    changed_apps_appstack = appstack.copy(apps=[app for app in apps
+                                                if app.name in set(changed_app_names)])
+    merged_apps = changed_apps_appstack.merge_manifests(
+        {artifact_name: manifest.fields
+         for artifact_name, manifest in artifact_manifests.items()}).apps
+    merged_apps_by_name = {app.name: app for app in merged_apps}
+    return appstack.copy(apps=[merged_apps_by_name.get(app.name, app) for app in apps])
+
+
+def _sort_appstack_incrementally(appstack, app_dependencies, cache):
+    """Sorts the appstack, reusing the order from the previous expansion if the apps and their
+    dependencies haven't changed.
+
+    Args:
+        appstack (`AppStack`): Appstack with merged manifests.
+        app_dependencies (dict[str,list[str]]): Result of `_get_app_dependencies` for the appstack.
+        cache (dict): Cached results of the previous expansion.
+
+    Returns:
+        `AppStack`: Appstack with applications sorted in order they should be deployed.
+    """
+    if cache['merged_apps'] and app_dependencies == cache['app_dependencies']:
+        _log.info("Apps' dependencies haven't changed, reusing the previous deployment order.")
+        return appstack.copy(apps=[appstack.get_app(name) for name in cache['sorted_app_names']])
+    return _sort_appstack(appstack, app_dependencies)
+
+
+def _get_manifest_digest(app, artifact_manifests):
+    manifest = artifact_manifests.get(app.artifact_name)
+    return manifest.digest if manifest else None
+
+
+def _load_expansion_cache(cache_path):
+    """
+    Args:
+        cache_path (str): Path to the file with cached results of the previous expansion.
+
+    Returns:
+        dict: Cached results of the previous expansion. Contains empty values if there's no
+            usable cache.
+    """
+    empty_cache = {
+        'version': EXPANSION_CACHE_VERSION,
+        'appstack_hash': None,
+        'manifests': {},
+        'merged_apps': {},
+        'app_dependencies': {},
+        'sorted_app_names': [],
+    }
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        if not isinstance(cache, dict) or cache.get('version') != EXPANSION_CACHE_VERSION:
+            _log.debug('Expansion cache %s is in an unsupported format.', cache_path)
+            return empty_cache
+        cache['manifests'] = {
+            (zip_path, size, mtime): ArtifactManifest(digest, fields) if digest else None
+            for zip_path, size, mtime, digest, fields in cache['manifests']}
+        cache['merged_apps'] = {name: (digest, AppConfig.from_dict(app_dict))
+                                for name, (digest, app_dict) in cache['merged_apps'].items()}
+    except Exception as ex: # pylint: disable=broad-except
+        _log.debug("Can't use expansion cache %s: %s", cache_path, ex)
+        return empty_cache
+    return cache
+
+
+def _get_cached_manifests(artifacts_path):
+    """
+    Args:
+        artifacts_path (str): Path to directory containing application artifacts.
+
+    Returns:
+        dict: Entries of the manifest cache for the current artifacts from the directory. Only those
+            are saved, so the cache doesn't grow with every build of the artifacts.
+    """
+    cache_keys = [_get_manifest_cache_key(zip_path) for zip_path in _list_artifacts(artifacts_path)]
+    return {key: _manifest_cache[key] for key in cache_keys if key in _manifest_cache}
+
+
+def _save_expansion_cache(cache_path, cache):
+    """Saves the cache as JSON, so that loading it can't execute any code.
+    Apps keep their empty fields, so that they're the same when loaded (e.g. "order: 0")."""
+    cache = dict(
+        cache,
+        manifests=[list(key) + (list(manifest) if manifest else [None, None])
+                   for key, manifest in sorted(cache['manifests'].items())],
+        merged_apps={name: (digest, app.to_dict(skip_empty=False))
+                     for name, (digest, app) in cache['merged_apps'].items()})
+    with open(cache_path, 'w') as cache_file:
+        json.dump(cache, cache_file)
 
 
 def _get_artifact_manifests(artifacts_path):
@@ -79,173 +232,164 @@ def _get_artifact_manifests(artifacts_path):
         dict[str,dict]: Mapping of artifact name to manifest's fields,
             e.g. 'app_A': {'memory': '64M', 'command': './app_A'}
     """
-    artifacts_path = path.abspath(artifacts_path)
-    _log.info('Getting manifests from application zips in %s', artifacts_path)
-    manifest_file_name = 'manifest.yml'
-    manifests = {}
-    zip_names = [name for name in os.listdir(artifacts_path) if name.endswith('.zip')]
-    for zip_name in zip_names:
-        zip_file = zipfile.ZipFile(path.join(artifacts_path, zip_name))
-        if manifest_file_name not in zip_file.namelist():
-            _log.debug("%s doesn't contain %s", zip_name, manifest_file_name)
-            continue
+    return {artifact_name: manifest.fields for artifact_name, manifest
+            in _read_artifact_manifests(artifacts_path).items()}
 
-        manifest_path = zip_file.extract(manifest_file_name)
-        with open(manifest_path) as manifest_file:
-            manifest_file_dict = yaml.load(manifest_file)
-        os.remove(manifest_path)
 
-        artifact_name = get_artifact_name(zip_name)
+def _read_artifact_manifests(artifacts_path):
+    """Reads application manifests from artifacts residing under the given path.
+    All zip files will be interpreted as artifacts.
+    Manifests are read from the artifacts in parallel.
+
+    Args:
+        artifacts_path (str): Path to directory containing application artifacts.
+
+    Returns:
+        dict[str,`ArtifactManifest`]: Mapping of artifact name to its manifest.
+    """
+    _log.info('Getting manifests from application zips in %s', path.abspath(artifacts_path))
+    zip_paths = _list_artifacts(artifacts_path)
+
+    pool = ThreadPool(max(1, min(MANIFEST_READING_WORKERS, len(zip_paths))))
+    try:
+        manifests = pool.map(_read_artifact_manifest, zip_paths)
+    finally:
+        pool.close()
+        pool.join()
+
+    artifact_manifests = {}
+    for zip_path, manifest in zip(zip_paths, manifests):
+        if manifest is None:
+            continue
+        artifact_name = get_artifact_name(zip_path)
         _log.debug('Got manifest from artifact: %s', artifact_name)
-        # Manifest file can theoretically contain more than one app definition, but our apps
-        # have only themselves in their manifests.
-        manifests[artifact_name] = manifest_file_dict['applications'][0]
-    return manifests
+        artifact_manifests[artifact_name] = manifest
+    return artifact_manifests
 
 
-def _sort_appstack(appstack): #pylint: disable=too-many-locals
+def _list_artifacts(artifacts_path):
     """
-    Sorts the appstack so that applications and services can be successfully deployed going from
-    first to last in "apps" and "user_provided_services" lists.
-    :param `AppStack` appstack: The appstack to sort.
-    :return: A new appstack with applications sorted in order they should be deployed.
-    :rtype: `AppStack`
+    Args:
+        artifacts_path (str): Path to directory containing application artifacts.
+
+    Returns:
+        list[str]: Sorted absolute paths of the artifacts (zip files) in the directory.
     """
+    artifacts_path = path.abspath(artifacts_path)
+    return [path.join(artifacts_path, name) for name in sorted(os.listdir(artifacts_path))
+            if name.endswith('.zip')]
 
-    app_graph = networkx.DiGraph()
-    service_providers = {}
 
-    for app in appstack.apps:
-        _log.debug('Adding app to dependency graph: %s', app.name)
-        app_graph.add_node(app)
-        # add exposed services to providers dictionary (service depends on app)
-        for service in app.user_provided_services:
-            _map_service_provider(service, app, service_providers)
-        if app.broker_config:
-            for service_instance in app.broker_config.service_instances:
-                _map_service_provider(service_instance, app, service_providers)
-        # add names of required services to graph (app depends on service)
-        for service_name in app.app_properties.get('services', []):
-            app_graph.add_edge(app, service_name)
-
-    final_graph = _substitute_services(
-        app_graph,
-        service_providers,
-        appstack.user_provided_services,
-        appstack.brokers)
-    _dump_graph(final_graph)
-    _detect_cycles(final_graph)
-
-    deployment_sequences = _get_app_deployment_sequences(final_graph)
-    sorted_apps = list(itertools.chain(*deployment_sequences))
-    final_sorted_apps = _apply_app_order_parameter(sorted_apps)
+def _get_manifest_cache_key(zip_path):
+    """
+    Returns:
+        tuple: Path, size and modification time of the artifact.
+    """
+    artifact_stat = os.stat(zip_path)
+    return zip_path, artifact_stat.st_size, artifact_stat.st_mtime
 
-    sorted_appstack = appstack.copy()
-    sorted_appstack.apps = final_sorted_apps
-    return sorted_appstack
 
+def _read_artifact_manifest(zip_path):
+    """Reads the manifest of an application straight from its artifact, without extracting it.
+    Manifests are cached by path, size and modification time of the artifact.
 
-def _substitute_services(
-        app_graph,
-        service_providers,
-        global_user_provided_services,
-        global_brokers):
-    """
-    All edges in the graph are from an app to a service.
-    This function creates a new graph in which apps are linked to the provider of the service
-    they depend on (which is another application).
-    :param `networkx.DiGraph` app_graph:
-    :param dict[str,`AppConfig`] service_providers: Links service name and the application
-        that provides it.
-    :param list[dict] global_user_provided_services: List of standalone user provided services
-        defined in the appstack.
-    :param list[dict] global_brokers: List of brokers that aren't created from applications
-        defined in appstack.
-    :return: A new graph containing only links between applications.
+    Args:
+        zip_path (str): Path to the artifact.
+
+    Returns:
+        `ArtifactManifest`: The manifest or None if the artifact doesn't contain one.
     """
-    global_broker_instances = itertools.chain(
-        *[broker.service_instances for broker in global_brokers])
-    global_broker_instances_names = [instance.name for instance in global_broker_instances]
-    global_user_instances_names = [instance.name for instance in global_user_provided_services]
-    global_instance_names = set(global_broker_instances_names + global_user_instances_names)
-    final_graph = app_graph.copy()
-    service_nodes = []
-
-    for dependency in app_graph.edges():
-        service_name = dependency[1]
-        service_nodes.append(service_name)
-
-        if service_name in service_providers:
-            final_graph.add_edge(dependency[0], service_providers[service_name])
-            _log.debug('Marked dependency of %s on %s through service %s.',
-                       dependency[0].name, service_providers[service_name].name, service_name)
-        elif service_name in global_instance_names:
-            # We don't care about this edge since all global user provided services will
-            # be created before first application is deployed.
-            pass
+    cache_key = _get_manifest_cache_key(zip_path)
+    if cache_key not in _manifest_cache:
+        with zipfile.ZipFile(zip_path) as zip_file:
+            try:
+                manifest_content = zip_file.read(MANIFEST_FILE_NAME)
+            except KeyError:
+                _log.debug("%s doesn't contain %s", zip_path, MANIFEST_FILE_NAME)
+                manifest_content = None
+        if manifest_content:
+            # Manifest file can theoretically contain more than one app definition, but our apps
+            # have only themselves in their manifests.
+            _manifest_cache[cache_key] = ArtifactManifest(
+                hashlib.sha1(manifest_content).hexdigest(),
+                yaml_codec.load(manifest_content)['applications'][0])
         else:
-            raise MalformedAppStackError("Service instance isn't defined anywhere: " + service_name)
-
-    final_graph.remove_nodes_from(service_nodes)
-    return final_graph
+            _manifest_cache[cache_key] = None
+    return _manifest_cache[cache_key]
 
 
-def _get_app_deployment_sequences(graph):
+def _sort_appstack(appstack, app_dependencies=None):
     """
-    :param `networkx.DiGraph` graph:
-    :return: Lists of applications that may be deployed in parallel.
-    First list needs to be deployed first, the second one after that, etc.
-    :rtype: list[list[`AppConfig`]]
+    Sorts the appstack so that applications and services can be successfully deployed going from
+    first to last in "apps" and "user_provided_services" lists.
+    :param `AppStack` appstack: The appstack to sort.
+    :param dict[str,list[str]] app_dependencies: Result of `_get_app_dependencies` for the
+        appstack, if it's already known.
+    :return: A new appstack with applications sorted in order they should be deployed.
+    :rtype: `AppStack`
     """
-    deployment_sequences = []
-    while graph:
-        leaves = [component for component, dep_num in graph.out_degree_iter() if dep_num == 0]
-        deployment_sequences.append(leaves)
-        graph.remove_nodes_from(leaves)
-    return deployment_sequences
+    if app_dependencies is None:
+        app_dependencies = _get_app_dependencies(appstack)
+    app_graph = DependencyGraph(app_dependencies)
+    _dump_graph(app_graph)
+    _detect_cycles(app_graph)
+
+    deployment_sequences = app_graph.get_levels()
+    sorted_apps = [appstack.get_app(name) for name in itertools.chain(*deployment_sequences)]
+    final_sorted_apps = _apply_app_order_parameter(sorted_apps)
+
+    return appstack.copy(apps=final_sorted_apps)
 
 
-def _map_service_provider(service_instance, app, service_providers):
+def _get_app_dependencies(appstack):
     """
-    Marks that a service is provided by an application.
+    Links apps to the providers of the services they depend on (which are other applications).
+    Services provided by standalone user-provided services and brokers aren't taken into account,
+    because they will be created before first application is deployed.
+    :param `AppStack` appstack: The appstack.
+    :return: Names of the applications that each application (by name) depends on.
+    :rtype: dict[str,list[str]]
+    :raises `MalformedAppStackError`: When some app requires a service that isn't defined anywhere
+        or when the same service is provided by more than one app.
     """
-    service_name = service_instance.name
-    if service_name not in service_providers:
-        service_providers[service_name] = app
-        _log.debug('Marking app %s as provider for service %s', app.name, service_name)
-    else:
-        raise MalformedAppStackError('The same service defined twice: ' + service_name)
+    services_provided_twice = appstack.get_services_provided_twice()
+    if services_provided_twice:
+        raise MalformedAppStackError('The same service defined twice: ' +
+                                     ', '.join(services_provided_twice))
+    app_dependencies = {}
+    for app in appstack.apps:
+        dependency_names = set()
+        for service_name in app.app_properties.get('services', []):
+            provider = appstack.get_service_provider(service_name)
+            if provider:
+                dependency_names.add(provider.name)
+                _log.debug('Marked dependency of %s on %s through service %s.',
+                           app.name, provider.name, service_name)
+            elif not appstack.is_global_service(service_name):
+                raise MalformedAppStackError("Service instance isn't defined anywhere: " +
+                                             service_name)
+        app_dependencies[app.name] = sorted(dependency_names)
+    return app_dependencies
 
 
 def _detect_cycles(graph):
     """
     Detects cycles in graph and raises exception when it finds one.
+    :param `DependencyGraph` graph: Graph of dependencies between applications.
     """
-    cycles = list(networkx.algorithms.simple_cycles(graph))
+    cycles = graph.find_cycles()
     if cycles:
-        with _simple_app_config_repr():
-            raise MalformedAppStackError("Appstack can't be reliably deployed, because there "
-                                         "are cycles in app dependencies: " + str(cycles))
+        raise MalformedAppStackError("Appstack can't be reliably deployed, because there "
+                                     "are cycles in app dependencies: " +
+                                     ', '.join('[{}]'.format(', '.join(cycle)) for cycle in cycles))
 
 
 def _dump_graph(graph):
     """
     Dumps the graph in GraphML format to a file.
     """
-    dump_file = 'app_dependencies_graph.xml'
-    _log.info("Dumping apps' dependencies graph to %s", path.realpath(dump_file))
-    with _simple_app_config_repr():
-        networkx.write_graphml(graph, dump_file)
-
-
-@contextmanager
-def _simple_app_config_repr():
-    app_config_repr = AppConfig.__repr__
-    try:
-        AppConfig.__repr__ = lambda self: self.name
-        yield
-    finally:
-        AppConfig.__repr__ = app_config_repr
+    _log.info("Dumping apps' dependencies graph to %s", path.realpath(DEPENDENCY_GRAPH_FILE))
+    graph.write_graphml(DEPENDENCY_GRAPH_FILE)
 
 
 def _apply_app_order_parameter(sorted_apps):
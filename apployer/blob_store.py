@@ -0,0 +1,188 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Storage of large configuration values (like base64-encoded archives and keytabs) outside of
+the filled appstack.
+Each value is saved once in a file named after its SHA-256 digest. Appstack contains only
+references to them ("apployer-blob:<digest>"), which are resolved when the real value is needed,
+e.g. when writing application's manifest.
+The blob store of a filled appstack is the directory next to it, with ".blobs" suffix. Blobs
+contain secrets (keytabs, certificates, etc.), so only their owner can read them.
+"""
+
+import hashlib
+import logging
+import os
+from os import path
+import re
+
+_log = logging.getLogger(__name__) # pylint: disable=invalid-name
+
+BLOB_REFERENCE_PREFIX = 'apployer-blob:'
+BLOB_STORE_SUFFIX = '.blobs'
+# Values shorter than that are kept in the appstack.
+MIN_BLOB_SIZE = 4096
+
+_BLOB_REFERENCE_REGEX = re.compile(re.escape(BLOB_REFERENCE_PREFIX) + '([0-9a-f]{64})')
+
+# Contents of the blobs already read, by (blob store path, digest).
+_blob_cache = {} # pylint: disable=invalid-name
+# Path to the blob store used when no other is given, see `set_store_path`.
+_store_path = None # pylint: disable=invalid-name
+
+
+def get_store_path(appstack_path):
+    """
+    Args:
+        appstack_path (str): Path to a filled appstack file.
+
+    Returns:
+        str: Path to the blob store of the appstack.
+    """
+    return appstack_path + BLOB_STORE_SUFFIX
+
+
+def set_store_path(store_path):
+    """Sets the blob store used by the functions of this module when they're not given one.
+    It should be the store of the appstack being deployed.
+
+    Args:
+        store_path (str): Path to the directory of the blob store.
+    """
+    global _store_path # pylint: disable=global-statement,invalid-name
+    _store_path = path.abspath(store_path)
+
+
+def _get_store_path(store_path):
+    if store_path:
+        return store_path
+    if _store_path is None:
+        raise IOError("Appstack references blobs, but the blob store to read them from isn't set.")
+    return _store_path
+
+
+def store_blob(value, store_path=None):
+    """Saves a value in the blob store.
+
+    Args:
+        value (str): The value.
+        store_path (str): Path to the directory of the blob store (the one set with
+            `set_store_path` by default).
+
+    Returns:
+        str: Reference to the blob that can be put in place of the value.
+    """
+    store_path = _get_store_path(store_path)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    digest = hashlib.sha256(value).hexdigest()
+    blob_path = path.join(store_path, digest)
+    if not path.exists(blob_path):
+        if not path.isdir(store_path):
+            os.makedirs(store_path, 0700)
+        _log.debug('Saving blob %s (%s bytes).', digest, len(value))
+        # the blob appears under its final name only when it's complete
+        temp_blob_path = '{}.{}.tmp'.format(blob_path, os.getpid())
+        blob_fd = os.open(temp_blob_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(blob_fd, 'wb') as blob_file:
+            blob_file.write(value)
+        os.rename(temp_blob_path, blob_path)
+    return BLOB_REFERENCE_PREFIX + digest
+
+
+def store_large_values(config, store_path=None, min_size=MIN_BLOB_SIZE):
+    """Moves large string values of a configuration to the blob store.
+
+    Args:
+        config (dict): Configuration variables.
+        store_path (str): Path to the directory of the blob store (the one set with
+            `set_store_path` by default).
+        min_size (int): Values at least that long will be moved to the store.
+
+    Returns:
+        dict: Configuration with large values replaced with blob references.
+    """
+    stored_config = {}
+    for key, value in config.iteritems():
+        if isinstance(value, basestring) and len(value) >= min_size:
+            _log.debug('Moving value of %s to the blob store.', key)
+            value = store_blob(value, store_path)
+        stored_config[key] = value
+    return stored_config
+
+
+def resolve(data, store_path=None):
+    """Replaces blob references with the values of blobs.
+
+    Args:
+        data (object): A string or a structure of dicts and lists that can contain references
+            in string values (also as a part of a longer string).
+        store_path (str): Path to the directory of the blob store (the one set with
+            `set_store_path` by default).
+
+    Returns:
+        object: Data with references resolved. Parts of it without references aren't copied.
+
+    Raises:
+        IOError: Referenced blob doesn't exist in the store.
+    """
+    if isinstance(data, basestring):
+        if BLOB_REFERENCE_PREFIX not in data:
+            return data
+        store_path = _get_store_path(store_path)
+        return _BLOB_REFERENCE_REGEX.sub(
+            lambda match: _read_blob(match.group(1), store_path), data)
+    elif isinstance(data, dict):
+        return {key: resolve(value, store_path) for key, value in data.iteritems()}
+    elif isinstance(data, list):
+        return [resolve(value, store_path) for value in data]
+    return data
+
+
+def find_missing_blobs(data, store_path):
+    """
+    Args:
+        data (object): A string or a structure of dicts and lists that can contain references
+            in string values.
+        store_path (str): Path to the directory of the blob store.
+
+    Returns:
+        list[str]: Sorted digests of the referenced blobs that aren't in the store.
+    """
+    missing_digests = set()
+    if isinstance(data, basestring):
+        missing_digests.update(digest for digest in _BLOB_REFERENCE_REGEX.findall(data)
+                               if not path.exists(path.join(store_path, digest)))
+    elif isinstance(data, dict):
+        for value in data.itervalues():
+            missing_digests.update(find_missing_blobs(value, store_path))
+    elif isinstance(data, list):
+        for value in data:
+            missing_digests.update(find_missing_blobs(value, store_path))
+    return sorted(missing_digests)
+
+
+def _read_blob(digest, store_path):
+    cache_key = (path.realpath(store_path), digest)
+    if cache_key not in _blob_cache:
+        blob_path = path.join(store_path, digest)
+        try:
+            with open(blob_path, 'rb') as blob_file:
+                _blob_cache[cache_key] = blob_file.read()
+        except IOError as ex:
+            raise IOError("Can't read blob {} referenced in the appstack: {}".format(digest, ex))
+    return _blob_cache[cache_key]
@@ -26,6 +26,11 @@ from subprocess import Popen, PIPE, STDOUT
 CF = 'cf'
 _log = logging.getLogger(__name__) # pylint: disable=invalid-name
 
+# Strategies for pushing applications, see `apployer.deployer.AppDeployer`.
+# They're defined here, so that the CLI can use them without importing the deployer.
+UPGRADE_STRATEGY = 'UPGRADE'
+PUSH_ALL_STRATEGY = 'PUSH_ALL'
+
 
 BuildpackDescription = namedtuple('BuildpackDescription',
                                   ['buildpack', 'position', 'enabled', 'locked', 'filename'])
@@ -0,0 +1,144 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Graph of dependencies between the elements of appstack.
+"""
+
+from xml.etree import ElementTree
+
+GRAPHML_NAMESPACE = 'http://graphml.graphdrawing.org/xmlns'
+
+
+class DependencyGraph(object):
+    """Directed graph in which each node points to the nodes it depends on.
+
+    Args:
+        dependencies (dict[str,list[str]]): Names of the nodes that each node (by name) depends on.
+            Nodes that appear only as dependencies are added to the graph too.
+    """
+
+    def __init__(self, dependencies):
+        self._dependencies = {}
+        self._dependents = {}
+        for node, node_dependencies in dependencies.iteritems():
+            self._add_node(node)
+            for dependency in node_dependencies:
+                self._add_node(dependency)
+                self._dependencies[node].add(dependency)
+                self._dependents[dependency].add(node)
+
+    def _add_node(self, node):
+        if node not in self._dependencies:
+            self._dependencies[node] = set()
+            self._dependents[node] = set()
+
+    @property
+    def nodes(self):
+        """list[str]: Sorted names of all nodes in the graph."""
+        return sorted(self._dependencies)
+
+    def get_levels(self):
+        """Splits the graph into levels that can be processed one after another.
+        The first level contains the nodes without dependencies, each next one - the nodes whose
+        dependencies are all on the previous levels. Nodes on each level are sorted by name.
+        Nodes that are part of a cycle (or depend on one) are not on any level.
+
+        Returns:
+            list[list[str]]: The levels.
+        """
+        unresolved_dependency_counts = {node: len(dependencies)
+                                        for node, dependencies in self._dependencies.iteritems()}
+        level = sorted(node for node, count in unresolved_dependency_counts.iteritems()
+                       if count == 0)
+        levels = []
+        while level:
+            levels.append(level)
+            next_level = []
+            for node in level:
+                for dependent in self._dependents[node]:
+                    unresolved_dependency_counts[dependent] -= 1
+                    if unresolved_dependency_counts[dependent] == 0:
+                        next_level.append(dependent)
+            level = sorted(next_level)
+        return levels
+
+    def find_cycles(self):
+        """Finds strongly connected components of the graph that contain cycles
+        (with Tarjan's algorithm, without recursion).
+
+        Returns:
+            list[list[str]]: Sorted names of the nodes forming each of the cycles.
+        """
+        indices = {}
+        low_links = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+
+        for root in self.nodes:
+            if root in indices:
+                continue
+            work = [(root, iter(sorted(self._dependencies[root])))]
+            indices[root] = low_links[root] = len(indices)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, dependencies = work[-1]
+                for dependency in dependencies:
+                    if dependency not in indices:
+                        indices[dependency] = low_links[dependency] = len(indices)
+                        stack.append(dependency)
+                        on_stack.add(dependency)
+                        work.append((dependency, iter(sorted(self._dependencies[dependency]))))
+                        break
+                    elif dependency in on_stack:
+                        low_links[node] = min(low_links[node], indices[dependency])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low_links[parent] = min(low_links[parent], low_links[node])
+                    if low_links[node] == indices[node]:
+                        component = self._pop_component(node, stack, on_stack)
+                        if len(component) > 1 or node in self._dependencies[node]:
+                            cycles.append(sorted(component))
+        return sorted(cycles)
+
+    @staticmethod
+    def _pop_component(root, stack, on_stack):
+        component = []
+        while True:
+            node = stack.pop()
+            on_stack.discard(node)
+            component.append(node)
+            if node == root:
+                return component
+
+    def write_graphml(self, file_path):
+        """Writes the graph to a file in GraphML format.
+
+        Args:
+            file_path (str): Path of the file.
+        """
+        graphml = ElementTree.Element('graphml', xmlns=GRAPHML_NAMESPACE)
+        graph = ElementTree.SubElement(graphml, 'graph', edgedefault='directed')
+        for node in self.nodes:
+            ElementTree.SubElement(graph, 'node', id=node)
+        for node in self.nodes:
+            for dependency in sorted(self._dependencies[node]):
+                ElementTree.SubElement(graph, 'edge', source=node, target=dependency)
+        ElementTree.ElementTree(graphml).write(file_path, encoding='utf-8')
@@ -19,6 +19,7 @@ Code responsible for initiating and carrying out the deployment of applications,
 brokers.
 """
 
+from contextlib import contextmanager
 import glob
 import json
 import logging
@@ -27,23 +28,22 @@ import subprocess
 from zipfile import ZipFile
 
 import datadiff
-import yaml
 
-from apployer import cf_cli, cf_api, app_file, app_compare, dry_run
-from .cf_cli import CommandFailedError
+from apployer import cf_cli, cf_api, app_file, app_compare, blob_store, dry_run, yaml_codec
+from .cf_cli import CommandFailedError, PUSH_ALL_STRATEGY, UPGRADE_STRATEGY
 
 _log = logging.getLogger(__name__) #pylint: disable=invalid-name
 
-UPGRADE_STRATEGY = 'UPGRADE'
-PUSH_ALL_STRATEGY = 'PUSH_ALL'
-
 UNPACKED_ARTIFACTS_FOLDER = 'apps'
 FINAL_MANIFESTS_FOLDER = 'manifests'
 
 DEPLOYER_OUTPUT = 'apployer_out'
+# Expected errors of deploying appstack's elements.
+_DEPLOYMENT_ERRORS = (CommandFailedError, subprocess.CalledProcessError, IOError)
 
 
-def deploy_appstack(cf_login_data, filled_appstack, artifacts_path, push_strategy, is_dry_run):
+def deploy_appstack(cf_login_data, filled_appstack, # pylint: disable=too-many-arguments
+                    artifacts_path, push_strategy, is_dry_run, full_appstack=None):
     """Deploys the appstack to Cloud Foundry.
 
     Args:
@@ -55,6 +55,9 @@ def deploy_appstack(cf_login_data, filled_appstack, artifacts_path, push_strateg
         push_strategy (str): Strategy for pushing applications.
         is_dry_run (bool): Is this a dry run? If set to True, no changes (except for creating org
             and space) will be introduced to targeted Cloud Foundry.
+        full_appstack (`apployer.appstack.AppStack`): The whole appstack, when `filled_appstack`
+            is only a part of it. Applications that the deployed apps are registered in are
+            looked up in it, so they don't need to be deployed again.
     """
     global cf_cli, register_in_application_broker #pylint: disable=C0103,W0603,W0601
     if is_dry_run:
@@ -63,15 +66,19 @@ def deploy_appstack(cf_login_data, filled_appstack, artifacts_path, push_strateg
         normal_register_in_app_broker = register_in_application_broker
         register_in_application_broker = dry_run.get_dry_function(register_in_application_broker)
     try:
-        _do_deploy(cf_login_data, filled_appstack, artifacts_path, push_strategy)
+        _do_deploy(cf_login_data, filled_appstack, artifacts_path, push_strategy,
+                   full_appstack or filled_appstack)
     finally:
         if is_dry_run:
             cf_cli = normal_cf_cli
             register_in_application_broker = normal_register_in_app_broker
 
 
-def _do_deploy(cf_login_data, filled_appstack, artifacts_path, push_strategy):
+def _do_deploy(cf_login_data, filled_appstack, # pylint: disable=too-many-locals
+               artifacts_path, push_strategy, full_appstack):
     """Actual heavy lifting of deployment.
+    Failure of an appstack element doesn't stop the deployment. Only the applications that depend
+    on it (directly or not) won't be deployed.
 
     Args:
         cf_login_data (`apployer.cf_cli.CfInfo`): Credentials and addresses needed to log into
@@ -80,42 +87,158 @@ def _do_deploy(cf_login_data, filled_appstack, artifacts_path, push_strategy):
             extracted from a live TAP environment.
         artifacts_path (str): Path to a directory containing application artifacts (zips).
         push_strategy (str): Strategy for pushing applications.
+        full_appstack (`apployer.appstack.AppStack`): Appstack that `filled_appstack` is a part of
+            (or the same appstack). Registrator applications are taken from it.
+
+    Raises:
+        DeploymentFailedError: When some elements of the appstack failed to deploy.
     """
     _prepare_org_and_space(cf_login_data)
 
+    summary = DeploymentSummary()
+    # Names of applications and of standalone services that failed or were blocked.
+    # They're kept apart, because apps and services can have the same names.
+    unavailable_apps = set()
+    unavailable_services = set()
     apps_to_restart = []
     for service in filled_appstack.user_provided_services:
-        affected_apps = UpsiDeployer(service).deploy()
-        apps_to_restart.extend(affected_apps)
+        with summary.track('user-provided service ' + service.name):
+            affected_apps = UpsiDeployer(service).deploy()
+            apps_to_restart.extend(affected_apps)
+        if not summary.last_succeeded:
+            unavailable_services.add(service.name)
 
     for broker in filled_appstack.brokers:
-        setup_broker(broker)
+        with summary.track('broker ' + broker.name):
+            setup_broker(broker)
+        if not summary.last_succeeded:
+            unavailable_services.update(instance.name for instance in broker.service_instances)
 
     for buildpack in filled_appstack.buildpacks:
-        setup_buildpack(buildpack, artifacts_path)
-
-    names_to_apps = {app.name: app for app in filled_appstack.apps}
+        with summary.track('buildpack ' + buildpack):
+            setup_buildpack(buildpack, artifacts_path)
 
     for app in filled_appstack.apps:
-        app_deployer = AppDeployer(app, DEPLOYER_OUTPUT)
-        affected_apps = app_deployer.deploy(artifacts_path, push_strategy)
-        apps_to_restart.extend(affected_apps)
-        if app.register_in:
-            # FIXME this universal mechanism is kind of pointless, because we can only do
-            # registering in application-broker. Even we made "register.sh" in the registrator app
-            # to be universal, we still need to pass a specific set of arguments to the script.
-            # And those are arguments wanted by the application-broker.
-            registrator_name = app.register_in
-            register_in_application_broker(
-                app,
-                names_to_apps[registrator_name],
-                filled_appstack.domain,
-                DEPLOYER_OUTPUT,
-                artifacts_path)
+        element_name = 'app ' + app.name
+        missing_dependencies = _get_unavailable_dependencies(
+            filled_appstack, app, unavailable_apps, unavailable_services)
+        if missing_dependencies:
+            summary.add_blocked(element_name, missing_dependencies)
+            unavailable_apps.add(app.name)
+            continue
+
+        with summary.track(element_name):
+            app_deployer = AppDeployer(app, DEPLOYER_OUTPUT)
+            affected_apps = app_deployer.deploy(artifacts_path, push_strategy)
+            apps_to_restart.extend(affected_apps)
+            if app.register_in:
+                # FIXME this universal mechanism is kind of pointless, because we can only do
+                # registering in application-broker. Even we made "register.sh" in the registrator
+                # app to be universal, we still need to pass a specific set of arguments to the
+                # script. And those are arguments wanted by the application-broker.
+                register_in_application_broker(
+                    app,
+                    full_appstack.get_app(app.register_in),
+                    filled_appstack.domain,
+                    DEPLOYER_OUTPUT,
+                    artifacts_path)
+        if not summary.last_succeeded:
+            unavailable_apps.add(app.name)
     _restart_apps(filled_appstack, apps_to_restart)
+
+    summary.log()
+    if summary.failed:
+        raise DeploymentFailedError('Failed to deploy: {}'.format(
+            ', '.join(name for name, _ in summary.failed)))
     _log.info('DEPLOYMENT FINISHED')
 
 
+def _get_unavailable_dependencies(appstack, app, unavailable_apps, unavailable_services):
+    """
+    Args:
+        appstack (`apployer.appstack.AppStack`): Appstack containing the application.
+        app (`apployer.appstack.AppConfig`): An application.
+        unavailable_apps (set[str]): Names of applications that failed to deploy or were blocked.
+        unavailable_services (set[str]): Names of standalone user-provided services and broker
+            instances that failed to deploy.
+
+    Returns:
+        list[str]: Names of the applications and services that the app depends on, but which
+            are unavailable (services are prefixed with "service ").
+    """
+    missing_dependencies = [dependency.name for dependency in appstack.get_app_dependencies(app)
+                            if dependency.name in unavailable_apps]
+    missing_dependencies.extend('service ' + service_name
+                                for service_name in app.app_properties.get('services', [])
+                                if service_name in unavailable_services)
+    return missing_dependencies
+
+
+class DeploymentFailedError(Exception):
+    """
+    Some elements of the appstack failed to deploy.
+    """
+    pass
+
+
+class DeploymentSummary(object):
+    """Outcomes of deploying the elements of an appstack.
+
+    Attributes:
+        succeeded (list[str]): Names of successfully deployed elements.
+        failed (list[(str, str)]): Names of elements that failed to deploy paired with the errors.
+        blocked (list[(str, list[str])]): Names of elements that weren't deployed paired with
+            the names of unavailable elements they depend on.
+        last_succeeded (bool): Whether the last tracked element was deployed successfully.
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self.blocked = []
+        self.last_succeeded = True
+
+    @contextmanager
+    def track(self, element_name):
+        """Records the outcome of deploying an element done in the context.
+        Errors (e.g. from Cloud Foundry CLI, failed commands or missing artifacts) are recorded
+        and don't leave the context, so the other elements can still be deployed.
+
+        Args:
+            element_name (str): Name of the deployed element.
+        """
+        try:
+            yield
+        except Exception as ex: # pylint: disable=broad-except
+            # Unexpected errors are logged with their tracebacks.
+            _log.error('Deployment of %s failed: %s', element_name, ex,
+                       exc_info=not isinstance(ex, _DEPLOYMENT_ERRORS))
+            self.failed.append((element_name, str(ex)))
+            self.last_succeeded = False
+        else:
+            self.succeeded.append(element_name)
+            self.last_succeeded = True
+
+    def add_blocked(self, element_name, missing_dependencies):
+        """Records that an element won't be deployed because of its unavailable dependencies.
+
+        Args:
+            element_name (str): Name of the element.
+            missing_dependencies (list[str]): Names of the unavailable dependencies.
+        """
+        _log.warning("Won't deploy %s, because it depends on unavailable: %s",
+                     element_name, ', '.join(missing_dependencies))
+        self.blocked.append((element_name, missing_dependencies))
+
+    def log(self):
+        """Logs the summary of the deployment."""
+        _log.info('Deployment summary:\nSucceeded (%d): %s\nFailed (%d): %s\nBlocked (%d): %s',
+                  len(self.succeeded), ', '.join(self.succeeded),
+                  len(self.failed), ', '.join(name for name, _ in self.failed),
+                  len(self.blocked), ', '.join('{} (needs {})'.format(name, ', '.join(missing))
+                                               for name, missing in self.blocked))
+
+
 def register_in_application_broker(registered_app, # pylint: disable=function-redefined
                                    application_broker, app_domain,
                                    unpacked_apps_dir, artifacts_location):
@@ -143,7 +266,7 @@ def register_in_application_broker(registered_app, # pylint: disable=function-re
                '-u', application_broker.app_properties['env']['AUTH_USER'],
                '-p', application_broker.app_properties['env']['AUTH_PASS']]
 
-    app_env = registered_app.app_properties['env']
+    app_env = blob_store.resolve(registered_app.app_properties['env'])
     display_name = app_env.get('display_name')
     if display_name:
         command.extend(['-s', display_name])
@@ -317,8 +440,8 @@ class UpsiDeployer(object):
             _log.debug(str(ex))
             _log.info("Failed to get GUID of user provided service %s, assuming it doesn't exist "
                       "yet. Gonna create it now...", service_name)
-            cf_cli.create_user_provided_service(service_name,
-                                                json.dumps(self. service.credentials))
+            cf_cli.create_user_provided_service(
+                service_name, json.dumps(blob_store.resolve(self.service.credentials)))
             _log.debug('Created user provided service %s.', service_name)
             return []
 
@@ -333,7 +456,7 @@ class UpsiDeployer(object):
                 update of this service. This list will be empty when there's nothing to restart
         """
         service_name = self.service.name
-        appstack_credentials = self.service.credentials
+        appstack_credentials = blob_store.resolve(self.service.credentials)
         live_credentials = cf_api.get_upsi_credentials(service_guid)
 
         if live_credentials != appstack_credentials:
@@ -425,11 +548,8 @@ class AppDeployer(object):
         filled_manifest_path = path.join(unpacked_path, self.FILLED_MANIFEST)
         _log.debug('Dumping filled application manifest: %s', filled_manifest_path)
         with open(filled_manifest_path, 'w') as manifest_file:
-            yaml.dump(
-                {'applications': [self.app.app_properties]},
-                manifest_file,
-                default_flow_style=False,
-                width=1000)
+            yaml_codec.dump({'applications': [blob_store.resolve(self.app.app_properties)]},
+                            manifest_file)
 
         return unpacked_path
 
@@ -489,6 +609,8 @@ def _prepare_org_and_space(cf_login_data):
 def _restart_apps(filled_appstack, app_guids):
     """Restarts applications. These apps need to be restarted because some user-provided services
     bound to them have changed.
+    Apps that aren't in the appstack (e.g. when only a part of the appstack is deployed) are
+    restarted too, because they also use the changed services.
 
     Args:
         filled_appstack (`apployer.appstack.AppStack`): Expanded appstack filled with configuration
@@ -498,8 +620,8 @@ def _restart_apps(filled_appstack, app_guids):
     app_names = [cf_api.get_app_name(app_guid) for app_guid in app_guids]
 
     for app_name in app_names:
-        app = next(app for app in filled_appstack.apps if app.name == app_name)
-        if '--no-start' not in app.push_options.params:
+        app = filled_appstack.get_app(app_name)
+        if app is None or '--no-start' not in app.push_options.params:
             _log.info("Restarting app %s because some of user-provided services bound to it have "
                       "changed...", app_name)
             cf_cli.restart(app_name)
@@ -21,11 +21,20 @@ import logging
 import os
 
 import paramiko
-import yaml
+
+from .. import yaml_codec
+
+# separates the manifests in the output of the command reading them
+MANIFESTS_DELIMITER = '#### apployer manifests delimiter ####'
 
 
 class CFConfExtractor(object):
 
+    # all variables are read from the same deployment manifests, so they're extracted together
+    PROVIDED_VARIABLES = ('nats_ip', 'h2o_provisioner_host', 'h2o_provisioner_port', 'cf_admin_password',
+                          'cf_admin_client_password', 'apps_domain', 'tap_console_password', 'email_address',
+                          'run_domain', 'smtp_pass', 'smtp_user', 'smtp_port', 'smtp_host', 'smtp_protocol')
+
     def __init__(self, config):
         self._logger = logging.getLogger(__name__)
 
@@ -74,17 +83,38 @@ class CFConfExtractor(object):
         ssh_in, ssh_out, ssh_err = self.ssh_connection.exec_command(command)
         return ssh_out.read() if ssh_out is not None else ssh_err.read()
 
-    def _extract_variables(self):
-        result = {}
+    def _get_manifests_paths(self):
         if self._path_to_cf_tiny_yml is not None and self._path_to_docker_vpc_yml is not None:
-            docker_vpc_yml = yaml.load(self.ssh_call_command('cat {0}'.format(self._path_to_docker_vpc_yml)))
-            cf_tiny_yml = yaml.load(self.ssh_call_command('cat {0}'.format(self._path_to_cf_tiny_yml)))
+            return self._path_to_docker_vpc_yml, self._path_to_cf_tiny_yml
         elif self._is_openstack:
-            docker_vpc_yml = yaml.load(self.ssh_call_command('cat ~/workspace/deployments/docker-services-boshworkspace/.deployments/docker-openstack.yml'))
-            cf_tiny_yml = yaml.load(self.ssh_call_command('cat ~/workspace/deployments/cf-boshworkspace/deployments/cf-openstack-tiny.yml'))
+            return ('~/workspace/deployments/docker-services-boshworkspace/.deployments/docker-openstack.yml',
+                    '~/workspace/deployments/cf-boshworkspace/deployments/cf-openstack-tiny.yml')
         else:
-            docker_vpc_yml = yaml.load(self.ssh_call_command('cat ~/workspace/deployments/docker-services-boshworkspace/.deployments/docker-aws-vpc.yml'))
-            cf_tiny_yml = yaml.load(self.ssh_call_command('cat ~/workspace/deployments/cf-boshworkspace/deployments/cf-aws-tiny.yml'))
+            return ('~/workspace/deployments/docker-services-boshworkspace/.deployments/docker-aws-vpc.yml',
+                    '~/workspace/deployments/cf-boshworkspace/deployments/cf-aws-tiny.yml')
+
+    def get_manifests_mtimes(self):
+        """Returns modification times of the deployment manifests the variables are read from
+        (None for the ones that don't exist)."""
+        output = self.ssh_call_command('for MANIFEST in {}; do stat -c %Y $MANIFEST 2> /dev/null || echo; done'
+                                       .format(' '.join(self._get_manifests_paths())))
+        return [int(line) if line.strip() else None for line in output.splitlines()]
+
+    def _read_manifests(self, manifests_paths):
+        # All manifests are read with a single remote command, each one is followed by the delimiter.
+        # The command stops at the first manifest that can't be read, printing the error instead.
+        output = self.ssh_call_command('set -e; ' + ' '.join(
+            'cat {0} 2>&1; echo; echo "{1}";'.format(manifest_path, MANIFESTS_DELIMITER)
+            for manifest_path in manifests_paths))
+        manifests = output.split(MANIFESTS_DELIMITER)
+        if len(manifests) != len(manifests_paths) + 1:
+            raise IOError('Cannot read configuration file {0} from the cf-bastion machine: {1}'.format(
+                manifests_paths[len(manifests) - 1], manifests[-1].strip()))
+        return [yaml_codec.load(manifest) for manifest in manifests[:-1]]
+
+    def _extract_variables(self):
+        result = {}
+        docker_vpc_yml, cf_tiny_yml = self._read_manifests(self._get_manifests_paths())
 
         if docker_vpc_yml is None or cf_tiny_yml is None:
             raise IOError("Cannot find configuration files on the cf-bastion machine.")
@@ -18,10 +18,13 @@
 #pylint: skip-file
 
 import base64
+import fnmatch
 import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
-import tempfile
+import re
+from StringIO import StringIO
 
 try:
     from sshtunnel import SSHTunnelForwarder
@@ -34,26 +37,106 @@ import yaml
 import requests
 import xml.etree.ElementTree as ET
 
-GENERATE_KEYTAB_SCRIPT = """#!/bin/sh
+CDH_MANAGER_PORT = 7180
+
+# fields of Cloudera Manager's /cm/deployment document that are needed to extract the configuration
+DEPLOYMENT_FIELDS = frozenset(['hosts', 'hostId', 'hostname', 'ipAddress', 'clusters', 'services', 'roles', 'name',
+                               'type', 'hostRef'])
+
+KERBEROS_BUNDLE_SCRIPT_PATH = '/tmp/apployer_kerberos_bundle.sh'
+BUNDLE_ENTRY_BEGIN = '--- apployer bundle entry:'
+BUNDLE_ENTRY_END = '--- apployer bundle entry end'
+BASE64_REGEX = re.compile(r'^(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?$')
+
+# Prints base64 of keytabs generated for principals and of files (arguments starting with "/"),
+# each one between delimiting lines. The ending line also has the exit status of base64, because
+# errors are printed to the same output (ssh -t merges them). All keytabs are exported in a single
+# kadmin.local session.
+KERBEROS_BUNDLE_SCRIPT = """#!/bin/sh
+
+DIR="/tmp/$(basename $0).$$"
+mkdir -m 700 "$DIR"
+COMMANDS=""
+N=0
+for ITEM in "$@"; do
+    case "$ITEM" in
+        /*)
+            ;;
+        *)
+            N=$((N + 1))
+            COMMANDS="${{COMMANDS}}xst -norandkey -k $DIR/$N.keytab $ITEM
+"
+            ;;
+    esac
+done
+if [ -n "$COMMANDS" ]; then
+    printf '%s' "$COMMANDS" | sudo kadmin.local > /dev/null 2>&1
+fi
+
+N=0
+for ITEM in "$@"; do
+    echo "{begin} $ITEM"
+    case "$ITEM" in
+        /*)
+            base64 "$ITEM"
+            ;;
+        *)
+            N=$((N + 1))
+            sudo base64 "$DIR/$N.keytab"
+            ;;
+    esac
+    echo "{end} $?"
+done
+sudo rm -rf "$DIR"
+""".format(begin=BUNDLE_ENTRY_BEGIN, end=BUNDLE_ENTRY_END)
+
+# variables with keytabs and principals they're generated for
+KEYTAB_PRINCIPALS = {
+    'hdfs_keytab_value': 'hdfs',
+    'auth_gateway_keytab_value': 'authgateway/sys',
+    'hgm_keytab_value': 'hgm/sys',
+    'vcap_keytab_value': 'vcap',
+    'sentry_keytab_value': 'hive/sys',
+}
+
+# variables with base64 of files from CDH-Manager machine
+KERBEROS_FILES = {
+    'krb5_base64': '/etc/krb5.conf',
+    'kerberos_cacert': '/var/krb5kdc/cacert.pem',
+}
 
-function tmp_file () {
-    TFILE="/tmp/$(basename $0).$$.keytab"
-echo $TFILE
+# variables with client configurations and services they're taken from
+CLIENT_CONFIG_SERVICES = {
+    'import_hadoop_conf_hdfs': 'HDFS',
+    'import_hadoop_conf_hbase': 'HBASE',
+    'import_hadoop_conf_yarn': 'YARN',
+    'import_hadoop_conf_hive': 'HIVE',
 }
 
-TMP=$(tmp_file)
-CMD=$(
-    {
-        PRINC=$@
-echo "xst -norandkey -k $TMP $PRINC"
-})
-sudo kadmin.local -q "$CMD" 2&> /dev/null
-sudo base64 $TMP
-sudo rm $TMP
-"""
+# client configs are base64-encoded while they're downloaded in chunks of that size,
+# which is a multiple of 3 so that the encoded chunks can be just concatenated
+CLIENT_CONFIG_CHUNK_SIZE = 3 * 64 * 1024
 
 
 class CdhConfExtractor(object):
+
+    # Names of the variables (can contain "*" wildcards) and extractor's methods providing them.
+    PROVIDERS = (
+        (('cloudera_manager_internal_host', 'cloudera_address', 'cloudera_port', 'cloudera_user', 'cloudera_password'),
+         '_provide_cdh_manager_conf'),
+        (('kerberos_host',), '_provide_kerberos_host'),
+        (tuple(KEYTAB_PRINCIPALS) + tuple(KERBEROS_FILES), '_provide_kerberos_data'),
+        (('sentry_port', 'sentry_address'), '_provide_sentry_conf'),
+        (('auth_gateway_profile',), '_provide_auth_gateway_profile'),
+        (('hgm_adress', 'hgm_password', 'hgm_username'), '_provide_hgm_conf'),
+        (('oozie_server',), '_provide_oozie_server'),
+        (('job_tracker',), '_provide_job_tracker'),
+        (('metastore',), '_provide_metastore'),
+        (('master_node_host_*',), '_provide_master_nodes'),
+        (('namenode_internal_host', 'hue_node', 'h2o_node', 'arcadia_node'), '_provide_nodes'),
+        (tuple(CLIENT_CONFIG_SERVICES), '_provide_client_configs'),
+    )
+
     def __init__(self, config):
         self._logger = logging.getLogger(__name__)
         self._hostname = config['machines']['cdh-launcher']['hostname']
@@ -68,6 +151,11 @@ class CdhConfExtractor(object):
         self._cdh_manager_user = config['machines']['cdh-manager']['user']
         self._cdh_manager_sshtunnel_required = config['machines']['cdh-manager']['sshtunnel_required']
         self._cdh_manager_password = config['machines']['cdh-manager']['password']
+        self._deployment = None
+        self._helper = None
+        self._session = None
+        self.ssh_connection = None
+        self._bundle_script_uploaded = False
 
     def __enter__(self):
         extractor = self
@@ -76,14 +164,16 @@ class CdhConfExtractor(object):
                 self._logger.info('Creating tunnel to CDH-Manager.')
                 extractor.create_tunnel_to_cdh_manager()
                 extractor.start_cdh_manager_tunneling()
-                self._logger.info('Tunnel to CDH-Manager has been created.')
+                self._logger.info('Tunnel to CDH-Manager has been created on {0}:{1}.'.format(self._local_bind_address, self._local_bind_port))
             else:
                 self._logger.info('Connection to CDH-Manager host without ssh tunnel.')
                 self._local_bind_address = self.extract_cdh_manager_host()
-                self._local_bind_port = 7180
+                self._local_bind_port = CDH_MANAGER_PORT
             return extractor
         except Exception as exc:
             self._logger.error('Cannot creating tunnel to CDH-Manager machine.')
+            if self.ssh_connection is not None:
+                self.close_ssh_connection()
             raise exc
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -94,6 +184,12 @@ class CdhConfExtractor(object):
         except Exception as exc:
             self._logger.error('Cannot close tunnel to CDH-Manager machine.')
             raise exc
+        finally:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            if self.ssh_connection is not None:
+                self.close_ssh_connection()
 
     # Cdh launcher methods
     def create_ssh_connection(self, hostname, username, key_filename, key_password):
@@ -104,6 +200,7 @@ class CdhConfExtractor(object):
             self.ssh_connection.connect(hostname, username=username, key_filename=key_filename, password=key_password)
             self._logger.info('Connection to host {0} established.'.format(hostname))
         except Exception as exc:
+            self.ssh_connection = None
             self._logger.error('Cannot creating connection to host {0} machine. Check your settings '
                                'in fetcher_config.yml file.'.format(hostname))
             raise exc
@@ -111,11 +208,18 @@ class CdhConfExtractor(object):
     def close_ssh_connection(self):
         try:
             self.ssh_connection.close()
+            self.ssh_connection = None
+            self._bundle_script_uploaded = False
             self._logger.info('Connection to remote host closed.')
         except Exception as exc:
             self._logger.error('Cannot close connection to the remote host.')
             raise exc
 
+    def _ensure_ssh_connection(self):
+        # one connection to cdh-launcher is kept open for all remote commands until the extractor exits
+        if self.ssh_connection is None:
+            self.create_ssh_connection(self._hostname, self._username, self._key, self._key_password)
+
     def ssh_call_command(self, command, subcommands=None):
         self._logger.info('Calling remote command: "{0}" with subcommands "{1}"'.format(command, subcommands))
         ssh_in, ssh_out, ssh_err = self.ssh_connection.exec_command(command, get_pty=True)
@@ -128,18 +232,19 @@ class CdhConfExtractor(object):
     def extract_cdh_manager_host(self):
         self._logger.info('Extracting CDH-Manager address.')
         if self._cdh_manager_ip is None:
-            self.create_ssh_connection(self._hostname, self._username, self._key, self._key_password)
+            self._ensure_ssh_connection()
             if self._is_openstack:
                 ansible_ini = self.ssh_call_command('cat ansible-cdh/platform-ansible/inventory/cdh')
             else:
                 ansible_ini = self.ssh_call_command('cat ansible-cdh/inventory/cdh')
             self._cdh_manager_ip = self._get_host_ip('cdh-manager', ansible_ini)
-            self.close_ssh_connection()
         self._logger.info('CDH-Manager adress extracted: {}'.format(self._cdh_manager_ip))
         return self._cdh_manager_ip
 
     # Cdh manager methods
-    def create_tunnel_to_cdh_manager(self, local_bind_address='localhost', local_bind_port=7180, remote_bind_port=7180):
+    def create_tunnel_to_cdh_manager(self, local_bind_address='localhost', local_bind_port=0, remote_bind_port=CDH_MANAGER_PORT):
+        # by default the system picks a free local port, so that many tunnels (from different processes or extractors)
+        # can be open at the same time; the port is known after the tunnel starts
         self._local_bind_address = local_bind_address
         self._local_bind_port = local_bind_port
         self.cdh_manager_tunnel = SSHTunnelForwarder(
@@ -154,8 +259,10 @@ class CdhConfExtractor(object):
     def start_cdh_manager_tunneling(self):
         try:
             self.cdh_manager_tunnel.start()
+            self._local_bind_port = self.cdh_manager_tunnel.local_bind_port
         except Exception as e:
-            self._logger.error('Cannot start tunnel: ' + e.message)
+            self._logger.error('Cannot start tunnel on {0}:{1}: {2}'.format(self._local_bind_address, self._local_bind_port, e))
+            raise
 
     def stop_cdh_manager_tunneling(self):
         try:
@@ -163,129 +270,238 @@ class CdhConfExtractor(object):
         except Exception as e:
             self._logger.error('Cannot stop tunnel: ' + e.message)
 
-    def extract_cdh_manager_details(self, settings):
-        for host in settings['hosts']:
-            if 'cdh-manager' in host['hostname']:
-                return host
+    def extract_cdh_manager_details(self, deployment):
+        nodes = self.extract_nodes_info('cdh-manager', deployment)
+        return nodes[0] if nodes else None
 
-    def extract_nodes_info(self, name, settings):
-        nodes = []
-        for host in settings['hosts']:
-            if name in host['hostname']:
-                nodes.append(host)
-        return nodes
+    def extract_nodes_info(self, name, deployment):
+        return deployment.find_hosts(name)
 
-    def extract_service_namenode(self, service_name, role_name, settings):
-        hdfs_service = self._find_item_by_attr_value(service_name, 'name', settings['clusters'][0]['services'])
-        hdfs_namenode = self._find_item_by_attr_value(role_name, 'name', hdfs_service['roles'])
-        host_id = hdfs_namenode['hostRef']['hostId']
-        return self._find_item_by_attr_value(host_id, 'hostId', settings['hosts'])['hostname']
+    def extract_service_namenode(self, service_name, role_name, deployment):
+        return deployment.get_role_hostname(service_name, role_name)
 
     def get_client_config_for_service(self, service_name):
-        result = requests.get('http://{0}:{1}/api/v10/clusters/CDH-cluster/services/{2}/clientConfig'.format(self._local_bind_address, self._local_bind_port, service_name))
-        return base64.standard_b64encode(result.content)
+        response = self._get_session().get('http://{0}:{1}/api/v10/clusters/CDH-cluster/services/{2}/clientConfig'
+                                           .format(self._local_bind_address, self._local_bind_port, service_name),
+                                           stream=True)
+        try:
+            return self._stream_base64(response.iter_content(CLIENT_CONFIG_CHUNK_SIZE))
+        finally:
+            response.close()
+
+    @staticmethod
+    def _stream_base64(chunks):
+        # only the encoded output and a single chunk are held in memory
+        encoded_parts = []
+        remainder = b''
+        for chunk in chunks:
+            data = remainder + chunk
+            encodable_length = len(data) - len(data) % 3
+            encoded_parts.append(base64.standard_b64encode(data[:encodable_length]))
+            remainder = data[encodable_length:]
+        encoded_parts.append(base64.standard_b64encode(remainder))
+        return ''.join(encoded_parts)
 
     def generate_keytab(self, principal_name):
-        def transfer_keytab_script(target):
-            sftp = self.ssh_connection.open_sftp()
-            with tempfile.NamedTemporaryFile('w') as f:
-                f.file.write(GENERATE_KEYTAB_SCRIPT)
-                f.file.close()
-                sftp.put(f.name, target)
-        self._logger.info('Generating keytab for {} principal.'.format(principal_name))
-        self.create_ssh_connection(self._hostname, self._username, self._key, self._key_password)
-
-        transfer_keytab_script('/tmp/generate_keytab_script.sh')
-
-        self.ssh_call_command('scp -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no /tmp/generate_keytab_script.sh {0}:/tmp/'.format(self._cdh_manager_ip))
-        self.ssh_call_command('ssh -t {0} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no "chmod 700 /tmp/generate_keytab_script.sh"'.format(self._cdh_manager_ip))
-        keytab_hash = self.ssh_call_command('ssh -t {0} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no "/tmp/generate_keytab_script.sh {1}"'
-                                            .format(self._cdh_manager_ip, principal_name))
-        self.close_ssh_connection()
-        lines = keytab_hash.splitlines()
-        self._logger.info('Keytab for {} principal has been generated.'.format(principal_name))
-        return '{}'.format(''.join(lines[2:-2]))
+        return self.generate_kerberos_bundle([principal_name])[principal_name]
 
     def generate_base64_for_file(self, file_path, hostname):
-        self._logger.info('Generating base64 for {} file.'.format(file_path))
-        self.create_ssh_connection(self._hostname, self._username, self._key, self._key_password)
-        base64_file_hash = self.ssh_call_command('ssh -t {0} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no "base64 {1}"'.format(hostname, file_path))
-        self.close_ssh_connection()
-        lines = base64_file_hash.splitlines()
-        self._logger.info('Base64 hash for {0} file on {1} machine has been generated.'.format(file_path, hostname))
-        return '{}'.format(''.join(lines[2:-2]))
+        return self.generate_kerberos_bundle([file_path])[file_path]
+
+    def generate_kerberos_bundle(self, items):
+        """Generates keytabs for principals and base64 of files (paths starting with "/") on CDH-Manager machine
+        in a single remote invocation.
+        Returns dict mapping each item to base64 of the keytab or file.
+        """
+        self._logger.info('Generating base64 of keytabs and files: {}.'.format(', '.join(items)))
+        self._ensure_ssh_connection()
+        if not self._bundle_script_uploaded:
+            self._upload_kerberos_bundle_script()
+        output = self.ssh_call_command('ssh -t {0} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no "{1} {2}"'
+                                       .format(self._cdh_manager_ip, KERBEROS_BUNDLE_SCRIPT_PATH,
+                                               ' '.join("'{}'".format(item) for item in items)))
+        bundle, errors = self._parse_kerberos_bundle(output)
+        missing_items = [item for item in items if not bundle.get(item)]
+        if missing_items:
+            raise IOError('Failed to generate base64 of {} on CDH-Manager machine: {}'.format(
+                ', '.join(missing_items),
+                '; '.join('{}: {}'.format(item, errors.get(item, 'no output')) for item in missing_items)))
+        self._logger.info('Base64 of keytabs and files has been generated.')
+        return bundle
+
+    def _upload_kerberos_bundle_script(self):
+        sftp = self.ssh_connection.open_sftp()
+        try:
+            sftp.putfo(StringIO(KERBEROS_BUNDLE_SCRIPT), KERBEROS_BUNDLE_SCRIPT_PATH)
+        finally:
+            sftp.close()
+        self.ssh_call_command('scp -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no {1} {0}:{1} && '
+                              'ssh -t {0} -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no "chmod 700 {1}"'
+                              .format(self._cdh_manager_ip, KERBEROS_BUNDLE_SCRIPT_PATH))
+        self._bundle_script_uploaded = True
+
+    @staticmethod
+    def _parse_kerberos_bundle(output):
+        """Returns base64 of the items that were successfully read and errors of the other ones, by items."""
+        bundle = {}
+        errors = {}
+        item = None
+        for line in output.replace('\r', '').splitlines():
+            if line.startswith(BUNDLE_ENTRY_END):
+                if item is not None:
+                    content = ''.join(item_lines)
+                    status = line[len(BUNDLE_ENTRY_END):].strip()
+                    if status != '0':
+                        errors[item] = 'exit status {}: {}'.format(status or 'unknown', ' '.join(item_lines))
+                    elif not BASE64_REGEX.match(content):
+                        errors[item] = 'output is not base64: {}'.format(' '.join(item_lines))
+                    else:
+                        bundle[item] = content
+                item = None
+            elif line.startswith(BUNDLE_ENTRY_BEGIN):
+                item = line[len(BUNDLE_ENTRY_BEGIN):].strip()
+                item_lines = []
+            elif item is not None:
+                item_lines.append(line.strip())
+        return bundle, errors
 
     def get_all_deployments_conf(self):
+        return self.get_deployments_conf()
+
+    @classmethod
+    def provides(cls, variable_name):
+        return any(cls._matches(variable_name, provided_names) for provided_names, _ in cls.PROVIDERS)
+
+    def get_deployments_conf(self, variable_names=None):
+        """Extracts configuration variables from CDH.
+        Only the providers of requested variables are run, so the costly ones (like keytab generation) are skipped if
+        their variables aren't needed. All variables are extracted if variable_names is None.
+        """
         result = {}
-        deployments_settings = json.loads(requests.get('http://' + self._local_bind_address + ':'
-                                                       + str(self._local_bind_port) + '/api/v10/cm/deployment',
-                                                    auth=(self._cdh_manager_user, self._cdh_manager_password)).content)
-        result['cloudera_manager_internal_host'] = self.extract_cdh_manager_details(deployments_settings)['hostname']
+        for provided_names, provider_name in self.PROVIDERS:
+            if variable_names is None:
+                requested_names = list(provided_names)
+            else:
+                requested_names = [name for name in variable_names if self._matches(name, provided_names)]
+            if requested_names:
+                self._logger.debug('Extracting {}'.format(', '.join(requested_names)))
+                result.update(getattr(self, provider_name)(requested_names))
+        return result
 
-        helper = CdhApiHelper(ApiResource(self._local_bind_address, username=self._cdh_manager_user, password=self._cdh_manager_password, version=9))
+    @staticmethod
+    def _matches(variable_name, provided_names):
+        return any(fnmatch.fnmatchcase(variable_name, provided_name) for provided_name in provided_names)
+
+    def _get_deployment(self):
+        if self._deployment is None:
+            response = self._get_session().get('http://' + self._local_bind_address + ':' + str(self._local_bind_port)
+                                               + '/api/v10/cm/deployment')
+            self._deployment = _DeploymentIndex.parse(response.content)
+        return self._deployment
+
+    def _get_session(self):
+        # one session keeps the connections through the tunnel open for all requests to CDH-Manager
+        if self._session is None:
+            self._session = requests.Session()
+            self._session.auth = (self._cdh_manager_user, self._cdh_manager_password)
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=len(CLIENT_CONFIG_SERVICES))
+            self._session.mount('http://', adapter)
+        return self._session
+
+    def _get_helper(self):
+        if self._helper is None:
+            self._helper = CdhApiHelper(ApiResource(self._local_bind_address, server_port=self._local_bind_port,
+                                                    username=self._cdh_manager_user,
+                                                    password=self._cdh_manager_password, version=9))
+        return self._helper
+
+    # providers of configuration variables, each one returns a dict of variables
+
+    def _provide_cdh_manager_conf(self, variable_names):
+        cdh_manager_host = self.extract_cdh_manager_details(self._get_deployment())['hostname']
+        return {
+            'cloudera_manager_internal_host': cdh_manager_host,
+            'cloudera_address': cdh_manager_host,
+            'cloudera_port': 7180,
+            'cloudera_user': self._cdh_manager_user,
+            'cloudera_password': self._cdh_manager_password,
+        }
+
+    def _provide_kerberos_host(self, variable_names):
+        if not self._is_kerberos:
+            return {}
+        return {'kerberos_host': self.extract_cdh_manager_details(self._get_deployment())['hostname']}
+
+    def _provide_kerberos_data(self, variable_names):
+        if not self._is_kerberos:
+            return {name: '' for name in variable_names}
+        items = {name: KEYTAB_PRINCIPALS.get(name) or KERBEROS_FILES[name] for name in variable_names}
+        bundle = self.generate_kerberos_bundle(sorted(set(items.values())))
+        return {name: bundle[item] for name, item in items.items()}
+
+    def _provide_sentry_conf(self, variable_names):
+        if not self._is_kerberos:
+            return {'sentry_port': '', 'sentry_address': ''}
+        helper = self._get_helper()
+        sentry_service = helper.get_service_from_cdh('SENTRY')
+        return {
+            'sentry_port': helper.get_entry(sentry_service, 'sentry_service_server_rpc_port'),
+            'sentry_address': helper.get_host(sentry_service),
+        }
+
+    def _provide_auth_gateway_profile(self, variable_names):
         if self._is_kerberos:
-            result['kerberos_host'] = result['cloudera_manager_internal_host']
-            result['hdfs_keytab_value'] = self.generate_keytab('hdfs')
-            result['auth_gateway_keytab_value'] = self.generate_keytab('authgateway/sys')
-            result['hgm_keytab_value'] = self.generate_keytab('hgm/sys')
-            result['vcap_keytab_value'] = self.generate_keytab('vcap')
-            result['krb5_base64'] = self.generate_base64_for_file('/etc/krb5.conf', self._cdh_manager_ip)
-            result['kerberos_cacert'] = self.generate_base64_for_file('/var/krb5kdc/cacert.pem', self._cdh_manager_ip)
-
-            sentry_service = helper.get_service_from_cdh('SENTRY')
-            result['sentry_port'] = helper.get_entry(sentry_service, 'sentry_service_server_rpc_port')
-            result['sentry_address'] = helper.get_host(sentry_service)
-            result['sentry_keytab_value'] = self.generate_keytab('hive/sys')
-            result['auth_gateway_profile'] = 'cloud,sentry-auth-gateway,zookeeper-auth-gateway,hdfs-auth-gateway,kerberos-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'
-            hgm_service = helper.get_service_from_cdh('HADOOPGROUPSMAPPING')
-            result['hgm_adress'] = 'http://' + helper.get_host(hgm_service, 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER') + ':' \
-                                   + helper.get_entry_from_group(hgm_service, 'rest_port', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE')
-            result['hgm_password'] = helper.get_entry_from_group(hgm_service, 'basic_auth_pass', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE')
-            result['hgm_username'] = helper.get_entry_from_group(hgm_service, 'basic_auth_user', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE')
-        else:
-            result['sentry_port'] = ''
-            result['sentry_address'] = ''
-            result['sentry_keytab_value'] = ''
-            result['hdfs_keytab_value'] = ''
-            result['auth_gateway_keytab_value'] = ''
-            result['vcap_keytab_value'] = ''
-            result['hgm_keytab_value'] = ''
-            result['krb5_base64'] = ''
-            result['kerberos_cacert'] = ''
-            result['auth_gateway_profile'] = 'cloud,zookeeper-auth-gateway,hdfs-auth-gateway,https-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'
-            hgm_service = helper.get_service_from_cdh('HADOOPGROUPSMAPPING')
-            result['hgm_adress'] = 'https://' + helper.get_host(hgm_service, 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER') + ':'\
-                                   + helper.get_entry_from_group(hgm_service, 'rest_port', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE')
-            result['hgm_password'] = helper.get_entry_from_group(hgm_service, 'basic_auth_pass', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE')
-            result['hgm_username'] = helper.get_entry_from_group(hgm_service, 'basic_auth_user', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE')
-
-        result['cloudera_address'] = result['cloudera_manager_internal_host']
-        result['cloudera_port'] = 7180
-        result['cloudera_user'] = self._cdh_manager_user
-        result['cloudera_password'] = self._cdh_manager_password
-
+            return {'auth_gateway_profile': 'cloud,sentry-auth-gateway,zookeeper-auth-gateway,hdfs-auth-gateway,kerberos-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'}
+        return {'auth_gateway_profile': 'cloud,zookeeper-auth-gateway,hdfs-auth-gateway,https-hgm-auth-gateway,yarn-auth-gateway,hbase-auth-gateway'}
+
+    def _provide_hgm_conf(self, variable_names):
+        helper = self._get_helper()
+        hgm_service = helper.get_service_from_cdh('HADOOPGROUPSMAPPING')
+        protocol = 'http://' if self._is_kerberos else 'https://'
+        return {
+            'hgm_adress': protocol + helper.get_host(hgm_service, 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER') + ':'
+                          + helper.get_entry_from_group(hgm_service, 'rest_port', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE'),
+            'hgm_password': helper.get_entry_from_group(hgm_service, 'basic_auth_pass', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE'),
+            'hgm_username': helper.get_entry_from_group(hgm_service, 'basic_auth_user', 'HADOOPGROUPSMAPPING-HADOOPGROUPSMAPPING_RESTSERVER-BASE'),
+        }
+
+    def _provide_oozie_server(self, variable_names):
+        helper = self._get_helper()
         oozie_server = helper.get_service_from_cdh('OOZIE')
-        result['oozie_server'] = 'http://' + helper.get_host(oozie_server) + ':' + helper.get_entry(oozie_server, 'oozie_http_port')
+        return {'oozie_server': 'http://' + helper.get_host(oozie_server) + ':' + helper.get_entry(oozie_server, 'oozie_http_port')}
 
+    def _provide_job_tracker(self, variable_names):
+        helper = self._get_helper()
         yarn = helper.get_service_from_cdh('YARN')
-        result['job_tracker'] = helper.get_host(yarn) + ':' + helper.get_entry(yarn, 'yarn_resourcemanager_address')
+        return {'job_tracker': helper.get_host(yarn) + ':' + helper.get_entry(yarn, 'yarn_resourcemanager_address')}
 
+    def _provide_metastore(self, variable_names):
+        helper = self._get_helper()
         sqoop_client = helper.get_service_from_cdh('SQOOP_CLIENT')
-        result['metastore'] = self._get_property_value(helper.get_entry(sqoop_client, 'sqoop-conf/sqoop-site.xml_client_config_safety_valve'), 'sqoop.metastore.client.autoconnect.url')
-
-        master_nodes = self.extract_nodes_info('cdh-master', deployments_settings)
-        for i, node in enumerate(master_nodes):
-            result['master_node_host_' + str(i+1)] = node['hostname']
-        result['namenode_internal_host'] = self.extract_service_namenode('HDFS', 'HDFS-NAMENODE', deployments_settings)
-        result['hue_node'] = self.extract_service_namenode('HUE', 'HUE-HUE_SERVER', deployments_settings)
-        result['h2o_node'] = self.extract_nodes_info('cdh-worker-0', deployments_settings)[0]['hostname']
-        result['arcadia_node'] = self.extract_nodes_info('cdh-worker-0', deployments_settings)[0]['hostname']
-        result['import_hadoop_conf_hdfs'] = self.get_client_config_for_service('HDFS')
-        result['import_hadoop_conf_hbase'] = self.get_client_config_for_service('HBASE')
-        result['import_hadoop_conf_yarn'] = self.get_client_config_for_service('YARN')
-        result['import_hadoop_conf_hive'] = self.get_client_config_for_service('HIVE')
-
-        return result
+        return {'metastore': self._get_property_value(helper.get_entry(sqoop_client, 'sqoop-conf/sqoop-site.xml_client_config_safety_valve'), 'sqoop.metastore.client.autoconnect.url')}
+
+    def _provide_master_nodes(self, variable_names):
+        master_nodes = self.extract_nodes_info('cdh-master', self._get_deployment())
+        return {'master_node_host_' + str(i+1): node['hostname'] for i, node in enumerate(master_nodes)}
+
+    def _provide_nodes(self, variable_names):
+        deployment = self._get_deployment()
+        worker_host = self.extract_nodes_info('cdh-worker-0', deployment)[0]['hostname']
+        return {
+            'namenode_internal_host': self.extract_service_namenode('HDFS', 'HDFS-NAMENODE', deployment),
+            'hue_node': self.extract_service_namenode('HUE', 'HUE-HUE_SERVER', deployment),
+            'h2o_node': worker_host,
+            'arcadia_node': worker_host,
+        }
+
+    def _provide_client_configs(self, variable_names):
+        pool = ThreadPool(len(variable_names))
+        try:
+            client_configs = pool.map(self.get_client_config_for_service,
+                                      [CLIENT_CONFIG_SERVICES[name] for name in variable_names])
+        finally:
+            pool.close()
+        return dict(zip(variable_names, client_configs))
 
     # helpful methods
 
@@ -295,9 +511,6 @@ class CdhConfExtractor(object):
             if property.find('name').text == key:
                 return property.find('value').text
 
-    def _find_item_by_attr_value(self, attr_value, attr_name, array_with_dicts):
-        return next(item for item in array_with_dicts if item[attr_name] == attr_value)
-
     def _get_host_ip(self, host, ansible_ini):
         host_info = []
         for line in ansible_ini.split('\n'):
@@ -310,39 +523,101 @@ class CdhConfExtractor(object):
             return yaml.load(stream)
 
 
+class _DeploymentIndex(object):
+    """Hosts, services and roles of the cluster from Cloudera Manager's /cm/deployment document, indexed for lookups.
+    Only the fields in DEPLOYMENT_FIELDS are kept, the rest of the document (configs, etc.) is dropped while parsing.
+    """
+
+    def __init__(self, deployment):
+        self._hosts = deployment.get('hosts', [])
+        self._hosts_by_id = {}
+        for host in self._hosts:
+            self._hosts_by_id.setdefault(host['hostId'], host)
+        # hosts found by name, the same names are looked up by several providers
+        self._found_hosts = {}
+        self._roles = {}
+        clusters = deployment.get('clusters') or [{}]
+        for service in clusters[0].get('services', []):
+            service_roles = self._roles.setdefault(service['name'], {})
+            for role in service.get('roles', []):
+                service_roles.setdefault(role['name'], role)
+
+    @classmethod
+    def parse(cls, document):
+        return cls(json.loads(document, object_hook=cls._strip_fields))
+
+    @staticmethod
+    def _strip_fields(json_object):
+        return {key: value for key, value in json_object.iteritems() if key in DEPLOYMENT_FIELDS}
+
+    def get_host(self, host_id):
+        return self._hosts_by_id[host_id]
+
+    def find_hosts(self, name):
+        """Returns hosts whose hostnames contain the name, in the order of the document."""
+        if name not in self._found_hosts:
+            self._found_hosts[name] = [host for host in self._hosts if name in host['hostname']]
+        return self._found_hosts[name]
+
+    def get_role_hostname(self, service_name, role_name):
+        role = self._roles[service_name][role_name]
+        return self.get_host(role['hostRef']['hostId'])['hostname']
+
+
 class CdhApiHelper(object):
+    """Access to Cloudera Manager API that fetches every piece of the cluster's topology and configuration
+    only once. Services, roles and hosts are indexed in dicts, full configs are memoized per role and role group.
+    """
 
     def __init__(self, cdhApi):
         self.cdhApi = cdhApi
+        self._services_by_type = None
+        self._roles = {}
+        self._hostnames = None
+        self._configs = {}
 
     def get_service_from_cdh(self, name):
-        cluster = self.cdhApi.get_all_clusters()[0]
+        if self._services_by_type is None:
+            cluster = self.cdhApi.get_all_clusters()[0]
+            self._services_by_type = {}
+            for service in cluster.get_all_services():
+                self._services_by_type.setdefault(service.type, service)
         try:
-            return next(service for service in cluster.get_all_services() if service.type == name)
-        except StopIteration:
+            return self._services_by_type[name]
+        except KeyError:
             raise NoCdhServiceError('No {} in CDH services.'.format(name))
 
+    def _get_roles(self, service):
+        if service.name not in self._roles:
+            roles = service.get_all_roles()
+            self._roles[service.name] = (roles, {role.name: role for role in roles})
+        return self._roles[service.name]
+
+    def _get_role(self, service, role=None):
+        roles, roles_by_name = self._get_roles(service)
+        if role is None:
+            return roles[0]
+        return roles_by_name[role]
+
     # get host ip for service or specified service role
     def get_host(self, service, role = None):
-        if role is None:
-            id = service.get_all_roles()[0].hostRef.hostId
-        else:
-            id = service.get_role(role).hostRef.hostId
-        return self.cdhApi.get_host(id).hostname
+        if self._hostnames is None:
+            self._hostnames = {host.hostId: host.hostname for host in self.cdhApi.get_all_hosts()}
+        return self._hostnames[self._get_role(service, role).hostRef.hostId]
 
     def get_entry(self, service, name):
-        sentry_config = service.get_all_roles()[0].get_config('full')
-        for config_entry in sentry_config:
-            if name == config_entry:
-                entry = sentry_config[config_entry].value or sentry_config[config_entry].default
-        return entry
+        role = self._get_role(service)
+        return self._get_config_entry(('role', service.name, role.name), role.get_config, name)
 
     def get_entry_from_group(self, service, name, group):
-        sentry_config = service.get_role_config_group(group).get_config('full')
-        for config_entry in sentry_config:
-            if name == config_entry:
-                entry = sentry_config[config_entry].value or sentry_config[config_entry].default
-        return entry
+        return self._get_config_entry(('group', service.name, group),
+                                      lambda view: service.get_role_config_group(group).get_config(view), name)
+
+    def _get_config_entry(self, config_key, get_config, name):
+        if config_key not in self._configs:
+            self._configs[config_key] = get_config('full')
+        config_entry = self._configs[config_key][name]
+        return config_entry.value or config_entry.default
 
 
 class NoCdhServiceError(Exception):
@@ -16,36 +16,130 @@
 
 """
 Deduction of some configuration variables based on those already fetched.
+Derived variables are declared with the variables they're computed from and are only computed
+when they're needed.
 """
 
+from collections import namedtuple
+
+from ..dependency_graph import DependencyGraph
+
 THRIFT_SERVER_URL = 'thrift_server_url'
 
+# A variable computed from other variables (fetched or derived).
+# Function gets the values of inputs as positional arguments, in the same order.
+DerivedVariable = namedtuple('DerivedVariable', ['name', 'inputs', 'function'])
+
+
+def _get_thrift_server_url(external_tool_arcadia, kerberos_host, kerberos_realm,
+                           namenode_internal_host, arcadia_node):
+    if not external_tool_arcadia:
+        if kerberos_host:
+            return ('jdbc:hive2://{0}:10000/default;principal=hive/{0}@{1};auth=kerberos'
+                    .format(namenode_internal_host, kerberos_realm))
+        else:
+            return 'jdbc:hive2://{}:10000/'.format(namenode_internal_host)
+    else:
+        if kerberos_host:
+            return ('jdbc:hive2://{0}:31050/;principal=arcadia-user/{0}@{1};auth=kerberos'
+                    .format(arcadia_node, kerberos_realm))
+        else:
+            return 'jdbc:hive2://{}:31050/;auth=noSasl'.format(arcadia_node)
+
 
-def deduce_final_configuration(fetched_config):
+DERIVED_VARIABLES = (
+    DerivedVariable(THRIFT_SERVER_URL,
+                    ('external_tool_arcadia', 'kerberos_host', 'kerberos_realm',
+                     'namenode_internal_host', 'arcadia_node'),
+                    _get_thrift_server_url),
+)
+
+
+def get_base_variables(variable_names, derived_variables=DERIVED_VARIABLES):
+    """
+    Args:
+        variable_names (iterable[str]): Names of needed variables.
+        derived_variables (iterable[`DerivedVariable`]): Declarations of derived variables.
+
+    Returns:
+        set[str]: Names of the variables that aren't derived, which are needed to get
+            the given variables (including the not derived ones from them).
+    """
+    derived_by_name = {variable.name: variable for variable in derived_variables}
+    base_variables = set()
+    visited = set()
+    names_to_visit = list(variable_names)
+    while names_to_visit:
+        name = names_to_visit.pop()
+        if name in visited:
+            continue
+        visited.add(name)
+        if name in derived_by_name:
+            names_to_visit.extend(derived_by_name[name].inputs)
+        else:
+            base_variables.add(name)
+    return base_variables
+
+
+def deduce_final_configuration(fetched_config, variable_names=None):
     """ Fills some variables in configuration based on those already extracted.
     Args:
         fetched_config (dict): Configuration variables extracted from a living environment,
+        variable_names (iterable[str]): Names of the variables that are needed. Only the derived
+            variables among them are computed. All derived variables are computed if it's None.
 
     Returns:
         dict: Final configuration from live environment.
     """
-    final_config = fetched_config.copy()
-    final_config[THRIFT_SERVER_URL] = _get_thrift_server_url(final_config)
-    return final_config
+    return ConfigResolver(fetched_config).resolve(variable_names)
 
 
-def _get_thrift_server_url(config):
-    if not config['external_tool_arcadia']:
-        if config['kerberos_host']:
-            return ('jdbc:hive2://{namenode_internal_host}:10000/default;'
-                    'principal=hive/{namenode_internal_host}@{kerberos_realm};'
-                    'auth=kerberos'.format(**config))
-        else:
-            return 'jdbc:hive2://{{ namenode_internal_host }}:10000/'.format(**config)
-    else:
-        if config['kerberos_host']:
-            return ('jdbc:hive2://{arcadia_node}:31050/;'
-                    'principal=arcadia-user/{arcadia_node}@{kerberos_realm};'
-                    'auth=kerberos'.format(**config))
-        else:
-            return 'jdbc:hive2://{arcadia_node}:31050/;auth=noSasl'.format(**config)
+class ConfigResolver(object):
+    """Gives values of configuration variables, computing the derived ones when they're needed.
+    Value of each derived variable is computed only once, even if several others depend on it.
+
+    Args:
+        config (dict): Values of variables that aren't derived.
+        derived_variables (iterable[`DerivedVariable`]): Declarations of derived variables.
+
+    Raises:
+        ValueError: Derived variables depend on each other in a cycle.
+    """
+
+    def __init__(self, config, derived_variables=DERIVED_VARIABLES):
+        self._config = dict(config)
+        self._derived_variables = {variable.name: variable for variable in derived_variables}
+        cycles = DependencyGraph({variable.name: variable.inputs
+                                  for variable in derived_variables}).find_cycles()
+        if cycles:
+            raise ValueError('Derived variables depend on each other in cycles: {}'.format(
+                '; '.join('[{}]'.format(', '.join(cycle)) for cycle in cycles)))
+        # name of variable -> value
+        self._derived_values = {}
+
+    def __getitem__(self, name):
+        derived_variable = self._derived_variables.get(name)
+        if derived_variable is None:
+            return self._config[name]
+        if name not in self._derived_values:
+            self._derived_values[name] = derived_variable.function(
+                *[self[input_name] for input_name in derived_variable.inputs])
+        return self._derived_values[name]
+
+    def resolve(self, variable_names=None):
+        """
+        Args:
+            variable_names (iterable[str]): Names of the variables that are needed. Only the
+                derived variables among them are computed. All derived variables are computed if
+                it's None.
+
+        Returns:
+            dict: Values of all variables that aren't derived and of the needed derived ones.
+        """
+        if variable_names is None:
+            variable_names = self._derived_variables
+        resolved_config = self._config.copy()
+        for name in variable_names:
+            if name in self._derived_variables:
+                resolved_config[name] = self[name]
+        return resolved_config
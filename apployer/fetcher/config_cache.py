@@ -0,0 +1,121 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+On-disk cache of the configuration fetched from the environment, so that retried deployments
+don't have to connect to CDH and bastion again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from os import path
+import time
+
+_log = logging.getLogger(__name__) # pylint: disable=invalid-name
+
+DEFAULT_CONFIG_CACHE_PATH = path.join('apployer_out', 'fetched_config')
+# Default time (in seconds) after which the cached configuration is fetched again.
+# It can be changed with "fetched_config_ttl" in fetcher's configuration.
+DEFAULT_CONFIG_CACHE_TTL = 12 * 3600
+CONFIG_CACHE_VERSION = 1
+
+
+class FetchedConfigCache(object):
+    """Configuration fetched from each of the sources (CDH, bastion), stored separately for each
+    fetcher's configuration. Cache files contain passwords and keytabs, so only their owner can
+    read them.
+
+    Args:
+        fetcher_config (dict): Configuration of the fetcher. Its hash is the key of the cache.
+        cache_path (str): Path to the directory of the cache.
+        ttl (float): Time (in seconds) for which the cached configuration is valid. Nothing is
+            cached if it's 0.
+        refetch (bool): Ignore the cached configuration (new one is still saved).
+    """
+
+    def __init__(self, fetcher_config, cache_path=DEFAULT_CONFIG_CACHE_PATH,
+                 ttl=DEFAULT_CONFIG_CACHE_TTL, refetch=False):
+        self._key = hashlib.sha1(json.dumps(fetcher_config, sort_keys=True)).hexdigest()
+        self._cache_path = cache_path
+        self._ttl = ttl
+        self._refetch = refetch
+
+    def _get_entry_path(self, source):
+        return path.join(self._cache_path, '{}.{}.json'.format(self._key, source))
+
+    def get(self, source, variable_names, validity_token=None):
+        """
+        Args:
+            source (str): Name of the source of the configuration.
+            variable_names (list[str]): Names of the variables that are needed.
+            validity_token (object): Value describing the state of the source (e.g. modification
+                times of files the configuration is read from). Cached configuration is valid
+                only if it was saved with the same token.
+
+        Returns:
+            dict: Cached configuration or None if there's no valid one containing the variables.
+        """
+        entry_path = self._get_entry_path(source)
+        if self._refetch or self._ttl <= 0 or not path.exists(entry_path):
+            return None
+        try:
+            with open(entry_path) as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, ValueError) as ex:
+            _log.warning("Can't read cached configuration from %s: %s", entry_path, ex)
+            return None
+
+        age = time.time() - entry.get('fetched_at', 0)
+        if entry.get('version') != CONFIG_CACHE_VERSION or not 0 <= age <= self._ttl:
+            _log.debug('Cached configuration from %s has expired.', source)
+        elif entry.get('validity_token') != validity_token:
+            _log.debug('Cached configuration from %s is out of date.', source)
+        elif not set(variable_names) <= set(entry['variable_names']):
+            _log.debug('Cached configuration from %s lacks some of the variables.', source)
+        else:
+            _log.info('Using configuration from %s cached %d minutes ago.', source, age // 60)
+            return entry['config']
+        return None
+
+    def put(self, source, variable_names, config, validity_token=None):
+        """
+        Args:
+            source (str): Name of the source of the configuration.
+            variable_names (list[str]): Names of the variables that were requested from the source.
+            config (dict): Configuration fetched from the source.
+            validity_token (object): Value describing the state of the source. Must be
+                serializable to JSON.
+        """
+        if self._ttl <= 0:
+            return
+        if not path.isdir(self._cache_path):
+            os.makedirs(self._cache_path, 0700)
+        entry = {
+            'version': CONFIG_CACHE_VERSION,
+            'fetched_at': time.time(),
+            'validity_token': validity_token,
+            'variable_names': sorted(variable_names),
+            'config': config,
+        }
+        entry_path = self._get_entry_path(source)
+        temp_entry_path = '{}.{}.tmp'.format(entry_path, os.getpid())
+        entry_fd = os.open(temp_entry_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(entry_fd, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.rename(temp_entry_path, entry_path)
+        _log.debug('Configuration from %s saved in %s', source, entry_path)
@@ -20,45 +20,96 @@ live TAP environment.
 """
 
 import logging
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 import os
 import pprint
+import time
 
-import jinja2
-import yaml
-
-from .cdh_utilities import CdhConfExtractor
-from .conf_finalizer import deduce_final_configuration
-from .bastion_utilities import CFConfExtractor
+from .. import blob_store, variable_index, yaml_codec
+from ..appstack import AppStack
+from .conf_finalizer import deduce_final_configuration, get_base_variables
+from .config_cache import FetchedConfigCache, DEFAULT_CONFIG_CACHE_PATH, DEFAULT_CONFIG_CACHE_TTL
 
 DEPLOY_CONF_FILE = 'templates/template_variables.yml'
 DEFAULT_FILLED_APPSTACK_PATH = 'filled_expanded_appstack.yml'
 DEFAULT_FETCHER_CONF = 'fetcher_config.yml'
+# Default time limits (in seconds) for fetching configuration from each of the machines.
+# They can be changed with "fetch_timeout" in machine's section of fetcher's configuration.
+DEFAULT_CDH_FETCH_TIMEOUT = 1800
+DEFAULT_BASTION_FETCH_TIMEOUT = 600
 
 _log = logging.getLogger(__name__) # pylint: disable=invalid-name
 
 
-def fill_appstack(expanded_appstack_file, fetcher_config_path):
+def fill_appstack(expanded_appstack_file, fetcher_config_path, refetch=False,
+                  filled_appstack_path=DEFAULT_FILLED_APPSTACK_PATH,
+                  config_cache_path=DEFAULT_CONFIG_CACHE_PATH):
     """Fills expanded appstack with configuration taken from a live environment.
+    Only the variables used in the expanded appstack (and the ones that the derived variables it
+    uses are computed from, see `apployer.fetcher.conf_finalizer`) that aren't set in
+    the deployment configuration file are fetched from the environment.
+    Fetched configuration is cached (see `apployer.fetcher.config_cache`) and reused by the next
+    runs while it's valid.
+    Large configuration values are put in the blob store next to the filled appstack
+    (see `apployer.blob_store`) and the filled appstack only references them.
+
     Args:
         expanded_appstack_file:
         fetcher_config_path:
+        refetch (bool): Fetch the configuration even if there's a valid cached one.
+        filled_appstack_path (str): Where to save the filled appstack file.
+        config_cache_path (str): Path to the directory of the fetched configuration cache.
 
     Returns:
-        str: Filled expanded appstack's path.
+        (`AppStack`, dict[str,str]): Filled expanded appstack (it's also saved to
+            `filled_appstack_path`) and digests of the used variables' values. The digests should
+            be saved only when the appstack is deployed (see `apployer.variable_index`).
     """
     if not fetcher_config_path:
         fetcher_config_path = DEFAULT_FETCHER_CONF
     fetcher_config = _get_fetcher_config(fetcher_config_path)
-    env_conf_values = _get_environment_config(fetcher_config)
-    filled_config = _get_full_deployment_config(env_conf_values)
-    _fill_appstack(expanded_appstack_file, filled_config, DEFAULT_FILLED_APPSTACK_PATH)
-    return DEFAULT_FILLED_APPSTACK_PATH
+    _log.debug('Expanded appstack file: %s', expanded_appstack_file)
+    with open(expanded_appstack_file, 'r') as appstack_file:
+        expanded_appstack_dict = yaml_codec.load(appstack_file)
+
+    deployment_variables = _get_deployment_variables()
+    template_variables = _get_template_variables(expanded_appstack_dict)
+    fetched_variables = sorted(name for name in get_base_variables(template_variables)
+                               if not deployment_variables.get(name))
+    config_cache = _get_config_cache(fetcher_config, config_cache_path, refetch)
+    env_conf_values = _get_environment_config(fetcher_config, fetched_variables, config_cache)
+
+    blob_store.set_store_path(blob_store.get_store_path(filled_appstack_path))
+    filled_config = blob_store.store_large_values(
+        _get_full_deployment_config(deployment_variables, env_conf_values, template_variables))
+    filled_appstack = _fill_appstack(expanded_appstack_dict, filled_config, filled_appstack_path)
+    return filled_appstack, variable_index.get_variable_digests(filled_config, template_variables)
+
+
+def _get_config_cache(fetcher_config, config_cache_path, refetch):
+    """
+    Args:
+        fetcher_config (dict): Configuration of the fetcher. Its "fetched_config_ttl" is the time
+            for which the fetched configuration is cached, 0 turns the cache off. The default is
+            used if it's not set.
+        config_cache_path (str): Path to the directory of the cache.
+        refetch (bool): Ignore the cached configuration.
+
+    Returns:
+        `FetchedConfigCache`: Cache of the fetched configuration.
+    """
+    ttl = fetcher_config.get('fetched_config_ttl')
+    if ttl is None:
+        ttl = DEFAULT_CONFIG_CACHE_TTL
+    return FetchedConfigCache(fetcher_config, cache_path=config_cache_path, ttl=ttl,
+                              refetch=refetch)
 
 
 def _get_fetcher_config(fetcher_config_path):
     _log.debug('Using configuration file: %s', fetcher_config_path)
     with open(fetcher_config_path) as fetcher_config_file:
-        fetcher_config = yaml.load(fetcher_config_file)
+        fetcher_config = yaml_codec.load(fetcher_config_file)
     return _fill_config_defaults(fetcher_config)
 
 
@@ -75,47 +126,233 @@ def _fill_config_defaults(fetcher_config):
     return config_with_defaults
 
 
-def _get_environment_config(fetcher_config):
-    _log.info("Extracting configuration values from CDH...")
-    with CdhConfExtractor(fetcher_config) as cdh_extractor:
-        cdh_conf = cdh_extractor.get_all_deployments_conf()
+def _get_environment_config(fetcher_config, variable_names, config_cache=None):
+    """
+    Configuration from CDH and from bastion is fetched concurrently.
 
-    _log.info("Extracting configuration values from bastion...")
-    with CFConfExtractor(fetcher_config) as cf_extractor:
-        env_conf = cf_extractor.get_environment_settings()
+    Args:
+        fetcher_config (dict): Configuration of the fetcher.
+        variable_names (list[str]): Names of the variables that should be fetched.
+            Extractors are only connected to the environment if they provide some of them.
+        config_cache (`FetchedConfigCache`): Cache of the fetched configuration.
+            Nothing is cached if it's None.
 
-    fetched_config = dict(cdh_conf.items() + env_conf.items())
+    Returns:
+        dict: Variables fetched from the environment.
+
+    Raises:
+        ConfigFetchError: Fetching from CDH or bastion failed or didn't finish in time.
+    """
+    # Extractors need SSH and CDH API libraries, which take long to import.
+    # They are imported here so that the commands not fetching the configuration don't load them.
+    from .cdh_utilities import CdhConfExtractor
+    from .bastion_utilities import CFConfExtractor
+
+    fetches = []
+    cdh_variables = [name for name in variable_names if CdhConfExtractor.provides(name)]
+    if cdh_variables:
+        fetches.append(_Fetch('CDH', _fetch_cdh_config,
+                              (fetcher_config, cdh_variables, config_cache),
+                              _get_fetch_timeout(fetcher_config, 'cdh-manager',
+                                                 DEFAULT_CDH_FETCH_TIMEOUT)))
+    if set(variable_names) & set(CFConfExtractor.PROVIDED_VARIABLES):
+        fetches.append(_Fetch('bastion', _fetch_bastion_config, (fetcher_config, config_cache),
+                              _get_fetch_timeout(fetcher_config, 'cf-bastion',
+                                                 DEFAULT_BASTION_FETCH_TIMEOUT)))
+
+    fetched_config = {}
+    for config in _run_fetches(fetches):
+        fetched_config.update(config)
+
+    unknown_variables = [name for name in variable_names if name not in fetched_config]
+    if unknown_variables:
+        _log.debug("Variables not provided by the environment: %s", ', '.join(unknown_variables))
     _log.debug('Config values fetched from environment:\n%s', pprint.pformat(fetched_config))
     return fetched_config
 
 
-def _get_full_deployment_config(env_conf_values):
+def _fetch_cdh_config(fetcher_config, variable_names, config_cache):
+    from .cdh_utilities import CdhConfExtractor
+
+    # CDH API has no cheap way of telling whether the configuration changed,
+    # so the cached one is used until it expires.
+    cdh_config = config_cache.get('CDH', variable_names) if config_cache else None
+    if cdh_config is None:
+        _log.info("Extracting configuration values from CDH...")
+        with CdhConfExtractor(fetcher_config) as cdh_extractor:
+            cdh_config = cdh_extractor.get_deployments_conf(variable_names)
+        _log.info("Configuration values from CDH extracted.")
+        if config_cache:
+            config_cache.put('CDH', variable_names, cdh_config)
+    return cdh_config
+
+
+def _fetch_bastion_config(fetcher_config, config_cache):
+    from .bastion_utilities import CFConfExtractor
+
+    with CFConfExtractor(fetcher_config) as cf_extractor:
+        # the cached configuration is valid as long as the manifests it was read from don't change
+        manifests_mtimes = cf_extractor.get_manifests_mtimes() if config_cache else None
+        bastion_config = config_cache.get('bastion', CFConfExtractor.PROVIDED_VARIABLES,
+                                          manifests_mtimes) if config_cache else None
+        if bastion_config is None:
+            _log.info("Extracting configuration values from bastion...")
+            bastion_config = cf_extractor.get_environment_settings()
+            _log.info("Configuration values from bastion extracted.")
+            if config_cache:
+                config_cache.put('bastion', CFConfExtractor.PROVIDED_VARIABLES, bastion_config,
+                                 manifests_mtimes)
+    return bastion_config
+
+
+def _get_fetch_timeout(fetcher_config, machine_name, default_timeout):
+    machine_config = fetcher_config.get('machines', {}).get(machine_name) or {}
+    return machine_config.get('fetch_timeout') or default_timeout
+
+
+class _Fetch(object): # pylint: disable=too-few-public-methods
+    """Fetching of configuration from one source.
+
+    Attributes:
+        source (str): Name of the source, used in messages.
+        function (callable): Function doing the fetching and returning a dict of variables.
+        args (tuple): Arguments for the function.
+        timeout (float): Time limit for the fetching in seconds.
+    """
+
+    def __init__(self, source, function, args, timeout):
+        self.source = source
+        self.function = function
+        self.args = args
+        self.timeout = timeout
+
+
+def _run_fetches(fetches):
+    """Runs the fetches concurrently, each with its own time limit.
+
+    Args:
+        fetches (list[`_Fetch`]): Fetches to run.
+
+    Returns:
+        list[dict]: Results of the fetches in the same order.
+
+    Raises:
+        ConfigFetchError: Some of the fetches failed or didn't finish in time.
+            Message describes all of the failures.
+    """
+    if not fetches:
+        return []
+    pool = ThreadPool(len(fetches))
+    try:
+        start_time = time.time()
+        async_results = [pool.apply_async(fetch.function, fetch.args) for fetch in fetches]
+        results = []
+        errors = []
+        for fetch, async_result in zip(fetches, async_results):
+            try:
+                results.append(async_result.get(max(0, start_time + fetch.timeout - time.time())))
+            except TimeoutError:
+                errors.append('fetching configuration from {} timed out after {} seconds'
+                              .format(fetch.source, fetch.timeout))
+            except Exception as ex: # pylint: disable=broad-except
+                _log.debug('Fetching configuration from %s failed.', fetch.source, exc_info=True)
+                errors.append('fetching configuration from {} failed: {}: {}'
+                              .format(fetch.source, type(ex).__name__, ex))
+        if errors:
+            raise ConfigFetchError('Getting configuration from the environment failed: ' +
+                                   '; '.join(errors))
+        return results
+    finally:
+        # Fetches that timed out can't be stopped, but their threads won't block the exit.
+        pool.terminate()
+
+
+class ConfigFetchError(Exception):
+    """Configuration couldn't be fetched from the environment."""
+    pass
+
+
+def _get_deployment_variables():
     _log.debug("Loading deployment configuration file: %s", DEPLOY_CONF_FILE)
     with open(DEPLOY_CONF_FILE, 'r') as variables_file:
-        deployment_variables = yaml.load(variables_file)
+        return yaml_codec.load(variables_file)
+
 
+def _get_full_deployment_config(deployment_variables, env_conf_values, variable_names=None):
+    deployment_variables = deployment_variables.copy()
     for key, value in env_conf_values.iteritems():
         if not deployment_variables.get(key):
             deployment_variables[key] = value
-    deployment_variables_final = deduce_final_configuration(deployment_variables)
+    deployment_variables_final = deduce_final_configuration(deployment_variables, variable_names)
     return deployment_variables_final
 
 
-def _fill_appstack(expanded_appstack_file, filled_config, filled_appstack_path):
+def _get_template_variables(appstack_dict):
+    """
+    Args:
+        appstack_dict (dict): Expanded appstack loaded from YAML.
+
+    Returns:
+        set[str]: Names of the variables used by the templates in the appstack.
+    """
+    variables = set()
+    for template in set(template for _, template in variable_index.get_templates(appstack_dict)):
+        variables.update(variable_index.get_template_variables(template))
+    return variables
+
+
+def _fill_appstack(expanded_appstack_dict, filled_config, filled_appstack_path):
     """
     Args:
-        expanded_appstack_file (str):
+        expanded_appstack_dict (dict): Expanded appstack loaded from YAML.
         filled_config (dict):
         filled_appstack_path (str): Where to save the filled appstack file.
+
+    Returns:
+        `AppStack`: Filled expanded appstack.
     """
     _log.info('Filling expanded appstack with configuration...')
-    _log.debug('Expanded appstack file: %s', expanded_appstack_file)
-
-    with open(expanded_appstack_file, 'r') as appstack_file:
-        appstack_str = appstack_file.read()
-    appstack_template = jinja2.Environment().from_string(appstack_str)
-    full_appstack_str = appstack_template.render(filled_config)
+    filled_appstack_dict = _TemplateRenderer(filled_config).render(expanded_appstack_dict)
 
     with open(filled_appstack_path, 'w') as appstack_file:
-        appstack_file.write(full_appstack_str)
+        yaml_codec.dump(filled_appstack_dict, appstack_file)
     _log.info('Filled expanded appstack file: %s', os.path.realpath(filled_appstack_path))
+    return AppStack.from_appstack_dict(filled_appstack_dict)
+
+
+class _TemplateRenderer(object):
+    """Renders Jinja templates contained in string values of a parsed YAML document.
+    Only the strings containing template markers are rendered. Each distinct template is
+    compiled and rendered only once.
+
+    Args:
+        template_variables (dict): Variables used to render the templates.
+    """
+
+    def __init__(self, template_variables):
+        import jinja2
+
+        self._environment = jinja2.Environment(keep_trailing_newline=True)
+        self._template_variables = template_variables
+        self._rendered_templates = {}
+
+    def render(self, data):
+        """
+        Args:
+            data (object): Structure of dicts and lists loaded from YAML.
+
+        Returns:
+            object: Data with templates in string values rendered.
+        """
+        if isinstance(data, basestring):
+            if not any(marker in data for marker in variable_index.TEMPLATE_MARKERS):
+                return data
+            if data not in self._rendered_templates:
+                template = self._environment.from_string(data)
+                self._rendered_templates[data] = template.render(self._template_variables)
+            return self._rendered_templates[data]
+        elif isinstance(data, dict):
+            return {key: self.render(value) for key, value in data.iteritems()}
+        elif isinstance(data, list):
+            return [self.render(value) for value in data]
+        return data
@@ -0,0 +1,455 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Recording and replaying of the traffic between the fetcher and the environment: remote commands
+run over SSH, SFTP uploads, Cloudera Manager REST responses and `cm_api` lookups.
+A recorded bundle lets filling of an appstack run offline (e.g. to measure changes of the fetcher)
+with the original latencies or without them.
+
+Usage:
+    python -m apployer.fetcher.traffic_recorder record BUNDLE_PATH EXPANDED_APPSTACK
+    python -m apployer.fetcher.traffic_recorder replay BUNDLE_PATH EXPANDED_APPSTACK --with-latency
+"""
+
+import base64
+from collections import defaultdict, deque
+import contextlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urlparse
+
+import click
+import paramiko
+import requests
+
+from . import bastion_utilities, cdh_utilities
+from .cdh_utilities import CdhApiHelper, CdhConfExtractor, NoCdhServiceError
+from .bastion_utilities import CFConfExtractor
+from .fetcher import fill_appstack, DEFAULT_FETCHER_CONF, DEFAULT_FILLED_APPSTACK_PATH
+
+_log = logging.getLogger(__name__) # pylint: disable=invalid-name
+
+BUNDLE_VERSION = 1
+
+# Errors raised by recorded calls that are raised again with the same type during replay.
+_REPLAYED_ERRORS = {error.__name__: error for error in (NoCdhServiceError, IOError, KeyError)}
+_MISSING = object()
+
+
+def _identity(value):
+    return value
+
+
+def _response_to_json(response):
+    return {'status_code': response.status_code,
+            'content': base64.standard_b64encode(response.content)}
+
+
+def _get_url_path(url):
+    # local port of the tunnel differs between runs, so only the rest of URL identifies a request
+    parsed_url = urlparse.urlsplit(url)
+    return urlparse.urlunsplit(('', '', parsed_url.path, parsed_url.query, ''))
+
+
+class _ReplayedResponse(object):
+    """Stand-in for `requests.Response` with recorded status and content."""
+
+    def __init__(self, recorded_response):
+        self.status_code = recorded_response['status_code']
+        self.content = base64.standard_b64decode(recorded_response['content'])
+
+    @property
+    def text(self):
+        """str: Content of the response."""
+        return self.content
+
+    def json(self):
+        """Returns content of the response decoded from JSON."""
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        """Yields content of the response in chunks."""
+        for position in xrange(0, len(self.content), chunk_size):
+            yield self.content[position:position + chunk_size]
+
+    def raise_for_status(self):
+        """Raises `requests.HTTPError` for error statuses."""
+        if self.status_code >= 400:
+            raise requests.HTTPError('{} error'.format(self.status_code), response=self)
+
+    def close(self):
+        """Does nothing, there's no connection."""
+        pass
+
+
+class _ReplayedService(object):
+    """Stand-in for a service from `cm_api`."""
+
+    def __init__(self, service_type):
+        self.type = service_type
+        self.name = service_type
+
+
+class _ReplayedSSHClient(object):
+    """Stand-in for `paramiko.SSHClient` that doesn't connect anywhere."""
+
+    def connect(self, *args, **kwargs):
+        """Does nothing."""
+        pass
+
+    def set_missing_host_key_policy(self, policy):
+        """Does nothing."""
+        pass
+
+    @staticmethod
+    def open_sftp():
+        """Returns SFTP client whose uploads are replayed."""
+        return _ReplayedSFTPClient()
+
+    def close(self):
+        """Does nothing."""
+        pass
+
+
+class _ReplayedSFTPClient(paramiko.SFTPClient):
+    """SFTP client without a channel, its uploads (patched methods of `paramiko.SFTPClient`)
+    are replayed."""
+
+    def __init__(self): # pylint: disable=super-init-not-called
+        pass
+
+    def close(self):
+        pass
+
+
+class _ReplayedParamiko(object):
+    """Stand-in for `paramiko` module used by the extractors."""
+    SSHClient = _ReplayedSSHClient
+    AutoAddPolicy = paramiko.AutoAddPolicy
+
+
+class _ReplayedTunnel(object):
+    """Stand-in for `sshtunnel.SSHTunnelForwarder`."""
+    local_bind_port = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def start(self):
+        """Does nothing."""
+        pass
+
+    def stop(self):
+        """Does nothing."""
+        pass
+
+
+def _replayed_api_resource(*args, **kwargs): # pylint: disable=unused-argument
+    # all lookups through the API are replayed by CdhApiHelper
+    return None
+
+
+class _CallKind(object):
+    """Kind of calls that are recorded and replayed, made through a method or function.
+
+    Args:
+        name (str): Name of the kind, used in the bundle.
+        owner (object): Class or module that has the method or function.
+        attribute (str): Name of the method or function.
+        get_key (callable): Takes the arguments of the call and returns a list identifying it.
+        to_json (callable): Turns the result of the call into a value that can be saved to JSON.
+        from_json (callable): Turns the saved value into the result of the call.
+    """
+
+    def __init__(self, name, owner, attribute, get_key, # pylint: disable=too-many-arguments
+                 to_json=_identity, from_json=_identity):
+        self.name = name
+        self.owner = owner
+        self.attribute = attribute
+        self.get_key = get_key
+        self.to_json = to_json
+        self.from_json = from_json
+
+
+CALL_KINDS = (
+    _CallKind('ssh', CdhConfExtractor, 'ssh_call_command',
+              lambda self, command, subcommands=None: ['cdh-launcher', command, subcommands]),
+    _CallKind('ssh', CFConfExtractor, 'ssh_call_command',
+              lambda self, command: ['cf-bastion', command]),
+    _CallKind('sftp_put', paramiko.SFTPClient, 'put',
+              lambda self, localpath, remotepath, *args, **kwargs: [remotepath],
+              to_json=lambda result: None),
+    _CallKind('sftp_put', paramiko.SFTPClient, 'putfo',
+              lambda self, fl, remotepath, *args, **kwargs: [remotepath],
+              to_json=lambda result: None),
+    _CallKind('http_get', requests.Session, 'get',
+              lambda self, url, **kwargs: [_get_url_path(url)],
+              to_json=_response_to_json, from_json=_ReplayedResponse),
+    _CallKind('cm_service', CdhApiHelper, 'get_service_from_cdh',
+              lambda self, name: [name],
+              to_json=lambda service: service.type, from_json=_ReplayedService),
+    _CallKind('cm_host', CdhApiHelper, 'get_host',
+              lambda self, service, role=None: [service.type, role]),
+    _CallKind('cm_entry', CdhApiHelper, 'get_entry',
+              lambda self, service, name: [service.type, name]),
+    _CallKind('cm_group_entry', CdhApiHelper, 'get_entry_from_group',
+              lambda self, service, name, group: [service.type, name, group]),
+)
+
+
+@contextlib.contextmanager
+def _patched(patches):
+    """Replaces attributes of classes or modules for the duration of the context.
+
+    Args:
+        patches (list[tuple]): Triples of (owner, attribute name, replacement).
+    """
+    originals = []
+    try:
+        for owner, attribute, replacement in patches:
+            originals.append((owner, attribute, vars(owner).get(attribute, _MISSING)))
+            setattr(owner, attribute, replacement)
+        yield
+    finally:
+        for owner, attribute, original in reversed(originals):
+            if original is _MISSING:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+
+
+class TrafficRecorder(object):
+    """Records the calls to the environment made in its context, see `recording`."""
+
+    def __init__(self):
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def get_patches(self):
+        """
+        Returns:
+            list[tuple]: Patches replacing the recorded methods with the recording ones.
+        """
+        return [(kind.owner, kind.attribute, self._make_recording_call(kind))
+                for kind in CALL_KINDS]
+
+    def _make_recording_call(self, kind):
+        original = getattr(kind.owner, kind.attribute)
+
+        def recording_call(*args, **kwargs):
+            """Calls the original function and records the call."""
+            key = kind.get_key(*args, **kwargs)
+            start_time = time.time()
+            try:
+                result = original(*args, **kwargs)
+            except Exception as ex:
+                self._add_call(kind, key, start_time, error=[type(ex).__name__, str(ex)])
+                raise
+            self._add_call(kind, key, start_time, result=kind.to_json(result))
+            return result
+        return recording_call
+
+    def _add_call(self, kind, key, start_time, **outcome):
+        call = {'kind': kind.name, 'key': key, 'duration': time.time() - start_time}
+        call.update(outcome)
+        with self._lock:
+            self._calls.append(call)
+
+    def save(self, bundle_path):
+        """Saves the recorded calls.
+
+        Args:
+            bundle_path (str): Path of the bundle file.
+        """
+        # calls contain passwords and keytabs, so only the owner can read the bundle
+        temp_bundle_path = '{}.{}.tmp'.format(bundle_path, os.getpid())
+        bundle_fd = os.open(temp_bundle_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(bundle_fd, 'w') as bundle_file:
+            json.dump({'version': BUNDLE_VERSION, 'calls': self._calls}, bundle_file,
+                      sort_keys=True)
+        os.rename(temp_bundle_path, bundle_path)
+        _log.info('Recorded %s calls to %s', len(self._calls), bundle_path)
+
+
+class TrafficPlayer(object):
+    """Replays the calls recorded in a bundle, see `replaying`.
+
+    Args:
+        bundle_path (str): Path of the bundle file.
+        with_latency (bool): Should each replayed call take as long as the recorded one.
+    """
+
+    def __init__(self, bundle_path, with_latency=False):
+        with open(bundle_path) as bundle_file:
+            bundle = json.load(bundle_file)
+        if bundle.get('version') != BUNDLE_VERSION:
+            raise ReplayError('Unsupported version of traffic bundle {}: {}'.format(
+                bundle_path, bundle.get('version')))
+        self._with_latency = with_latency
+        # identical calls are replayed in the order they were recorded
+        self._calls = defaultdict(deque)
+        for call in bundle['calls']:
+            self._calls[self._get_call_id(call['kind'], call['key'])].append(call)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_call_id(kind_name, key):
+        return json.dumps([kind_name, key])
+
+    def get_patches(self):
+        """
+        Returns:
+            list[tuple]: Patches replacing the recorded methods with the replaying ones and
+                the classes making connections with stand-ins.
+        """
+        patches = [(kind.owner, kind.attribute, self._make_replaying_call(kind))
+                   for kind in CALL_KINDS]
+        patches.extend([
+            (cdh_utilities, 'paramiko', _ReplayedParamiko),
+            (bastion_utilities, 'paramiko', _ReplayedParamiko),
+            (cdh_utilities, 'SSHTunnelForwarder', _ReplayedTunnel),
+            (cdh_utilities, 'ApiResource', _replayed_api_resource),
+        ])
+        return patches
+
+    def _make_replaying_call(self, kind):
+        def replaying_call(*args, **kwargs):
+            """Returns the result of the recorded call."""
+            return self.replay(kind, kind.get_key(*args, **kwargs))
+        return replaying_call
+
+    def replay(self, kind, key):
+        """
+        Args:
+            kind (`_CallKind`): Kind of the call.
+            key (list): Identifier of the call.
+
+        Returns:
+            object: Result of the recorded call.
+
+        Raises:
+            ReplayError: There's no (more) such calls in the bundle.
+        """
+        with self._lock:
+            recorded_calls = self._calls.get(self._get_call_id(kind.name, key))
+            if not recorded_calls:
+                raise ReplayError('No recorded {} call for {}'.format(kind.name, key))
+            call = recorded_calls.popleft()
+        if self._with_latency:
+            time.sleep(call['duration'])
+        if 'error' in call:
+            error_type, message = call['error']
+            raise _REPLAYED_ERRORS.get(error_type, ReplayError)(message)
+        return kind.from_json(call['result'])
+
+
+class ReplayError(Exception):
+    """Call can't be replayed from the bundle."""
+    pass
+
+
+@contextlib.contextmanager
+def recording(bundle_path):
+    """Records the traffic with the environment made in the context and saves it in a bundle
+    (also when the context fails).
+
+    Args:
+        bundle_path (str): Path of the bundle file.
+    """
+    recorder = TrafficRecorder()
+    try:
+        with _patched(recorder.get_patches()):
+            yield recorder
+    finally:
+        recorder.save(bundle_path)
+
+
+@contextlib.contextmanager
+def replaying(bundle_path, with_latency=False):
+    """Replays the traffic with the environment recorded in a bundle instead of connecting to it.
+
+    Args:
+        bundle_path (str): Path of the bundle file.
+        with_latency (bool): Should each replayed call take as long as the recorded one.
+    """
+    player = TrafficPlayer(bundle_path, with_latency)
+    with _patched(player.get_patches()):
+        yield player
+
+
+def _timed_fill_appstack(expanded_appstack, fetcher_config, **fill_options):
+    start_time = time.time()
+    fill_appstack(expanded_appstack, fetcher_config, refetch=True, **fill_options)
+    _log.info('Filling the appstack took %.2f seconds.', time.time() - start_time)
+
+
+@click.group()
+def cli():
+    """
+    Recording and replaying of fetcher's traffic with the environment.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s-%(levelname)s-%(name)s: %(message)s')
+
+
+@cli.command()
+@click.argument('BUNDLE_PATH')
+@click.argument('EXPANDED_APPSTACK')
+@click.option('-f', '--fetch-conf', 'fetcher_config',
+              default=DEFAULT_FETCHER_CONF, show_default=True,
+              help='Path to the configuration file for environment configuration fetcher.')
+def record(bundle_path, expanded_appstack, fetcher_config):
+    """
+    Fills the expanded appstack with configuration from the environment and records the traffic
+    in BUNDLE_PATH.
+    """
+    with recording(bundle_path):
+        _timed_fill_appstack(expanded_appstack, fetcher_config)
+
+
+@cli.command()
+@click.argument('BUNDLE_PATH')
+@click.argument('EXPANDED_APPSTACK')
+@click.option('-f', '--fetch-conf', 'fetcher_config',
+              default=DEFAULT_FETCHER_CONF, show_default=True,
+              help='Path to the configuration file for environment configuration fetcher.')
+@click.option('--with-latency', is_flag=True,
+              help='Make each replayed call take as long as the recorded one.')
+def replay(bundle_path, expanded_appstack, fetcher_config, with_latency):
+    """
+    Fills the expanded appstack offline with the traffic recorded in BUNDLE_PATH.
+    The filled appstack and the fetched configuration are saved in a temporary directory, so that
+    the ones of real deployments aren't overwritten with the recorded configuration.
+    """
+    output_path = tempfile.mkdtemp(prefix='apployer_replay_')
+    try:
+        with replaying(bundle_path, with_latency):
+            _timed_fill_appstack(
+                expanded_appstack, fetcher_config,
+                filled_appstack_path=os.path.join(output_path, DEFAULT_FILLED_APPSTACK_PATH),
+                config_cache_path=os.path.join(output_path, 'fetched_config'))
+    finally:
+        shutil.rmtree(output_path)
+
+
+if __name__ == '__main__':
+    cli()
@@ -24,14 +24,14 @@ import sys
 import time
 
 import click
-import yaml
 
 import apployer
-from .appstack import AppStack
-from .appstack_expand import expand_appstack
-from .deployer import deploy_appstack, UPGRADE_STRATEGY
-from apployer.cf_cli import CfInfo
-from .fetcher import fill_appstack, DEFAULT_FETCHER_CONF, DEFAULT_FILLED_APPSTACK_PATH
+from . import blob_store, variable_index, yaml_codec
+from apployer.cf_cli import CfInfo, UPGRADE_STRATEGY
+from .fetcher import DEFAULT_FETCHER_CONF, DEFAULT_FILLED_APPSTACK_PATH
+
+# Functions doing the actual work of the commands are imported when the command is run,
+# so that "apployer --help" and tab-completion don't have to load the libraries they need.
 
 DEFAULT_EXPANDED_APPSTACK_FILE = 'expanded_appstack.yml'
 DEFAULT_APPSTACK_FILE = 'appstack.yml'
@@ -71,6 +71,7 @@ def expand(appstack_file, artifacts_location, expanded_appstack_location):
 
     EXPANDED_APPSTACK_LOCATION defaults to "expanded_appstack.yml".
     """
+    from .appstack_expand import expand_appstack
     expand_appstack(appstack_file, artifacts_location, expanded_appstack_location)
 
 
@@ -119,8 +120,27 @@ def expand(appstack_file, artifacts_location, expanded_appstack_location):
                    "Cloud Foundry environment, except for creating org and space if those don't "
                    "already exist. "
                    "Each action that the deployment would perform is logged.")
-
-def deploy( #pylint: disable=too-many-arguments
+@click.option('--only',
+              help="Comma-separated list of applications (e.g. 'app-a,app-b') that should be "
+                   "deployed instead of the whole appstack. Standalone user-provided services "
+                   "and brokers they use will be deployed with them. Applications that they need "
+                   "to be registered in are only deployed with --with-dependencies.")
+@click.option('--with-dependencies', is_flag=True,
+              help="Used with --only. Also deploy the applications that the selected ones "
+                   "depend on (recursively).")
+@click.option('--with-dependents', is_flag=True,
+              help="Used with --only. Also deploy the applications that depend on the selected "
+                   "ones (recursively).")
+@click.option('--only-changed', is_flag=True,
+              help="Deploy only the applications, user-provided services and brokers that use "
+                   "configuration variables whose values have changed since the last complete "
+                   "deployment (without --only or --dry-run). The appstack is filled again with "
+                   "configuration fetched anew (--filled-appstack is ignored). Services whose "
+                   "credentials are updated restart the applications bound to them.")
+@click.option('--refetch', is_flag=True,
+              help="Fetch the configuration from the environment even if a valid one was cached "
+                   "by a previous run (in apployer_out/fetched_config).")
+def deploy( #pylint: disable=too-many-arguments,too-many-locals
         artifacts_location,
         cf_api_endpoint,
         cf_user,
@@ -132,7 +152,12 @@ def deploy( #pylint: disable=too-many-arguments
         expanded_appstack,
         appstack,
         push_strategy,
-        dry_run):
+        dry_run,
+        only,
+        with_dependencies,
+        with_dependents,
+        only_changed,
+        refetch):
     """
     Deploy the whole appstack.
     This should be run from environment's bastion to reduce chance of errors.
@@ -147,24 +172,53 @@ def deploy( #pylint: disable=too-many-arguments
 
     apployer deploy ../apps https://cf-api.example.com -p <CF password>
     -e ../tools/expanded_appstack.yml
+
+    Example of deploying a single application with everything that depends on it:
+
+    apployer deploy ../apps https://cf-api.example.com -p <CF password>
+    --only app-a --with-dependents
     """
+    from .deployer import deploy_appstack, DeploymentFailedError
     start_time = time.time()
 
     cf_info = CfInfo(api_url=cf_api_endpoint, password=cf_password, user=cf_user,
                      org=cf_org, space=cf_space)
-    filled_appstack = _get_filled_appstack(appstack, expanded_appstack, filled_appstack,
-                                           fetcher_config, artifacts_location)
-    deploy_appstack(cf_info, filled_appstack, artifacts_location, push_strategy, dry_run)
-
-    _log.info('Deployment time: %s', _seconds_to_time(time.time() - start_time))
-
-
-def _get_filled_appstack(
+    if (with_dependencies or with_dependents) and not only:
+        raise ApployerArgumentError('--with-dependencies and --with-dependents can only be used '
+                                    'with --only.')
+    if only_changed:
+        if only:
+            raise ApployerArgumentError("--only and --only-changed can't be used together.")
+        full_appstack, deployed_appstack, variable_digests = _get_changed_appstack(
+            appstack, expanded_appstack, fetcher_config, artifacts_location)
+    else:
+        full_appstack, variable_digests = _get_filled_appstack(
+            appstack, expanded_appstack, filled_appstack, fetcher_config, artifacts_location,
+            refetch)
+        deployed_appstack = full_appstack
+    if only:
+        deployed_appstack = _select_apps( #pylint: disable=redefined-variable-type
+            full_appstack, only, with_dependencies, with_dependents)
+    try:
+        deploy_appstack(cf_info, deployed_appstack, artifacts_location, push_strategy, dry_run,
+                        full_appstack)
+        # the next --only-changed deployment looks for changes since this complete one
+        if variable_digests is not None and not only and not dry_run:
+            variable_index.save_variable_digests(variable_digests, DEFAULT_FILLED_APPSTACK_PATH)
+    except DeploymentFailedError as ex:
+        _log.error(str(ex))
+        sys.exit(1)
+    finally:
+        _log.info('Deployment time: %s', _seconds_to_time(time.time() - start_time))
+
+
+def _get_filled_appstack( #pylint: disable=too-many-arguments
         appstack_path,
         expanded_appstack_path,
         filled_appstack_path,
         fetcher_config_path,
-        artifacts_location):
+        artifacts_location,
+        refetch=False):
     """ Does the necessary things to obtain a filled expanded appstack based on the command line
     parameters.
 
@@ -175,27 +229,125 @@ def _get_filled_appstack(
         fetcher_config_path (str): Path to the configuration file for environment configuration
             fetcher.
         artifacts_location (str): Path to a directory with applications' artifacts (zips).
+        refetch (bool): Fetch the configuration from the environment even if it's cached.
 
     Returns:
-        `AppStack`: Expanded appstack filled with configuration extracted from
-            a live TAP environment.
+        (`AppStack`, dict[str,str]): Expanded appstack filled with configuration extracted from
+            a live TAP environment and digests of the configuration variables it uses
+            (None if an already filled appstack is used).
+
+    Raises:
+        ApployerArgumentError: When the blobs referenced by the filled appstack aren't in its
+            blob store.
     """
+    from .appstack import AppStack
+    from .appstack_expand import expand_appstack
+    from .fetcher import fill_appstack
+
     if os.path.exists(filled_appstack_path):
         _log.info('Using filled expanded appstack file: %s', os.path.realpath(filled_appstack_path))
-        final_appstack_path = filled_appstack_path
+        with open(filled_appstack_path) as filled_appstack_file:
+            filled_appstack_dict = yaml_codec.load(filled_appstack_file)
+        store_path = blob_store.get_store_path(filled_appstack_path)
+        missing_blobs = blob_store.find_missing_blobs(filled_appstack_dict, store_path)
+        if missing_blobs:
+            raise ApployerArgumentError(
+                'Blobs referenced by the filled appstack are missing from its blob store ({}): {}. '
+                'Copy the blob store together with the appstack.'.format(
+                    os.path.realpath(store_path), ', '.join(missing_blobs)))
+        blob_store.set_store_path(store_path)
+        return AppStack.from_appstack_dict(filled_appstack_dict), None
     elif os.path.exists(expanded_appstack_path):
         _log.info('Using expanded appstack file: %s', os.path.realpath(expanded_appstack_path))
-        final_appstack_path = fill_appstack(expanded_appstack_path, fetcher_config_path)
+        return fill_appstack(expanded_appstack_path, fetcher_config_path, refetch)
     elif os.path.exists(appstack_path):
         _log.info('Using appstack file: %s', os.path.realpath(appstack_path))
         expand_appstack(appstack_path, artifacts_location, expanded_appstack_path)
-        final_appstack_path = fill_appstack(expanded_appstack_path, fetcher_config_path)
+        return fill_appstack(expanded_appstack_path, fetcher_config_path, refetch)
     else:
         raise ApployerArgumentError("Couldn't find any appstack file.")
 
-    with open(final_appstack_path) as appstack_file:
-        filled_appstack_dict = yaml.load(appstack_file)
-    return AppStack.from_appstack_dict(filled_appstack_dict)
+
+def _get_changed_appstack(
+        appstack_path,
+        expanded_appstack_path,
+        fetcher_config_path,
+        artifacts_location):
+    """Fills the appstack again and narrows it down to the elements affected by the changes of
+    configuration variables since the last complete deployment.
+
+    Args:
+        appstack_path (str): Path to appstack file.
+        expanded_appstack_path (str): Path to expanded appstack file.
+        fetcher_config_path (str): Path to the configuration file for environment configuration
+            fetcher.
+        artifacts_location (str): Path to a directory with applications' artifacts (zips).
+
+    Returns:
+        (`AppStack`, `AppStack`, dict[str,str]): The whole filled expanded appstack, the part of it
+            with only the affected elements and digests of the configuration variables it uses.
+            The part is the whole appstack if the changes affect something else than
+            applications, user-provided services and brokers.
+
+    Raises:
+        ApployerArgumentError: When the appstack wasn't deployed completely before.
+    """
+    previous_digests = variable_index.load_variable_digests(DEFAULT_FILLED_APPSTACK_PATH)
+    if previous_digests is None:
+        raise ApployerArgumentError(
+            "Can't tell what has changed, because no appstack filled by a previous run was "
+            "deployed completely ({}).".format(os.path.realpath(DEFAULT_FILLED_APPSTACK_PATH)))
+    filled_appstack, digests = _get_filled_appstack(appstack_path, expanded_appstack_path, '',
+                                                    fetcher_config_path, artifacts_location, True)
+    changed_variables = variable_index.get_changed_variables(previous_digests, digests)
+    _log.info('Configuration variables changed since the last complete deployment: %s',
+              ', '.join(changed_variables) or 'none')
+
+    index = variable_index.load_variable_index(expanded_appstack_path)
+    if index is None:
+        with open(expanded_appstack_path) as expanded_appstack_file:
+            index = variable_index.build_variable_index(yaml_codec.load(expanded_appstack_file))
+    affected_elements = variable_index.get_affected_elements(index, changed_variables)
+    if affected_elements is None:
+        _log.info('Changes affect the whole appstack, deploying everything.')
+        return filled_appstack, filled_appstack, digests
+
+    changed_appstack = filled_appstack.select_elements(
+        sorted(affected_elements['apps']),
+        affected_elements['user_provided_services'],
+        affected_elements['brokers'])
+    _log.info('Deploying only the affected elements: %s', ', '.join(
+        [app.name for app in changed_appstack.apps] +
+        [service.name for service in changed_appstack.user_provided_services] +
+        [broker.name for broker in changed_appstack.brokers]) or 'none')
+    return filled_appstack, changed_appstack, digests
+
+
+def _select_apps(appstack, app_names_list, with_dependencies, with_dependents):
+    """Narrows down the appstack to the applications selected on the command line.
+
+    Args:
+        appstack (`AppStack`): Appstack to select the applications from.
+        app_names_list (str): Comma-separated names of applications.
+        with_dependencies (bool): Should the apps that selected apps depend on be selected too.
+        with_dependents (bool): Should the apps depending on selected apps be selected too.
+
+    Returns:
+        `AppStack`: Appstack with only the selected applications.
+
+    Raises:
+        ApployerArgumentError: When some of the applications aren't in the appstack.
+    """
+    app_names = [name.strip() for name in app_names_list.split(',') if name.strip()]
+    unknown_apps = [name for name in app_names if appstack.get_app(name) is None]
+    if unknown_apps:
+        raise ApployerArgumentError('Applications not found in the appstack: {}'
+                                    .format(', '.join(unknown_apps)))
+
+    selected_appstack = appstack.select_apps(app_names, with_dependencies, with_dependents)
+    _log.info('Deploying only the selected applications: %s',
+              ', '.join(app.name for app in selected_appstack.apps))
+    return selected_appstack
 
 
 def _setup_logging(level):
@@ -224,9 +376,7 @@ def _seconds_to_time(seconds):
 
 
 # TODO primary
-# Make installable and testable for py26. This will require to make an "extra feature" (see
-#   setuptools docs on "declaring extras") out of appstack expansion.
-#   Only dependency for this feature would be networkx.
+# Make installable and testable for py26.
 # Brokers serving instances that hold no data (like all WSSB brokers) can be marked
 #   as "recreatable" or something. Then, they could be recreated and rebound to apps when WSSB
 #   configuration changes. Right now it won't happen, because there's no universal way of
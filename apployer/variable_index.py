@@ -0,0 +1,201 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Tracking which elements of the appstack are affected by changes of the configuration.
+Expansion saves an index of the places (paths) in the expanded appstack where each template
+variable is used. Filling gives digests of the variables' values, which are saved once the filled
+appstack is deployed. Comparing the digests of two fillings gives the changed variables and
+the index gives the elements using them.
+Digests of secrets could be used to guess them, so only their owner can read them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+_log = logging.getLogger(__name__) # pylint: disable=invalid-name
+
+# Strings containing these are Jinja templates.
+TEMPLATE_MARKERS = ('{{', '{%')
+# The index is saved next to the expanded appstack, digests next to the filled one.
+VARIABLE_INDEX_SUFFIX = '.variables'
+VARIABLE_DIGESTS_SUFFIX = '.digests'
+# Sections of the appstack whose elements (identified by names) can be deployed separately.
+ELEMENT_SECTIONS = ('apps', 'user_provided_services', 'brokers')
+PATH_SEPARATOR = '/'
+
+# Variables used by each template, by template.
+_template_variables_cache = {} # pylint: disable=invalid-name
+
+
+def get_template_variables(template):
+    """
+    Args:
+        template (str): Jinja template.
+
+    Returns:
+        frozenset[str]: Names of the variables used by the template.
+    """
+    if template not in _template_variables_cache:
+        import jinja2
+        from jinja2 import meta
+
+        parsed_template = jinja2.Environment().parse(template)
+        _template_variables_cache[template] = frozenset(
+            meta.find_undeclared_variables(parsed_template))
+    return _template_variables_cache[template]
+
+
+def get_templates(data, data_path=()):
+    """
+    Args:
+        data (object): Structure of dicts and lists loaded from YAML.
+        data_path (tuple): Path of the data in the whole structure.
+
+    Yields:
+        (tuple, str): String values from the data that contain Jinja templates, with their paths.
+            Items of lists are identified by their "name" fields if they have them,
+            by their positions otherwise.
+    """
+    if isinstance(data, basestring):
+        if any(marker in data for marker in TEMPLATE_MARKERS):
+            yield data_path, data
+    elif isinstance(data, dict):
+        for key, value in data.iteritems():
+            for template_path, template in get_templates(value, data_path + (key,)):
+                yield template_path, template
+    elif isinstance(data, list):
+        for position, value in enumerate(data):
+            if isinstance(value, dict) and isinstance(value.get('name'), basestring):
+                item_id = value['name']
+            else:
+                item_id = position
+            for template_path, template in get_templates(value, data_path + (item_id,)):
+                yield template_path, template
+
+
+def build_variable_index(appstack_dict):
+    """
+    Args:
+        appstack_dict (dict): Expanded appstack loaded from YAML.
+
+    Returns:
+        dict[str,list[str]]: Sorted paths (like "apps/app-a/app_properties/env/PASSWORD") of the
+            places using each of the variables, by variable name.
+    """
+    index = {}
+    for template_path, template in get_templates(appstack_dict):
+        joined_path = PATH_SEPARATOR.join(str(component) for component in template_path)
+        for variable in get_template_variables(template):
+            index.setdefault(variable, []).append(joined_path)
+    return {variable: sorted(paths) for variable, paths in index.iteritems()}
+
+
+def get_affected_elements(variable_index, variable_names):
+    """
+    Args:
+        variable_index (dict[str,list[str]]): Index made by `build_variable_index`.
+        variable_names (iterable[str]): Names of the variables that have changed.
+
+    Returns:
+        dict[str,set[str]]: Names of the affected elements in each of ELEMENT_SECTIONS.
+            None if the changes affect other parts of the appstack (like the domain), so the whole
+            appstack is affected.
+    """
+    affected_elements = {section: set() for section in ELEMENT_SECTIONS}
+    for variable in variable_names:
+        for variable_path in variable_index.get(variable, []):
+            components = variable_path.split(PATH_SEPARATOR, 2)
+            if components[0] not in ELEMENT_SECTIONS or len(components) < 2:
+                _log.debug('Variable %s is used in %s, so the whole appstack is affected.',
+                           variable, variable_path)
+                return None
+            affected_elements[components[0]].add(components[1])
+    return affected_elements
+
+
+def get_variable_digests(config, variable_names):
+    """
+    Args:
+        config (dict): Values of configuration variables.
+        variable_names (iterable[str]): Names of the variables whose digests are needed.
+
+    Returns:
+        dict[str,str]: Digests of the values by variable names (missing variables are
+            treated like they're None).
+    """
+    return {name: hashlib.sha256(json.dumps(config.get(name), sort_keys=True, default=str))
+                  .hexdigest()
+            for name in variable_names}
+
+
+def get_changed_variables(previous_digests, digests):
+    """
+    Args:
+        previous_digests (dict[str,str]): Digests of variables from the previous filling.
+        digests (dict[str,str]): Digests of variables from the current filling.
+
+    Returns:
+        list[str]: Sorted names of the variables with different digests (also the ones that are
+            only in one of the fillings).
+    """
+    return sorted(name for name in set(previous_digests) | set(digests)
+                  if previous_digests.get(name) != digests.get(name))
+
+
+def save_variable_index(variable_index, expanded_appstack_path):
+    """Saves the index next to the expanded appstack file."""
+    _save(variable_index, expanded_appstack_path + VARIABLE_INDEX_SUFFIX)
+
+
+def load_variable_index(expanded_appstack_path):
+    """
+    Returns:
+        dict[str,list[str]]: Index saved next to the expanded appstack file, None if there's none.
+    """
+    return _load(expanded_appstack_path + VARIABLE_INDEX_SUFFIX)
+
+
+def save_variable_digests(digests, filled_appstack_path):
+    """Saves the digests next to the filled appstack file."""
+    _save(digests, filled_appstack_path + VARIABLE_DIGESTS_SUFFIX, private=True)
+
+
+def load_variable_digests(filled_appstack_path):
+    """
+    Returns:
+        dict[str,str]: Digests saved next to the filled appstack file, None if there are none.
+    """
+    return _load(filled_appstack_path + VARIABLE_DIGESTS_SUFFIX)
+
+
+def _save(data, file_path, private=False):
+    temp_file_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    data_fd = os.open(temp_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                      0600 if private else 0666)
+    with os.fdopen(data_fd, 'w') as data_file:
+        json.dump(data, data_file, sort_keys=True, indent=1)
+    os.rename(temp_file_path, file_path)
+    _log.debug('Saved %s', file_path)
+
+
+def _load(file_path):
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path) as data_file:
+        return json.load(data_file)
@@ -0,0 +1,51 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Reading and writing YAML files used by Apployer.
+Uses the fast LibYAML-based loader and dumper if they're available. Only standard YAML tags are
+supported, arbitrary Python objects won't be constructed.
+"""
+
+import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+
+def load(stream):
+    """
+    Args:
+        stream (str or file): YAML document.
+
+    Returns:
+        object: The loaded document.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump(data, stream=None):
+    """
+    Args:
+        data (object): Data made of standard types (dicts, lists, strings, numbers, etc.).
+        stream (file): File to write the YAML document to.
+
+    Returns:
+        str: The YAML document if `stream` wasn't given, None otherwise.
+    """
+    return yaml.dump(data, stream, Dumper=SafeDumper, default_flow_style=False, width=1000)
+
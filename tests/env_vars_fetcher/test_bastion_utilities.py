@@ -14,9 +14,12 @@
 # limitations under the License.
 #
 
+import subprocess
+
+import mock
 import pytest
 
-from apployer.fetcher.bastion_utilities import CFConfExtractor
+from apployer.fetcher.bastion_utilities import CFConfExtractor, MANIFESTS_DELIMITER
 
 @pytest.fixture
 def fetcher_config():
@@ -62,3 +65,70 @@ def test_set_smtps_for_port(cf_conf_extractor):
 
 def test_protocol_not_set_for_unknown_port(cf_conf_extractor):
     assert None == cf_conf_extractor._determine_smtp_protocol(111111)
+
+
+def test_get_manifests_mtimes(cf_conf_extractor, monkeypatch):
+    ssh_call_command = mock.Mock(return_value='1466000000\n\n')
+    monkeypatch.setattr(cf_conf_extractor, 'ssh_call_command', ssh_call_command)
+
+    assert cf_conf_extractor.get_manifests_mtimes() == [1466000000, None]
+    assert 'docker-openstack.yml' in ssh_call_command.call_args[0][0]
+    assert 'cf-openstack-tiny.yml' in ssh_call_command.call_args[0][0]
+
+
+def test_extract_variables_in_one_command(cf_conf_extractor, monkeypatch):
+    docker_vpc_yml = '''
+properties:
+  nats:
+    machines: [10.0.0.5]
+jobs:
+- networks:
+  - static_ips: [10.0.0.6]'''
+    cf_tiny_yml = '''
+meta:
+  admin_secret: admin-pass
+  secret: secret
+  app_domains: apps.example.com
+  domain: example.com
+  login_smtp:
+    senderEmail: tap@example.com
+    password: smtp-pass
+    user: smtp-user
+    port: 465
+    host: smtp.example.com
+'''
+    ssh_call_command = mock.Mock(return_value='{0}\n\n{1}\n{2}\n\n{1}\n'.format(
+        docker_vpc_yml, MANIFESTS_DELIMITER, cf_tiny_yml))
+    monkeypatch.setattr(cf_conf_extractor, 'ssh_call_command', ssh_call_command)
+
+    settings = cf_conf_extractor.get_environment_settings()
+
+    assert ssh_call_command.call_count == 1
+    assert settings['nats_ip'] == '10.0.0.5'
+    assert settings['h2o_provisioner_host'] == '10.0.0.6'
+    assert settings['cf_admin_password'] == 'admin-pass'
+    assert settings['smtp_user'] == '"smtp-user"'
+    assert settings['smtp_protocol'] == 'smtps'
+
+
+def test_extract_variables_missing_manifest(cf_conf_extractor, monkeypatch):
+    monkeypatch.setattr(cf_conf_extractor, 'ssh_call_command', mock.Mock(return_value=''))
+
+    with pytest.raises(IOError):
+        cf_conf_extractor.get_environment_settings()
+
+
+def test_read_manifests_stops_at_missing_one(cf_conf_extractor, tmpdir, monkeypatch):
+    tmpdir.join('first.yml').write('a: 1')
+    tmpdir.join('third.yml').write('c: 3')
+    manifests_paths = [tmpdir.join(name).strpath for name in ('first.yml', 'second.yml', 'third.yml')]
+    monkeypatch.setattr(cf_conf_extractor, 'ssh_call_command',
+                        lambda command: subprocess.Popen(command, shell=True,
+                                                         stdout=subprocess.PIPE).communicate()[0])
+
+    assert cf_conf_extractor._read_manifests([manifests_paths[0], manifests_paths[2]]) == \
+        [{'a': 1}, {'c': 3}]
+    with pytest.raises(IOError) as exc_info:
+        cf_conf_extractor._read_manifests(manifests_paths)
+    assert 'second.yml' in str(exc_info.value)
+    assert 'No such file' in str(exc_info.value)
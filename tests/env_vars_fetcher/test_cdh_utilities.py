@@ -14,12 +14,17 @@
 # limitations under the License.
 #
 
+import base64
+import json
+import os
+import subprocess
 from collections import namedtuple
 
 import mock
 import pytest
 
-from apployer.fetcher.cdh_utilities import CdhConfExtractor
+from apployer.fetcher.cdh_utilities import (CdhApiHelper, CdhConfExtractor, NoCdhServiceError,
+                                            KERBEROS_BUNDLE_SCRIPT, _DeploymentIndex)
 
 
 @pytest.fixture
@@ -85,3 +90,248 @@ def test_create_and_close_SSHConnection(mock_policy, ssh_client, cdh_conf_extrac
         key_filename=cdh_conf_extractor._key,
         password=cdh_conf_extractor._key_password,
         username=cdh_conf_extractor._username)
+
+
+def test_get_deployments_conf_runs_only_needed_providers(cdh_conf_extractor, monkeypatch):
+    generate_kerberos_bundle = mock.Mock(
+        side_effect=lambda items: {item: 'base64 of ' + item for item in items})
+    monkeypatch.setattr(cdh_conf_extractor, 'generate_kerberos_bundle', generate_kerberos_bundle)
+    monkeypatch.setattr(cdh_conf_extractor, '_get_deployment',
+                        lambda: pytest.fail("Deployment document shouldn't be needed."))
+
+    conf = cdh_conf_extractor.get_deployments_conf(
+        ['hdfs_keytab_value', 'krb5_base64', 'auth_gateway_profile'])
+
+    assert conf['hdfs_keytab_value'] == 'base64 of hdfs'
+    assert conf['krb5_base64'] == 'base64 of /etc/krb5.conf'
+    assert 'sentry' in conf['auth_gateway_profile']
+    assert 'vcap_keytab_value' not in conf
+    generate_kerberos_bundle.assert_called_once_with(['/etc/krb5.conf', 'hdfs'])
+
+
+def test_generate_kerberos_bundle(cdh_conf_extractor, monkeypatch):
+    ssh_connection = mock.MagicMock()
+    monkeypatch.setattr(cdh_conf_extractor, 'ssh_connection', ssh_connection)
+    bundle_output = (
+        'Warning: Permanently added 10.10.10.11 to the list of known hosts.\r\n'
+        '--- apployer bundle entry: hdfs\r\n'
+        'AAAA\r\nBBBB\r\n'
+        '--- apployer bundle entry end 0\r\n'
+        '--- apployer bundle entry: /etc/krb5.conf\r\n'
+        'CCCC\r\n'
+        '--- apployer bundle entry end 0\r\n'
+        'Connection to 10.10.10.11 closed.\r\n')
+    ssh_call_command = mock.Mock(return_value=bundle_output)
+    monkeypatch.setattr(cdh_conf_extractor, 'ssh_call_command', ssh_call_command)
+
+    bundle = cdh_conf_extractor.generate_kerberos_bundle(['hdfs', '/etc/krb5.conf'])
+    cdh_conf_extractor.generate_keytab('hdfs')
+
+    assert bundle == {'hdfs': 'AAAABBBB', '/etc/krb5.conf': 'CCCC'}
+    assert ssh_connection.open_sftp.call_count == 1
+    # one upload of the script and two invocations of it
+    assert ssh_call_command.call_count == 3
+
+
+def test_kerberos_bundle_script(cdh_conf_extractor, tmpdir):
+    fake_bin = tmpdir.mkdir('bin')
+    fake_bin.join('sudo').write('#!/bin/sh\nexec "$@"\n')
+    # a fake of kadmin.local that writes keytabs requested on stdin and counts its sessions
+    fake_bin.join('kadmin.local').write(
+        '#!/bin/sh\n'
+        'echo session >> {}\n'
+        'while read COMMAND OPTION KEYTAB_OPTION KEYTAB PRINCIPAL; do\n'
+        '    echo "keytab of $PRINCIPAL" > "$KEYTAB"\n'
+        'done\n'.format(tmpdir.join('sessions').strpath))
+    for fake_command in fake_bin.listdir():
+        fake_command.chmod(0700)
+    script = tmpdir.join('bundle.sh')
+    script.write(KERBEROS_BUNDLE_SCRIPT)
+    some_file = tmpdir.join('krb5.conf')
+    some_file.write('some config')
+    env = dict(os.environ, PATH=fake_bin.strpath + os.pathsep + os.environ['PATH'])
+
+    missing_file_path = tmpdir.join('missing.pem').strpath
+
+    # errors are in the output, like with "ssh -t"
+    output = subprocess.check_output(['sh', script.strpath, 'hdfs', some_file.strpath, 'vcap',
+                                      missing_file_path], env=env, stderr=subprocess.STDOUT)
+
+    bundle, errors = cdh_conf_extractor._parse_kerberos_bundle(output)
+    assert {item: base64.b64decode(value) for item, value in bundle.items()} == {
+        'hdfs': 'keytab of hdfs\n',
+        some_file.strpath: 'some config',
+        'vcap': 'keytab of vcap\n',
+    }
+    assert list(errors) == [missing_file_path]
+    assert errors[missing_file_path].startswith('exit status 1: ')
+    assert tmpdir.join('sessions').read() == 'session\n'
+
+
+@pytest.mark.parametrize('entry_output, error', [
+    ('sudo: no tty present and no askpass program specified\r\n'
+     '--- apployer bundle entry end 1\r\n', 'exit status 1: sudo: no tty present'),
+    ('base64: /etc/krb5.conf: No such file\r\n'
+     '--- apployer bundle entry end 0\r\n', 'output is not base64'),
+    ('AAAA\r\n'
+     '--- apployer bundle entry end\r\n', 'exit status unknown'),
+])
+def test_generate_kerberos_bundle_failed_item(cdh_conf_extractor, monkeypatch, entry_output, error):
+    monkeypatch.setattr(cdh_conf_extractor, 'ssh_connection', mock.MagicMock())
+    monkeypatch.setattr(cdh_conf_extractor, 'ssh_call_command', mock.Mock(return_value=(
+        '--- apployer bundle entry: hdfs\r\n'
+        'AAAA\r\n'
+        '--- apployer bundle entry end 0\r\n'
+        '--- apployer bundle entry: /etc/krb5.conf\r\n' + entry_output)))
+
+    with pytest.raises(IOError) as exc_info:
+        cdh_conf_extractor.generate_kerberos_bundle(['hdfs', '/etc/krb5.conf'])
+    assert '/etc/krb5.conf: ' + error in str(exc_info.value)
+    assert 'hdfs' not in str(exc_info.value)
+
+
+def test_generate_kerberos_bundle_missing_item(cdh_conf_extractor, monkeypatch):
+    monkeypatch.setattr(cdh_conf_extractor, 'ssh_connection', mock.MagicMock())
+    monkeypatch.setattr(cdh_conf_extractor, 'ssh_call_command', mock.Mock(return_value=''))
+
+    with pytest.raises(IOError):
+        cdh_conf_extractor.generate_kerberos_bundle(['hdfs'])
+
+
+def test_cdh_extractor_provides():
+    assert CdhConfExtractor.provides('master_node_host_3')
+    assert CdhConfExtractor.provides('import_hadoop_conf_hdfs')
+    assert not CdhConfExtractor.provides('smtp_host')
+
+
+def test_cdh_api_helper_fetches_once():
+    ConfigEntry = namedtuple('ConfigEntry', 'value default')
+    group_config = {'rest_port': ConfigEntry(None, '8090'),
+                    'basic_auth_user': ConfigEntry('hgm', None),
+                    'basic_auth_pass': ConfigEntry('secret', None)}
+    role = mock.Mock(hostRef=mock.Mock(hostId='host-1'))
+    role.name = 'HGM-RESTSERVER'
+    service = mock.Mock(type='HADOOPGROUPSMAPPING')
+    service.name = 'hgm'
+    service.get_all_roles.return_value = [role]
+    service.get_role_config_group.return_value.get_config.return_value = group_config
+    cdh_api = mock.MagicMock()
+    cdh_api.get_all_clusters.return_value[0].get_all_services.return_value = [service]
+    cdh_api.get_all_hosts.return_value = [mock.Mock(hostId='host-1', hostname='cdh-worker-1')]
+    helper = CdhApiHelper(cdh_api)
+
+    hgm_service = helper.get_service_from_cdh('HADOOPGROUPSMAPPING')
+    values = [helper.get_entry_from_group(hgm_service, name, 'HGM-RESTSERVER-BASE')
+              for name in ('rest_port', 'basic_auth_user', 'basic_auth_pass')]
+    hosts = [helper.get_host(helper.get_service_from_cdh('HADOOPGROUPSMAPPING'), 'HGM-RESTSERVER'),
+             helper.get_host(hgm_service)]
+
+    assert values == ['8090', 'hgm', 'secret']
+    assert hosts == ['cdh-worker-1', 'cdh-worker-1']
+    assert cdh_api.get_all_clusters.call_count == 1
+    assert cdh_api.get_all_hosts.call_count == 1
+    assert service.get_all_roles.call_count == 1
+    assert service.get_role_config_group.return_value.get_config.call_count == 1
+    with pytest.raises(NoCdhServiceError):
+        helper.get_service_from_cdh('SENTRY')
+
+
+def test_get_client_configs(cdh_conf_extractor, monkeypatch):
+    client_configs = {service: 'client config of {}'.format(service) * 1000
+                      for service in ('HDFS', 'HBASE', 'YARN', 'HIVE')}
+    requested_urls = []
+
+    def get(url, stream):
+        assert stream
+        requested_urls.append(url)
+        content = client_configs[url.split('/')[-2]]
+        response = mock.Mock()
+        response.iter_content.side_effect = lambda chunk_size: (
+            content[i:i + 1000] for i in range(0, len(content), 1000))
+        return response
+    session = mock.Mock(get=get)
+    monkeypatch.setattr(cdh_conf_extractor, '_session', session)
+    cdh_conf_extractor._local_bind_address = 'localhost'
+    cdh_conf_extractor._local_bind_port = 7180
+
+    conf = cdh_conf_extractor.get_deployments_conf(
+        ['import_hadoop_conf_hdfs', 'import_hadoop_conf_hbase', 'import_hadoop_conf_yarn',
+         'import_hadoop_conf_hive'])
+
+    assert conf == {
+        'import_hadoop_conf_hdfs': base64.standard_b64encode(client_configs['HDFS']),
+        'import_hadoop_conf_hbase': base64.standard_b64encode(client_configs['HBASE']),
+        'import_hadoop_conf_yarn': base64.standard_b64encode(client_configs['YARN']),
+        'import_hadoop_conf_hive': base64.standard_b64encode(client_configs['HIVE']),
+    }
+    assert len(requested_urls) == 4
+
+
+@mock.patch('apployer.fetcher.cdh_utilities.ApiResource')
+@mock.patch('apployer.fetcher.cdh_utilities.SSHTunnelForwarder')
+def test_tunnel_on_ephemeral_port(mock_tunnel_forwarder, mock_api_resource, fetcher_config,
+                                  monkeypatch):
+    monkeypatch.setattr(CdhConfExtractor, 'extract_cdh_manager_host', lambda self: '10.10.10.11')
+    tunnels = [mock.Mock(local_bind_port=port) for port in (41001, 41002)]
+    mock_tunnel_forwarder.side_effect = tunnels
+
+    with CdhConfExtractor(fetcher_config) as first_extractor, \
+            CdhConfExtractor(fetcher_config) as second_extractor:
+        first_extractor._get_helper()
+        second_extractor._get_helper()
+        assert first_extractor._local_bind_port == 41001
+        assert second_extractor._local_bind_port == 41002
+
+    for call_args in mock_tunnel_forwarder.call_args_list:
+        assert call_args[1]['local_bind_address'] == ('localhost', 0)
+        assert call_args[1]['remote_bind_address'] == ('10.10.10.11', 7180)
+    assert [call_args[1]['server_port'] for call_args in mock_api_resource.call_args_list] == \
+        [41001, 41002]
+    assert all(tunnel.stop.called for tunnel in tunnels)
+
+
+def test_get_nodes_from_deployment(cdh_conf_extractor, monkeypatch):
+    hosts = [
+        {'hostId': 'id-{}'.format(hostname), 'hostname': hostname, 'config': {'items': []}}
+        for hostname in ('cdh-worker-1.node', 'cdh-master-1.node', 'cdh-manager.node',
+                         'cdh-master-0.node', 'cdh-worker-0.node')]
+    deployment_document = json.dumps({
+        'timestamp': '2016-06-01T12:00:00',
+        'hosts': hosts,
+        'clusters': [{'name': 'CDH-cluster', 'services': [
+            {'name': 'HDFS', 'type': 'HDFS', 'config': {'items': [{'name': 'dfs_replication'}]},
+             'roles': [{'name': 'HDFS-DATANODE', 'hostRef': {'hostId': 'id-cdh-worker-0.node'}},
+                       {'name': 'HDFS-NAMENODE', 'hostRef': {'hostId': 'id-cdh-master-0.node'}}]},
+            {'name': 'HUE', 'type': 'HUE',
+             'roles': [{'name': 'HUE-HUE_SERVER', 'hostRef': {'hostId': 'id-cdh-master-1.node'}}]},
+        ]}],
+    })
+    session = mock.Mock()
+    session.get.return_value.content = deployment_document
+    monkeypatch.setattr(cdh_conf_extractor, '_session', session)
+    cdh_conf_extractor._local_bind_address = 'localhost'
+    cdh_conf_extractor._local_bind_port = 7180
+
+    conf = cdh_conf_extractor.get_deployments_conf(
+        ['namenode_internal_host', 'hue_node', 'h2o_node', 'master_node_host_*',
+         'cloudera_manager_internal_host'])
+
+    assert conf['namenode_internal_host'] == 'cdh-master-0.node'
+    assert conf['hue_node'] == 'cdh-master-1.node'
+    assert conf['h2o_node'] == 'cdh-worker-0.node'
+    assert conf['master_node_host_1'] == 'cdh-master-1.node'
+    assert conf['master_node_host_2'] == 'cdh-master-0.node'
+    assert conf['cloudera_manager_internal_host'] == 'cdh-manager.node'
+    assert session.get.call_count == 1
+    assert cdh_conf_extractor._get_deployment().get_host('id-cdh-manager.node') == \
+        {'hostId': 'id-cdh-manager.node', 'hostname': 'cdh-manager.node'}
+
+
+def test_find_hosts_by_substring():
+    deployment = _DeploymentIndex({'hosts': [
+        {'hostId': 'id-{}'.format(hostname), 'hostname': hostname}
+        for hostname in ('x-cdh-master-2.node', 'cdh-worker-0.node', 'cdh-master-0.node')]})
+
+    assert [host['hostname'] for host in deployment.find_hosts('cdh-master')] == \
+        ['x-cdh-master-2.node', 'cdh-master-0.node']
+    assert deployment.find_hosts('cdh-manager') == []
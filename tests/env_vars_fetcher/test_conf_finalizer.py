@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import mock
+import pytest
+
+from apployer.fetcher.conf_finalizer import (ConfigResolver, deduce_final_configuration,
+                                             DerivedVariable, get_base_variables)
+
+THRIFT_INPUTS = {'external_tool_arcadia': '', 'kerberos_host': '', 'kerberos_realm': 'CLOUDERA',
+                 'namenode_internal_host': 'nn.node', 'arcadia_node': 'arcadia.node'}
+
+
+@pytest.mark.parametrize('changed_inputs, thrift_server_url', [
+    ({}, 'jdbc:hive2://nn.node:10000/'),
+    ({'kerberos_host': 'kdc.node'},
+     'jdbc:hive2://nn.node:10000/default;principal=hive/nn.node@CLOUDERA;auth=kerberos'),
+    ({'external_tool_arcadia': 'true'}, 'jdbc:hive2://arcadia.node:31050/;auth=noSasl'),
+    ({'external_tool_arcadia': 'true', 'kerberos_host': 'kdc.node'},
+     'jdbc:hive2://arcadia.node:31050/;principal=arcadia-user/arcadia.node@CLOUDERA;'
+     'auth=kerberos'),
+])
+def test_deduce_thrift_server_url(changed_inputs, thrift_server_url):
+    config = dict(THRIFT_INPUTS, other='value', **changed_inputs)
+
+    final_config = deduce_final_configuration(config)
+
+    assert final_config == dict(config, thrift_server_url=thrift_server_url)
+
+
+def test_deduce_only_needed_variables():
+    assert deduce_final_configuration({'other': 'value'}, ['other']) == {'other': 'value'}
+
+
+def test_get_base_variables():
+    derived_variables = [DerivedVariable('c', ('a', 'b'), None),
+                         DerivedVariable('d', ('c', 'e'), None)]
+
+    assert get_base_variables(['d', 'x'], derived_variables) == {'a', 'b', 'e', 'x'}
+    assert get_base_variables(['thrift_server_url']) == set(THRIFT_INPUTS)
+
+
+def test_resolver_computes_only_needed_variables_once():
+    get_c = mock.Mock(side_effect=lambda a, b: a + b)
+    get_d = mock.Mock(side_effect=lambda e: e * 2)
+    get_f = mock.Mock(side_effect=lambda c, a: c + a)
+    get_g = mock.Mock(side_effect=lambda c: c * 10)
+    resolver = ConfigResolver({'a': 1, 'b': 2, 'e': 3}, [DerivedVariable('c', ('a', 'b'), get_c),
+                                                        DerivedVariable('d', ('e',), get_d),
+                                                        DerivedVariable('f', ('c', 'a'), get_f),
+                                                        DerivedVariable('g', ('c',), get_g)])
+
+    assert resolver.resolve(['f', 'g']) == {'a': 1, 'b': 2, 'e': 3, 'f': 4, 'g': 30}
+    assert resolver['f'] == 4
+
+    assert get_c.call_count == 1
+    assert get_d.call_count == 0
+    assert get_f.call_count == 1
+    assert get_g.call_count == 1
+
+
+def test_resolver_cycle():
+    with pytest.raises(ValueError):
+        ConfigResolver({}, [DerivedVariable('a', ('b',), None),
+                            DerivedVariable('b', ('a',), None)])
@@ -0,0 +1,56 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import stat
+import time
+
+from apployer.fetcher.config_cache import FetchedConfigCache
+
+FETCHER_CONFIG = {'machines': {'cf-bastion': {'hostname': '10.10.10.10'}}}
+
+
+def test_cache_roundtrip(tmpdir):
+    cache_path = str(tmpdir.join('cache'))
+    cache = FetchedConfigCache(FETCHER_CONFIG, cache_path)
+
+    assert cache.get('CDH', ['a']) is None
+    cache.put('CDH', ['a', 'b'], {'a': 'x', 'b': 'y'})
+
+    assert cache.get('CDH', ['a']) == {'a': 'x', 'b': 'y'}
+    assert cache.get('CDH', ['a', 'c']) is None
+    assert cache.get('bastion', ['a']) is None
+    entry_file, = os.listdir(cache_path)
+    assert stat.S_IMODE(os.stat(os.path.join(cache_path, entry_file)).st_mode) == 0600
+
+
+def test_cache_validity(tmpdir, monkeypatch):
+    cache_path = str(tmpdir)
+    FetchedConfigCache(FETCHER_CONFIG, cache_path, ttl=60).put('bastion', ['a'], {'a': 'x'},
+                                                              [100, 200])
+
+    assert FetchedConfigCache(FETCHER_CONFIG, cache_path).get('bastion', ['a'], [100, 200]) == \
+        {'a': 'x'}
+    assert FetchedConfigCache(FETCHER_CONFIG, cache_path).get('bastion', ['a'], [100, 201]) is None
+    assert FetchedConfigCache(FETCHER_CONFIG, cache_path, refetch=True).get(
+        'bastion', ['a'], [100, 200]) is None
+    other_config = {'machines': {'cf-bastion': {'hostname': '10.10.10.11'}}}
+    assert FetchedConfigCache(other_config, cache_path).get('bastion', ['a'], [100, 200]) is None
+
+    current_time = time.time()
+    monkeypatch.setattr(time, 'time', lambda: current_time + 61)
+    assert FetchedConfigCache(FETCHER_CONFIG, cache_path, ttl=60).get(
+        'bastion', ['a'], [100, 200]) is None
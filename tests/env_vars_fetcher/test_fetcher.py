@@ -14,8 +14,18 @@
 # limitations under the License.
 #
 
+import os
+import threading
+import time
+
+import mock
 import pytest
+import yaml
 
+from apployer.appstack import AppStack
+from apployer.fetcher import fetcher
+from apployer.fetcher.cdh_utilities import CdhConfExtractor
+from apployer.fetcher.config_cache import FetchedConfigCache
 from apployer.fetcher.fetcher import _fill_config_defaults
 
 MACHINES_KEY = 'machines'
@@ -39,3 +49,120 @@ def test_get_config_with_defaults(openstack_env, username, proper_username):
     fetcher_config['openstack_env'] = openstack_env
     config_with_defaults = _fill_config_defaults(fetcher_config)
     assert config_with_defaults[MACHINES_KEY][CDH_LAUNCHER_KEY]['username'] == 'ec2-user'
+
+
+def test_fill_appstack(tmpdir):
+    expanded_appstack_dict = {
+        'apps': [
+            {'name': 'app_a',
+             'app_properties': {
+                 'env': {'PASSWORD': '{{ password }}', 'PORT': 8080, 'URL': 'http://{{ domain }}'},
+                 'services': ['{{ service }}', 'other_service']}},
+            {'name': 'app_b', 'app_properties': {'env': {'URL': 'http://{{ domain }}'}}},
+        ],
+        'domain': '{{ domain }}',
+    }
+    filled_appstack_path = tmpdir.join('filled_appstack.yml')
+    config = {'password': "'quoted: {yaml}' # bla", 'domain': 'example.com', 'service': 'srv'}
+
+    filled_appstack = fetcher._fill_appstack(
+        expanded_appstack_dict, config, filled_appstack_path.strpath)
+
+    app_a, app_b = filled_appstack.apps
+    assert app_a.app_properties == {
+        'env': {'PASSWORD': "'quoted: {yaml}' # bla", 'PORT': 8080, 'URL': 'http://example.com'},
+        'services': ['srv', 'other_service']}
+    assert app_a.app_properties['env']['URL'] is app_b.app_properties['env']['URL']
+    assert filled_appstack.domain == 'example.com'
+    assert AppStack.from_appstack_dict(yaml.safe_load(filled_appstack_path.read())) == \
+        filled_appstack
+
+
+def test_get_template_variables():
+    appstack_dict = {
+        'apps': [{'name': 'app_a', 'app_properties': {'env': {
+            'URL': 'http://{{ domain }}',
+            'SUFFIX': '{{ suffix if kerberos_host != "" }}',
+            'PLAIN': 'bla'}}}],
+        'domain': '{{ domain }}',
+    }
+
+    assert fetcher._get_template_variables(appstack_dict) == {'domain', 'suffix', 'kerberos_host'}
+
+
+@mock.patch('apployer.fetcher.bastion_utilities.CFConfExtractor')
+@mock.patch('apployer.fetcher.cdh_utilities.CdhConfExtractor')
+def test_get_environment_config_only_needed(mock_cdh_extractor, mock_cf_extractor):
+    mock_cdh_extractor.provides.side_effect = CdhConfExtractor.provides
+    get_conf = mock_cdh_extractor.return_value.__enter__.return_value.get_deployments_conf
+    get_conf.return_value = {'hue_node': 'host', 'master_node_host_1': 'master'}
+
+    fetched_config = fetcher._get_environment_config(
+        {}, ['hue_node', 'master_node_host_1', 'unknown_variable'])
+
+    assert fetched_config == {'hue_node': 'host', 'master_node_host_1': 'master'}
+    get_conf.assert_called_once_with(['hue_node', 'master_node_host_1'])
+    assert not mock_cf_extractor.called
+
+
+def _sleep_and_return(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def _fail():
+    raise IOError('no connection')
+
+
+def _meet(own_event, other_event, value):
+    own_event.set()
+    return value if other_event.wait(5) else None
+
+
+def test_run_fetches_concurrently():
+    # each fetch waits for the other one to start, so they can only succeed when run concurrently
+    cdh_started, bastion_started = threading.Event(), threading.Event()
+
+    results = fetcher._run_fetches([
+        fetcher._Fetch('CDH', _meet, (cdh_started, bastion_started, {'a': 1}), 10),
+        fetcher._Fetch('bastion', _meet, (bastion_started, cdh_started, {'b': 2}), 10),
+    ])
+
+    assert results == [{'a': 1}, {'b': 2}]
+
+
+def test_run_fetches_errors():
+    with pytest.raises(fetcher.ConfigFetchError) as exc_info:
+        fetcher._run_fetches([
+            fetcher._Fetch('CDH', _sleep_and_return, (2, {}), 0.1),
+            fetcher._Fetch('bastion', _fail, (), 5),
+        ])
+
+    message = str(exc_info.value)
+    assert 'fetching configuration from CDH timed out after 0.1 seconds' in message
+    assert 'fetching configuration from bastion failed: IOError: no connection' in message
+
+
+@mock.patch('apployer.fetcher.cdh_utilities.CdhConfExtractor')
+def test_fetch_cdh_config_cached(mock_cdh_extractor, tmpdir):
+    get_conf = mock_cdh_extractor.return_value.__enter__.return_value.get_deployments_conf
+    get_conf.return_value = {'hue_node': 'host'}
+    config_cache = FetchedConfigCache({}, str(tmpdir))
+
+    first_config = fetcher._fetch_cdh_config({}, ['hue_node'], config_cache)
+    second_config = fetcher._fetch_cdh_config({}, ['hue_node'], config_cache)
+
+    assert first_config == second_config == {'hue_node': 'host'}
+    assert get_conf.call_count == 1
+
+
+@pytest.mark.parametrize('fetched_config_ttl, cached', [(None, True), (60, True), (0, False)])
+def test_config_cache_ttl(tmpdir, fetched_config_ttl, cached):
+    fetcher_config = {'fetched_config_ttl': fetched_config_ttl}
+    cache_path = str(tmpdir.join('cache'))
+
+    fetcher._get_config_cache(fetcher_config, cache_path, False).put('CDH', ['a'], {'a': 'x'})
+
+    cached_config = fetcher._get_config_cache(fetcher_config, cache_path, False).get('CDH', ['a'])
+    assert cached_config == ({'a': 'x'} if cached else None)
+    assert os.path.exists(cache_path) == cached
@@ -0,0 +1,118 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import stat
+import time
+
+from click.testing import CliRunner
+import mock
+import pytest
+import requests
+
+from apployer.fetcher.bastion_utilities import CFConfExtractor
+from apployer.fetcher.cdh_utilities import CdhApiHelper, NoCdhServiceError
+from apployer.fetcher.traffic_recorder import cli, recording, replaying, ReplayError
+
+FETCHER_CONFIG = {
+    'openstack_env': True,
+    'machines': {
+        'cf-bastion': {
+            'hostname': '10.10.10.10',
+            'hostport': 22,
+            'username': 'ubuntu',
+            'key_filename': 'key.pem',
+            'key_password': None,
+            'path_to_cf_tiny_yml': None,
+            'path_to_docker_vpc_yml': None
+        }
+    }
+}
+
+
+def _get_service(helper, name):
+    if name == 'SENTRY':
+        raise NoCdhServiceError('No SENTRY in CDH services.')
+    return mock.Mock(type=name)
+
+
+def _get(session, url, **kwargs):
+    time.sleep(0.1)
+    return mock.Mock(status_code=200, content='content of ' + url.split('/')[-1])
+
+
+def test_record_and_replay(tmpdir, monkeypatch):
+    bundle_path = str(tmpdir.join('bundle.json'))
+    # a bundle from before, readable by everyone
+    tmpdir.join('bundle.json').write('{}')
+    os.chmod(bundle_path, 0644)
+    original_ssh_call_command = vars(CFConfExtractor)['ssh_call_command']
+    monkeypatch.setattr(CFConfExtractor, 'ssh_call_command',
+                        lambda self, command: 'output of ' + command)
+    monkeypatch.setattr(requests.Session, 'get', _get)
+    monkeypatch.setattr(CdhApiHelper, 'get_service_from_cdh', _get_service)
+    monkeypatch.setattr(CdhApiHelper, 'get_entry',
+                        lambda self, service, name: service.type + ' ' + name)
+    extractor = CFConfExtractor(FETCHER_CONFIG)
+    helper = CdhApiHelper(None)
+
+    with recording(bundle_path):
+        assert extractor.ssh_call_command('ls') == 'output of ls'
+        response = requests.Session().get('http://localhost:41001/api/v10/cm/deployment')
+        assert response.content == 'content of deployment'
+        assert helper.get_entry(helper.get_service_from_cdh('OOZIE'), 'port') == 'OOZIE port'
+        with pytest.raises(NoCdhServiceError):
+            helper.get_service_from_cdh('SENTRY')
+    monkeypatch.undo()
+    assert stat.S_IMODE(os.stat(bundle_path).st_mode) == 0600
+
+    with replaying(bundle_path, with_latency=True):
+        # connecting to bastion is replaced too, so nothing leaves the machine
+        with CFConfExtractor(FETCHER_CONFIG) as replayed_extractor:
+            assert replayed_extractor.ssh_call_command('ls') == 'output of ls'
+        start_time = time.time()
+        response = requests.Session().get('http://localhost:41002/api/v10/cm/deployment',
+                                          stream=True)
+        assert time.time() - start_time >= 0.1
+        assert ''.join(response.iter_content(4)) == 'content of deployment'
+        assert helper.get_entry(helper.get_service_from_cdh('OOZIE'), 'port') == 'OOZIE port'
+        with pytest.raises(NoCdhServiceError):
+            helper.get_service_from_cdh('SENTRY')
+        with pytest.raises(ReplayError):
+            extractor.ssh_call_command('ls')
+
+    assert vars(CFConfExtractor)['ssh_call_command'] is original_ssh_call_command
+
+
+def test_replay_in_temporary_directory(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir.strpath)
+    with recording('bundle.json'):
+        pass
+    filled_paths = []
+
+    def fill_appstack(expanded_appstack, fetcher_config, refetch, filled_appstack_path,
+                      config_cache_path):
+        assert refetch
+        assert os.path.dirname(filled_appstack_path) == os.path.dirname(config_cache_path)
+        filled_paths.append(filled_appstack_path)
+    monkeypatch.setattr('apployer.fetcher.traffic_recorder.fill_appstack', fill_appstack)
+
+    result = CliRunner().invoke(cli, ['replay', 'bundle.json', 'expanded_appstack.yml'])
+
+    assert result.exit_code == 0
+    assert not filled_paths[0].startswith(tmpdir.strpath)
+    assert not os.path.exists(os.path.dirname(filled_paths[0]))
+    assert tmpdir.listdir() == [tmpdir.join('bundle.json')]
@@ -154,3 +154,54 @@ def test_dict_is_part_of(dict_a, dict_b, is_part_of):
 ])
 def test_normalize_to_megabytes(value_string, megabytes):
     assert app_compare._normalize_to_megabytes(value_string) == megabytes
+
+
+@pytest.mark.parametrize('lower_version, higher_version', [
+    ('', '0.0.1'),
+    ('0.1.2', '0.1.3'),
+    ('0.1.9', '0.1.10'),
+    ('0.9', '0.10.0'),
+    ('1.0a1', '1.0'),
+    ('1.0.dev3', '1.0a1'),
+    ('1.0rc2', '1.0'),
+    ('1.0', '1.0.post1'),
+    ('1.0.post1', '1.0.1'),
+])
+def test_app_version_ordering(lower_version, higher_version):
+    assert app_compare._AppVersion(lower_version) < app_compare._AppVersion(higher_version)
+    assert app_compare._AppVersion(higher_version) > app_compare._AppVersion(lower_version)
+
+
+def test_app_version_trailing_zeros():
+    assert app_compare._AppVersion('1.0') == app_compare._AppVersion('1.0.0')
+    assert app_compare._AppVersion('1') == app_compare._AppVersion('1.0')
+
+
+# Versions of TAP applications (from their VERSION env) and other forms found in artifacts.
+COMPARED_VERSIONS = [
+    '', '0.0.1', '0.1.2', '0.1.3', '0.1.10', '0.4.5', '0.5.12', '0.9', '0.10.0', '1', '1.0',
+    '1.0.0', '1.0a1', '1.0alpha1', '1.0b2', '1.0-beta', '1.0c1', '1.0rc1', '1.0pre1',
+    '1.0preview1', '1.0.0-rc.2', '1.0.dev3', '1.0a1.dev1', '1.0.post1', '1.0-1', '1.0.rev2',
+    '1.0+local.7', '1.0+local.abc', '1!0.1', '1.0-SNAPSHOT', '1.0.0-SNAPSHOT', '0.9-SNAPSHOT',
+    '1.0.SNAPSHOT', '1.0-dev-SNAPSHOT', 'abc', 'latest', '2016.06.14', 'v1.2',
+]
+
+
+@pytest.mark.parametrize('version', COMPARED_VERSIONS)
+def test_app_version_parity_with_pkg_resources(version):
+    import pkg_resources
+    parsed_version = pkg_resources.parse_version(version)
+    app_version = app_compare._AppVersion(version)
+
+    for other_version in COMPARED_VERSIONS:
+        parsed_other_version = pkg_resources.parse_version(other_version)
+        app_other_version = app_compare._AppVersion(other_version)
+        assert (app_version < app_other_version) == (parsed_version < parsed_other_version), \
+            other_version
+        assert (app_version == app_other_version) == (parsed_version == parsed_other_version), \
+            other_version
+
+
+def test_app_version_compared_to_other_types():
+    assert app_compare._AppVersion('1.0') != '1.0'
+    assert not app_compare._AppVersion('1.0') == None
@@ -18,20 +18,49 @@ import copy
 
 import pytest
 
-from apployer.appstack import AppConfig, AppStack, DataContainer, MalformedAppStackError
+from apployer.appstack import (AppConfig, AppStack, BrokerConfig, DataContainer,
+                               MalformedAppStackError, ServiceInstance, UserProvidedService)
 from .fake_appstack import (TEST_APP_X, TEST_APP_Y, TEST_APPSTACK_DICT,
                             TEST_APPSTACK_USER_PROVIDED_SERVICES, TEST_APPSTACK, TEST_APP_MANIFESTS,
                             TEST_APPSTACK_WITH_MANIFESTS, BUILDPACK_NAME)
 
 
+class _FakeContainer(DataContainer):
+    __slots__ = ('something', 'hidden')
+    _serialized_fields = ('something',)
+
+    def __init__(self, something=None, hidden=None):
+        self.something = something
+        self.hidden = hidden
+
+
 def test_data_container_eq():
-    a, b = DataContainer(), DataContainer()
+    a, b = _FakeContainer(), _FakeContainer()
     assert a == b
     a.something = 'qwerty'
     assert a != b
     assert not a.__eq__('something-else')
 
 
+def test_data_container_to_dict():
+    assert _FakeContainer().to_dict() == {}
+    assert _FakeContainer('qwerty', 'hidden value').to_dict() == {'something': 'qwerty'}
+    nested_container = _FakeContainer([_FakeContainer('a'), 'b'])
+    assert nested_container.to_dict() == {'something': [{'something': 'a'}, 'b']}
+
+
+def test_data_container_has_no_dict():
+    with pytest.raises(AttributeError):
+        AppConfig('bla').some_undeclared_field = 'qwerty'
+
+
+def test_app_config_to_dict_round_trip():
+    app_dict = TEST_APPSTACK_DICT['apps'][0]
+    app_config = AppConfig.from_dict(app_dict)
+    assert 'is_ordered' not in app_config.to_dict()
+    assert AppConfig.from_dict(app_config.to_dict()) == app_config
+
+
 @pytest.mark.parametrize('appstack_properties, manifest, merged_app_properties', [
     (
         {
@@ -113,6 +142,22 @@ def test_parse_appstack():
     assert appstack.buildpacks == [BUILDPACK_NAME]
 
 
+def test_parse_appstack_shares_equal_strings():
+    big_value = ''.join(['x'] * 1000)
+    appstack_dict = {
+        'apps': [{'name': name, 'app_properties': {'env': {'BIG': ''.join(['x'] * 1000)}}}
+                 for name in ('app_a', 'app_b')],
+        'user_provided_services': [{'name': 'upsi', 'credentials': {'big': big_value}}],
+    }
+
+    appstack = AppStack.from_appstack_dict(appstack_dict)
+
+    app_a_value = appstack.apps[0].app_properties['env']['BIG']
+    assert app_a_value == big_value
+    assert app_a_value is appstack.apps[1].app_properties['env']['BIG']
+    assert app_a_value is appstack.user_provided_services[0].credentials['big']
+
+
 def test_parse_invalid_appstack():
     appstack_dict = copy.deepcopy(TEST_APPSTACK_DICT)
     del appstack_dict['apps'][0]['name']
@@ -128,3 +173,157 @@ def test_parse_appstack_nonexistent_registrator():
 def test_merge_manifests():
     expanded_appstack = TEST_APPSTACK.merge_manifests(TEST_APP_MANIFESTS)
     assert TEST_APPSTACK_WITH_MANIFESTS == expanded_appstack
+
+
+def test_merge_manifest_shares_unchanged_fields():
+    app_properties = {'env': {'a': 'b'}, 'disk_quota': '256M'}
+    app_config = AppConfig('test_app', app_properties=app_properties,
+                           user_provided_services=[UserProvidedService('upsi', {'c': 'd'})])
+
+    merged_app_cfg = app_config.merge_manifest({'memory': '64M'})
+
+    assert app_config.app_properties == {'env': {'a': 'b'}, 'disk_quota': '256M'}
+    assert merged_app_cfg.app_properties['env'] is app_properties['env']
+    assert merged_app_cfg.user_provided_services is app_config.user_provided_services
+    assert merged_app_cfg.push_options is app_config.push_options
+
+
+def test_merge_manifests_shares_global_services():
+    expanded_appstack = TEST_APPSTACK.merge_manifests(TEST_APP_MANIFESTS)
+    assert expanded_appstack.user_provided_services is TEST_APPSTACK.user_provided_services
+    assert expanded_appstack.apps is not TEST_APPSTACK.apps
+
+
+def test_data_container_copy_with_changes():
+    app_config = AppConfig('test_app', app_properties={'memory': '64M'})
+
+    app_copy = app_config.copy(register_in='other_app')
+
+    assert app_copy.register_in == 'other_app'
+    assert app_config.register_in is None
+    assert app_copy.app_properties is app_config.app_properties
+    with pytest.raises(AttributeError):
+        app_config.copy(nonexistent_field=1)
+
+
+@pytest.fixture
+def indexed_appstack():
+    provider = AppConfig('provider', artifact_name='artifact',
+                         user_provided_services=[UserProvidedService('upsi', {})],
+                         broker_config=BrokerConfig('broker', 'url', 'user', 'pass',
+                                                    [ServiceInstance('instance', 'plan')]))
+    consumer = AppConfig('consumer', artifact_name='artifact', register_in='provider',
+                         app_properties={'services': ['upsi', 'instance', 'global_upsi']})
+    return AppStack(apps=[provider, consumer],
+                    user_provided_services=[UserProvidedService('global_upsi', {})])
+
+
+def test_appstack_queries(indexed_appstack):
+    provider, consumer = indexed_appstack.apps
+
+    assert indexed_appstack.get_app('consumer') is consumer
+    assert indexed_appstack.get_app('nonexistent') is None
+    assert indexed_appstack.get_apps_by_artifact('artifact') == [provider, consumer]
+    assert indexed_appstack.get_service_provider('upsi') is provider
+    assert indexed_appstack.get_service_provider('instance') is provider
+    assert indexed_appstack.get_service_provider('global_upsi') is None
+    assert indexed_appstack.get_service_consumers('instance') == [consumer]
+    assert indexed_appstack.get_registered_apps('provider') == [consumer]
+    assert indexed_appstack.is_global_service('global_upsi')
+    assert not indexed_appstack.is_global_service('upsi')
+
+
+def test_appstack_queries_after_copy(indexed_appstack):
+    new_app = AppConfig('new_app', user_provided_services=[UserProvidedService('new_upsi', {})])
+
+    copied_appstack = indexed_appstack.copy(apps=indexed_appstack.apps[:1] + [new_app])
+    assert copied_appstack.get_service_provider('new_upsi') is new_app
+    assert copied_appstack.get_app('consumer') is None
+    assert indexed_appstack.get_app('consumer') is not None
+    assert indexed_appstack.get_service_provider('new_upsi') is None
+
+    renamed_appstack = indexed_appstack.copy(domain='example.com')
+    assert renamed_appstack.get_app('consumer') is indexed_appstack.get_app('consumer')
+
+
+def test_appstack_queries_after_deepcopy(indexed_appstack):
+    copied_appstack = copy.deepcopy(indexed_appstack)
+    assert copied_appstack.get_app('consumer') is copied_appstack.apps[1]
+
+
+def test_appstack_service_defined_twice():
+    apps = [AppConfig('app_1', user_provided_services=[UserProvidedService('upsi', {})]),
+            AppConfig('app_2', user_provided_services=[UserProvidedService('upsi', {})])]
+    appstack = AppStack(apps=apps)
+    assert appstack.get_services_provided_twice() == ['upsi']
+    assert appstack.get_service_provider('upsi') is apps[0]
+
+
+@pytest.fixture
+def chained_appstack():
+    """Appstack in which: app_c -> app_b -> app_a (through services), app_d is registered in
+    app_a, app_e is independent."""
+    app_a = AppConfig('app_a', user_provided_services=[UserProvidedService('a_upsi', {})])
+    app_b = AppConfig('app_b', app_properties={'services': ['a_upsi', 'global_upsi']},
+                      broker_config=BrokerConfig('b_broker', 'url', 'user', 'pass',
+                                                 [ServiceInstance('b_instance', 'plan')]))
+    app_c = AppConfig('app_c', app_properties={'services': ['b_instance', 'global_instance']})
+    app_d = AppConfig('app_d', register_in='app_a')
+    app_e = AppConfig('app_e')
+    return AppStack(
+        apps=[app_a, app_b, app_c, app_d, app_e],
+        user_provided_services=[UserProvidedService('global_upsi', {}),
+                                UserProvidedService('other_upsi', {})],
+        brokers=[BrokerConfig('global_broker', 'url', 'user', 'pass',
+                              [ServiceInstance('global_instance', 'plan')]),
+                 BrokerConfig('other_broker', 'url', 'user', 'pass',
+                              [ServiceInstance('other_instance', 'plan')])])
+
+
+@pytest.mark.parametrize('app_names, with_dependencies, with_dependents, selected_names', [
+    (['app_b'], False, False, ['app_b']),
+    (['app_b'], True, False, ['app_a', 'app_b']),
+    (['app_b'], False, True, ['app_b', 'app_c']),
+    (['app_a'], False, True, ['app_a', 'app_b', 'app_c', 'app_d']),
+    (['app_d'], False, False, ['app_d']),
+    (['app_d'], True, False, ['app_a', 'app_d']),
+    (['app_e', 'app_c'], True, False, ['app_a', 'app_b', 'app_c', 'app_e']),
+])
+def test_select_apps(chained_appstack, app_names, with_dependencies, with_dependents,
+                     selected_names):
+    selected_appstack = chained_appstack.select_apps(app_names, with_dependencies, with_dependents)
+    assert [app.name for app in selected_appstack.apps] == selected_names
+
+
+def test_select_apps_services_and_brokers(chained_appstack):
+    selected_appstack = chained_appstack.select_apps(['app_c'], with_dependencies=True)
+
+    assert [service.name for service in selected_appstack.user_provided_services] == \
+        ['global_upsi']
+    assert [broker.name for broker in selected_appstack.brokers] == ['global_broker']
+    assert len(chained_appstack.apps) == 5
+
+
+def test_select_nonexistent_app(chained_appstack):
+    with pytest.raises(KeyError):
+        chained_appstack.select_apps(['nonexistent'])
+
+
+def test_select_elements(chained_appstack):
+    selected_appstack = chained_appstack.select_elements(['app_c', 'app_b'], ['other_upsi'],
+                                                         ['other_broker'])
+
+    assert [app.name for app in selected_appstack.apps] == ['app_b', 'app_c']
+    assert [service.name for service in selected_appstack.user_provided_services] == \
+        ['global_upsi', 'other_upsi']
+    assert [broker.name for broker in selected_appstack.brokers] == \
+        ['global_broker', 'other_broker']
+
+
+def test_select_only_standalone_elements(chained_appstack):
+    selected_appstack = chained_appstack.select_elements([], ['other_upsi'])
+
+    assert selected_appstack.apps == []
+    assert [service.name for service in selected_appstack.user_provided_services] == \
+        ['other_upsi']
+    assert selected_appstack.brokers == []
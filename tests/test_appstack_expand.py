@@ -16,12 +16,15 @@
 
 import itertools
 import os
+import zipfile
 
 import pytest
 import yaml
 
-from apployer.appstack import AppConfig, AppStack, UserProvidedService, BrokerConfig
-from apployer.appstack_expand import expand_appstack, _sort_appstack
+from apployer.appstack import (AppConfig, AppStack, UserProvidedService, BrokerConfig,
+                               MalformedAppStackError)
+from apployer import appstack_expand, variable_index
+from apployer.appstack_expand import expand_appstack, _sort_appstack, _get_artifact_manifests
 from .utils import get_appstack_resource_dir
 
 app_a_upsi_name = 'app_a_upsi'
@@ -81,6 +84,30 @@ def test_sort_unlinked_apps():
     assert apps == set(sorted_appstack.apps)
 
 
+def test_sort_appstack_with_cycle():
+    app_x = AppConfig(
+        name='app_x',
+        app_properties={'services': ['app_y_upsi']},
+        user_provided_services=[UserProvidedService('app_x_upsi', {})])
+    app_y = AppConfig(
+        name='app_y',
+        app_properties={'services': ['app_x_upsi']},
+        user_provided_services=[UserProvidedService('app_y_upsi', {})])
+
+    with pytest.raises(MalformedAppStackError) as exc_info:
+        _sort_appstack(AppStack([app_x, app_a, app_y], [], []))
+    assert str(exc_info.value).endswith('cycles in app dependencies: [app_x, app_y]')
+
+
+def test_sort_appstack_with_service_defined_twice():
+    apps = [AppConfig('app_1', user_provided_services=[UserProvidedService('upsi', {})]),
+            AppConfig('app_2', user_provided_services=[UserProvidedService('upsi', {})])]
+
+    with pytest.raises(MalformedAppStackError) as exc_info:
+        _sort_appstack(AppStack(apps))
+    assert str(exc_info.value) == 'The same service defined twice: upsi'
+
+
 def test_appstack_expander(tmpdir, artifacts_location):
     appstack_file_path = os.path.join(get_appstack_resource_dir(), 'appstack.yml')
     expanded_appstack_path = tmpdir.join('expanded_appstack.yml').strpath
@@ -105,5 +132,125 @@ def test_appstack_expander(tmpdir, artifacts_location):
             for required_app in app_dependencies[app_name]:
                 assert app_indices[app_name] > app_indices[required_app]
 
+    assert variable_index.load_variable_index(expanded_appstack_path) == \
+        variable_index.build_variable_index(expanded_appstack_dict)
+
+def test_get_artifact_manifests(tmpdir, artifacts_location, monkeypatch):
+    with zipfile.ZipFile(os.path.join(artifacts_location, 'no_manifest-v1.zip'), 'w') as zip_file:
+        zip_file.writestr('some_file.txt', 'bla')
+    monkeypatch.chdir(tmpdir.mkdir('work_dir').strpath)
+
+    manifests = _get_artifact_manifests(artifacts_location)
+
+    assert sorted(manifests) == list('ABDEFGHX')
+    assert manifests['A']['name'] == 'A'
+    assert not os.listdir('.')
+
+
+def test_get_artifact_manifests_cached(artifacts_location, monkeypatch):
+    manifests = _get_artifact_manifests(artifacts_location)
+    monkeypatch.setattr('apployer.appstack_expand.yaml_codec.load',
+                        lambda _: pytest.fail('Manifest should have been cached.'))
+
+    assert _get_artifact_manifests(artifacts_location) == manifests
+
+
+def test_appstack_expander_reuses_cache(tmpdir, artifacts_location, monkeypatch):
+    appstack_file_path = os.path.join(get_appstack_resource_dir(), 'appstack.yml')
+    expanded_appstack_path = tmpdir.join('expanded_appstack.yml').strpath
+    expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path)
+    with open(expanded_appstack_path) as expanded_appstack_file:
+        first_expansion = expanded_appstack_file.read()
+
+    monkeypatch.setattr(appstack_expand, '_manifest_cache', {})
+    monkeypatch.setattr('apployer.appstack_expand._sort_appstack',
+                        lambda *args: pytest.fail('Appstack should not have been sorted.'))
+    monkeypatch.setattr(AppStack, 'merge_manifests',
+                        lambda *args: pytest.fail('Manifests should not have been merged.'))
+    expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path)
+
+    with open(expanded_appstack_path) as expanded_appstack_file:
+        assert expanded_appstack_file.read() == first_expansion
+
+
+def test_appstack_expander_merges_changed_apps(tmpdir, artifacts_location, monkeypatch):
+    appstack_file_path = os.path.join(get_appstack_resource_dir(), 'appstack.yml')
+    expanded_appstack_path = tmpdir.join('expanded_appstack.yml').strpath
+    expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path)
+
+    with zipfile.ZipFile(os.path.join(artifacts_location, 'E.zip'), 'w') as zip_file:
+        zip_file.writestr('manifest.yml', yaml.dump(
+            {'applications': [{'name': 'E', 'memory': '2G'}]}))
+    merged_app_names = []
+    original_merge_manifests = AppStack.merge_manifests
+    def merge_manifests(appstack, manifests):
+        merged_app_names.extend(app.name for app in appstack.apps)
+        return original_merge_manifests(appstack, manifests)
+    monkeypatch.setattr(AppStack, 'merge_manifests', merge_manifests)
+    expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path)
+
+    assert merged_app_names == ['E']
+    with open(expanded_appstack_path) as expanded_appstack_file:
+        expanded_appstack = AppStack.from_appstack_dict(yaml.load(expanded_appstack_file))
+    assert expanded_appstack.get_app('E').app_properties['memory'] == '2G'
+
+
+def test_appstack_expander_keeps_order_of_cached_apps(tmpdir, monkeypatch):
+    appstack_path = tmpdir.join('appstack.yml')
+    appstack_path.write(yaml.dump({'apps': [
+        {'name': 'a', 'user_provided_services': [{'name': 'a_upsi', 'credentials': {}}]},
+        {'name': 'b'},
+        {'name': 'zfirst', 'order': 0},
+    ]}))
+    artifacts_path = tmpdir.mkdir('artifacts')
+
+    def write_artifact(app_name, **manifest):
+        with zipfile.ZipFile(artifacts_path.join(app_name + '.zip').strpath, 'w') as zip_file:
+            zip_file.writestr('manifest.yml', yaml.dump(
+                {'applications': [dict(manifest, name=app_name)]}))
+    for app_name in ('a', 'b', 'zfirst'):
+        write_artifact(app_name)
+    expanded_appstack_path = tmpdir.join('expanded_appstack.yml').strpath
+
+    def get_expanded_app_names():
+        expand_appstack(appstack_path.strpath, artifacts_path.strpath, expanded_appstack_path)
+        with open(expanded_appstack_path) as expanded_appstack_file:
+            return [app['name'] for app in yaml.load(expanded_appstack_file)['apps']]
+
+    assert get_expanded_app_names() == ['zfirst', 'a', 'b']
+
+    # b starts to depend on a, so the apps are sorted again, with a and zfirst from the cache
+    write_artifact('b', services=['a_upsi'])
+    merged_app_names = []
+    original_merge_manifests = AppStack.merge_manifests
+    def merge_manifests(appstack, manifests):
+        merged_app_names.extend(app.name for app in appstack.apps)
+        return original_merge_manifests(appstack, manifests)
+    monkeypatch.setattr(AppStack, 'merge_manifests', merge_manifests)
+
+    assert get_expanded_app_names() == ['zfirst', 'a', 'b']
+    assert merged_app_names == ['b']
+
+
+def test_appstack_expander_drops_old_manifests(tmpdir, artifacts_location):
+    appstack_file_path = os.path.join(get_appstack_resource_dir(), 'appstack.yml')
+    expanded_appstack_path = tmpdir.join('expanded_appstack.yml').strpath
+    cache_path = expanded_appstack_path + appstack_expand.EXPANSION_CACHE_SUFFIX
+    expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path)
+    cached_keys = set(appstack_expand._load_expansion_cache(cache_path)['manifests'])
+
+    e_zip_path = os.path.join(artifacts_location, 'E.zip')
+    with zipfile.ZipFile(e_zip_path, 'w') as zip_file:
+        zip_file.writestr('manifest.yml', yaml.dump(
+            {'applications': [{'name': 'E', 'memory': '2G'}]}))
+    os.utime(e_zip_path, (1, 1))
+    expand_appstack(appstack_file_path, artifacts_location, expanded_appstack_path)
+
+    new_cached_keys = set(appstack_expand._load_expansion_cache(cache_path)['manifests'])
+    assert len(new_cached_keys) == len(cached_keys)
+    assert [key for key in new_cached_keys - cached_keys] == \
+        [appstack_expand._get_manifest_cache_key(e_zip_path)]
+
+
 # TODO test for exceptions
 # TODO create broker object. some fields will be required
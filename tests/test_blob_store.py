@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import stat
+
+import pytest
+
+from apployer import blob_store
+
+
+@pytest.fixture
+def store_path(tmpdir):
+    return tmpdir.join('blobs').strpath
+
+
+def test_store_blob(store_path):
+    reference = blob_store.store_blob('some value', store_path)
+
+    assert reference.startswith(blob_store.BLOB_REFERENCE_PREFIX)
+    assert blob_store.store_blob('some value', store_path) == reference
+    assert len(os.listdir(store_path)) == 1
+    assert blob_store.resolve(reference, store_path) == 'some value'
+
+
+def test_store_blob_permissions(store_path):
+    reference = blob_store.store_blob('secret', store_path)
+
+    blob_path = os.path.join(store_path, reference[len(blob_store.BLOB_REFERENCE_PREFIX):])
+    assert stat.S_IMODE(os.stat(store_path).st_mode) == 0700
+    assert stat.S_IMODE(os.stat(blob_path).st_mode) == 0600
+
+
+def test_default_store_path(store_path, monkeypatch):
+    monkeypatch.setattr('apployer.blob_store._store_path', None)
+    with pytest.raises(IOError):
+        blob_store.store_blob('some value')
+
+    blob_store.set_store_path(store_path)
+    reference = blob_store.store_blob('some value')
+
+    assert blob_store.resolve(reference) == 'some value'
+    assert blob_store.resolve(reference, store_path) == 'some value'
+
+
+def test_store_large_values(store_path):
+    config = {'small': 'abc', 'large': 'x' * 10, 'number': 12345678901}
+
+    stored_config = blob_store.store_large_values(config, store_path, min_size=10)
+
+    assert stored_config['small'] == 'abc'
+    assert stored_config['number'] == 12345678901
+    assert stored_config['large'].startswith(blob_store.BLOB_REFERENCE_PREFIX)
+    assert blob_store.resolve(stored_config, store_path) == config
+
+
+def test_resolve_nested(store_path):
+    reference = blob_store.store_blob('cert', store_path)
+    data = {
+        'env': {'CREDENTIALS': '{"kcacert": "%s", "kuser": "bla"}' % reference},
+        'services': ['service', reference],
+        'instances': 2,
+    }
+
+    assert blob_store.resolve(data, store_path) == {
+        'env': {'CREDENTIALS': '{"kcacert": "cert", "kuser": "bla"}'},
+        'services': ['service', 'cert'],
+        'instances': 2,
+    }
+
+
+def test_resolve_missing_blob(store_path):
+    with pytest.raises(IOError):
+        blob_store.resolve(blob_store.BLOB_REFERENCE_PREFIX + 'a' * 64, store_path)
+
+
+def test_find_missing_blobs(store_path):
+    reference = blob_store.store_blob('cert', store_path)
+    missing_reference = blob_store.BLOB_REFERENCE_PREFIX + 'a' * 64
+    data = {'env': {'A': reference, 'B': [missing_reference, 'bla']}, 'instances': 2}
+
+    assert blob_store.find_missing_blobs(data, store_path) == ['a' * 64]
+    assert blob_store.find_missing_blobs({'env': {'A': reference}}, store_path) == []
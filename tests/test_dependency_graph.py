@@ -0,0 +1,112 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import sys
+from xml.etree import ElementTree
+
+import pytest
+
+from apployer.dependency_graph import DependencyGraph, GRAPHML_NAMESPACE
+
+
+def test_get_levels():
+    graph = DependencyGraph({
+        'A': ['B', 'C'],
+        'B': ['D'],
+        'C': ['D'],
+        'D': [],
+        'E': ['D', 'A'],
+        'F': [],
+    })
+
+    assert graph.get_levels() == [['D', 'F'], ['B', 'C'], ['A'], ['E']]
+
+
+def test_get_levels_adds_dependency_nodes():
+    graph = DependencyGraph({'A': ['B']})
+
+    assert graph.nodes == ['A', 'B']
+    assert graph.get_levels() == [['B'], ['A']]
+
+
+@pytest.mark.parametrize('dependencies, cycles', [
+    ({'A': ['B'], 'B': []}, []),
+    ({'A': ['A']}, [['A']]),
+    ({'A': ['B'], 'B': ['C'], 'C': ['A'], 'D': ['A']}, [['A', 'B', 'C']]),
+    ({'A': ['B'], 'B': ['A'], 'C': ['D'], 'D': ['C'], 'E': ['A', 'C']}, [['A', 'B'], ['C', 'D']]),
+])
+def test_find_cycles(dependencies, cycles):
+    assert DependencyGraph(dependencies).find_cycles() == cycles
+
+
+class _CountingDict(dict):
+    """Dictionary counting the lookups of its items."""
+
+    def __init__(self, *args):
+        super(_CountingDict, self).__init__(*args)
+        self.lookups = 0
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        return super(_CountingDict, self).__getitem__(key)
+
+
+def _get_stack_depth():
+    depth = 0
+    frame = sys._getframe()
+    while frame:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def test_large_graph():
+    app_count = 10000
+    dependencies = {'app_{:05d}'.format(i): ['app_{:05d}'.format(i - 1)] if i else []
+                    for i in range(app_count)}
+    dependencies.update({'other_{:05d}'.format(i): ['app_{:05d}'.format(i)]
+                         for i in range(app_count)})
+    graph = DependencyGraph(dependencies)
+    graph._dependencies = _CountingDict(graph._dependencies)
+    graph._dependents = _CountingDict(graph._dependents)
+
+    # a recursive traversal of the long chain of apps would exceed the limit
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(_get_stack_depth() + 50)
+    try:
+        cycles = graph.find_cycles()
+        levels = graph.get_levels()
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    assert cycles == []
+    assert len(levels) == app_count + 1
+    assert levels[1] == ['app_00001', 'other_00000']
+    # each node is looked up a constant number of times
+    node_count = 2 * app_count
+    assert graph._dependencies.lookups <= 2 * node_count
+    assert graph._dependents.lookups <= node_count
+
+
+def test_write_graphml(tmpdir):
+    graph_path = tmpdir.join('graph.xml').strpath
+
+    DependencyGraph({'A': ['B'], 'B': []}).write_graphml(graph_path)
+
+    graph = ElementTree.parse(graph_path).getroot().find('{%s}graph' % GRAPHML_NAMESPACE)
+    assert [node.get('id') for node in graph.iter('{%s}node' % GRAPHML_NAMESPACE)] == ['A', 'B']
+    assert [(edge.get('source'), edge.get('target'))
+            for edge in graph.iter('{%s}edge' % GRAPHML_NAMESPACE)] == [('A', 'B')]
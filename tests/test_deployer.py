@@ -22,7 +22,7 @@ from mock import MagicMock
 import pytest
 import yaml
 
-from apployer import deployer
+from apployer import blob_store, deployer
 from apployer.appstack import (AppStack, AppConfig, UserProvidedService, BrokerConfig, PushOptions,
                                ServiceInstance)
 from apployer.cf_cli import CommandFailedError, CfInfo, BuildpackDescription
@@ -107,6 +107,20 @@ def test_prepare_app(artifacts_location, app_deployer):
     assert manifest_dict == {'applications': [app_deployer.app.app_properties]}
 
 
+def test_prepare_app_with_blob(artifacts_location, app_deployer, monkeypatch, tmpdir):
+    monkeypatch.chdir(tmpdir.mkdir('work_dir').strpath)
+    monkeypatch.setattr('apployer.blob_store._store_path', tmpdir.join('blobs').strpath)
+    big_value = 'a' * 5000
+    app_deployer.app.app_properties.setdefault('env', {})['BIG_VALUE'] = \
+        blob_store.store_blob(big_value)
+
+    prepared_app_path = app_deployer.prepare(artifacts_location)
+
+    with open(os.path.join(prepared_app_path, deployer.AppDeployer.FILLED_MANIFEST)) as manifest:
+        manifest_dict = yaml.load(manifest)
+    assert manifest_dict['applications'][0]['env']['BIG_VALUE'] == big_value
+
+
 def test_prepare_app_no_artifact(app_deployer):
     with pytest.raises(IOError):
         app_deployer.prepare('/some/fake/location')
@@ -433,6 +447,28 @@ def test_deploy_appstack(monkeypatch, mock_upsi_deployer, mock_setup_broker):
                                                    deployer.DEPLOYER_OUTPUT, artifacts_path)
 
 
+def test_deploy_appstack_part(monkeypatch):
+    registrator = AppConfig('application-broker')
+    registered_app = AppConfig('app1', register_in='application-broker')
+    full_appstack = AppStack([registered_app, registrator], domain='fake-domain')
+    appstack_part = full_appstack.select_apps(['app1'])
+    monkeypatch.setattr('apployer.deployer._prepare_org_and_space', MagicMock())
+    monkeypatch.setattr('apployer.deployer._restart_apps', MagicMock())
+    mock_app_deployer_init = MagicMock()
+    mock_app_deployer_init.return_value.deploy.return_value = []
+    monkeypatch.setattr('apployer.deployer.AppDeployer', mock_app_deployer_init)
+    mock_register_in_app_broker = MagicMock()
+    monkeypatch.setattr('apployer.deployer.register_in_application_broker',
+                        mock_register_in_app_broker)
+
+    deployer.deploy_appstack(CfInfo('https://api.example.com', 'password'), appstack_part,
+                             'some-fake-path', deployer.UPGRADE_STRATEGY, False, full_appstack)
+
+    mock_app_deployer_init.assert_called_once_with(registered_app, deployer.DEPLOYER_OUTPUT)
+    mock_register_in_app_broker.assert_called_once_with(
+        registered_app, registrator, 'fake-domain', deployer.DEPLOYER_OUTPUT, 'some-fake-path')
+
+
 def test_deploy_appstack_dry_run(monkeypatch):
     fake_cf_login, fake_appstack, fake_artifacts_path, fake_strategy = 1, 2, 3, 4
     mock_do_deploy = MagicMock()
@@ -444,7 +480,7 @@ def test_deploy_appstack_dry_run(monkeypatch):
                              fake_strategy, True)
 
     mock_do_deploy.assert_called_with(fake_cf_login, fake_appstack,
-                                      fake_artifacts_path, fake_strategy)
+                                      fake_artifacts_path, fake_strategy, fake_appstack)
     assert deployer.cf_cli is real_cf_cli
     assert deployer.register_in_application_broker is real_register_in_app_broker
 
@@ -501,10 +537,97 @@ def test_prepare_org_and_space(mock_cf_cli):
 def test_restart_apps(mock_cf_api, mock_cf_cli):
     apps = [AppConfig('app_1'), AppConfig('app_2'),
             AppConfig('app_3', push_options=PushOptions('--no-start'))]
-    app_guids = ['app_1_guid', 'app_2_guid', 'app_3_guid']
+    app_guids = ['app_1_guid', 'app_2_guid', 'app_3_guid', 'other_app_guid']
     appstack = AppStack(apps)
-    mock_cf_api.get_app_name.side_effect = [app.name for app in apps]
+    mock_cf_api.get_app_name.side_effect = [app.name for app in apps] + ['other_app']
 
     deployer._restart_apps(appstack, app_guids)
 
-    mock_cf_cli.restart.call_args_list == [mock.call(apps[0].name), mock.call(apps[1].name)]
+    assert mock_cf_cli.restart.call_args_list == \
+        [mock.call(apps[0].name), mock.call(apps[1].name), mock.call('other_app')]
+
+
+def test_deploy_appstack_isolates_failures(monkeypatch, mock_upsi_deployer, mock_setup_broker):
+    # arrange - data
+    failing_app = AppConfig('failing', user_provided_services=[UserProvidedService('f_upsi', {})])
+    blocked_app = AppConfig('blocked', app_properties={'services': ['f_upsi']})
+    transitively_blocked_app = AppConfig(
+        'transitively_blocked', register_in='blocked')
+    blocked_by_service_app = AppConfig('blocked_by_service',
+                                       app_properties={'services': ['failing-upsi']})
+    independent_app = AppConfig('independent')
+    apps = [failing_app, blocked_app, transitively_blocked_app, blocked_by_service_app,
+            independent_app]
+    user_provided_services = [UserProvidedService('failing-upsi', {})]
+    appstack = AppStack(apps, user_provided_services)
+
+    # arrange - mocks
+    monkeypatch.setattr('apployer.deployer._prepare_org_and_space', MagicMock())
+    monkeypatch.setattr('apployer.deployer._restart_apps', MagicMock())
+    mock_upsi_deployer.return_value.deploy.side_effect = CommandFailedError('upsi failed')
+    deployed_apps = []
+
+    def fake_deploy(app, *_):
+        if app.name == failing_app.name:
+            raise CommandFailedError('push failed')
+        deployed_apps.append(app.name)
+        return []
+    mock_app_deployer_init = MagicMock()
+    mock_app_deployer_init.side_effect = lambda app, _: MagicMock(
+        deploy=lambda *args: fake_deploy(app, *args))
+    monkeypatch.setattr('apployer.deployer.AppDeployer', mock_app_deployer_init)
+    mock_summary_log = MagicMock()
+    monkeypatch.setattr('apployer.deployer.DeploymentSummary.log', mock_summary_log)
+
+    # act
+    with pytest.raises(deployer.DeploymentFailedError):
+        deployer.deploy_appstack(CfInfo('https://api.example.com', 'password'), appstack,
+                                 'some-fake-path', deployer.UPGRADE_STRATEGY, False)
+
+    # assert
+    assert deployed_apps == [independent_app.name]
+    assert mock_summary_log.call_args_list
+
+
+def test_deploy_appstack_apps_and_services_with_same_names(monkeypatch, mock_upsi_deployer):
+    # "shared" is both a failing standalone user-provided service and an app
+    apps = [AppConfig('shared'),
+            AppConfig('registered', register_in='shared'),
+            AppConfig('consumer', app_properties={'services': ['shared']})]
+    appstack = AppStack(apps, [UserProvidedService('shared', {})])
+    monkeypatch.setattr('apployer.deployer._prepare_org_and_space', MagicMock())
+    monkeypatch.setattr('apployer.deployer._restart_apps', MagicMock())
+    monkeypatch.setattr('apployer.deployer.register_in_application_broker', MagicMock())
+    mock_upsi_deployer.return_value.deploy.side_effect = CommandFailedError('upsi failed')
+    mock_app_deployer_init = MagicMock()
+    mock_app_deployer_init.return_value.deploy.return_value = []
+    monkeypatch.setattr('apployer.deployer.AppDeployer', mock_app_deployer_init)
+    mock_summary_log = MagicMock()
+    monkeypatch.setattr('apployer.deployer.DeploymentSummary.log', mock_summary_log)
+
+    with pytest.raises(deployer.DeploymentFailedError):
+        deployer.deploy_appstack(CfInfo('https://api.example.com', 'password'), appstack,
+                                 'some-fake-path', deployer.UPGRADE_STRATEGY, False)
+
+    deployed_apps = [call[0][0].name for call in mock_app_deployer_init.call_args_list]
+    assert deployed_apps == ['shared', 'registered']
+
+
+def test_deployment_summary():
+    summary = deployer.DeploymentSummary()
+
+    with summary.track('app a'):
+        pass
+    assert summary.last_succeeded
+    with summary.track('app b'):
+        raise CommandFailedError('some error')
+    assert not summary.last_succeeded
+    with summary.track('app d'):
+        raise ValueError('unexpected error')
+    assert not summary.last_succeeded
+    summary.add_blocked('app c', ['b'])
+    summary.log()
+
+    assert summary.succeeded == ['app a']
+    assert summary.failed == [('app b', 'some error'), ('app d', 'unexpected error')]
+    assert summary.blocked == [('app c', ['b'])]
@@ -14,12 +14,21 @@
 # limitations under the License.
 #
 
+import json
+import subprocess
+import sys
+
+from click.testing import CliRunner
 import mock
 from mock import MagicMock
 
 import pytest
 
-from apployer.main import _get_filled_appstack, ApployerArgumentError, _seconds_to_time
+from apployer import blob_store, yaml_codec
+from apployer.appstack import AppConfig, AppStack, UserProvidedService
+from apployer.deployer import DeploymentFailedError
+from apployer.main import (cli, _get_changed_appstack, _get_filled_appstack, ApployerArgumentError,
+                           _seconds_to_time, _select_apps)
 
 appstack_path = 'appstack_path'
 expanded_appstack_path = 'expanded_appstack_path'
@@ -27,6 +36,10 @@ filled_appstack_path = 'filled_appstack_path'
 artifacts_path = 'artifacts_path'
 fetcher_conf_path = 'fetcher_conf_path'
 
+# Libraries that take long to import, they should only be imported by the commands using them.
+HEAVY_MODULES = ['cm_api', 'datadiff', 'jinja2', 'paramiko', 'pkg_resources', 'requests',
+                 'sshtunnel']
+
 
 @pytest.fixture
 def mock_appstack_file(monkeypatch):
@@ -36,14 +49,14 @@ def mock_appstack_file(monkeypatch):
 @pytest.fixture
 def mock_fill_appstack(monkeypatch):
     mock_fill = MagicMock()
-    monkeypatch.setattr('apployer.main.fill_appstack', mock_fill)
+    monkeypatch.setattr('apployer.fetcher.fill_appstack', mock_fill)
     return mock_fill
 
 
 @pytest.fixture
 def mock_expand_appstack(monkeypatch):
     mock_expand = MagicMock()
-    monkeypatch.setattr('apployer.main.expand_appstack', mock_expand)
+    monkeypatch.setattr('apployer.appstack_expand.expand_appstack', mock_expand)
     return mock_expand
 
 
@@ -51,15 +64,34 @@ def test_get_filled_appstack_with_filled(monkeypatch, mock_appstack_file):
     monkeypatch.setattr(
         'os.path.exists',
         lambda path: True if path == filled_appstack_path else False)
+    monkeypatch.setattr('apployer.blob_store._store_path', None)
     _get_filled_appstack(None, None, filled_appstack_path, None, None)
 
 
+def test_get_filled_appstack_with_missing_blobs(monkeypatch, tmpdir):
+    monkeypatch.setattr('apployer.blob_store._store_path', None)
+    filled_path = tmpdir.join('filled_appstack.yml')
+    reference = blob_store.store_blob('cert', blob_store.get_store_path(filled_path.strpath))
+    filled_path.write(yaml_codec.dump({'apps': [{'name': 'app', 'app_properties': {
+        'env': {'CERT': reference}}}]}))
+
+    appstack, digests = _get_filled_appstack(None, None, filled_path.strpath, None, None)
+    assert digests is None
+    assert appstack.apps[0].app_properties['env']['CERT'] == reference
+    assert blob_store.resolve(reference) == 'cert'
+
+    filled_path.copy(tmpdir.mkdir('other_dir').join('filled_appstack.yml'))
+    with pytest.raises(ApployerArgumentError):
+        _get_filled_appstack(None, None, tmpdir.join('other_dir', 'filled_appstack.yml').strpath,
+                             None, None)
+
+
 def test_get_filled_appstack_with_expanded(monkeypatch, mock_appstack_file, mock_fill_appstack):
     monkeypatch.setattr(
         'os.path.exists',
         lambda path: True if path == expanded_appstack_path else False)
     _get_filled_appstack(None, expanded_appstack_path, None, fetcher_conf_path, artifacts_path)
-    mock_fill_appstack.assert_called_once_with(expanded_appstack_path, fetcher_conf_path)
+    mock_fill_appstack.assert_called_once_with(expanded_appstack_path, fetcher_conf_path, False)
 
 
 def test_get_filled_appstack_with_bare(monkeypatch, mock_appstack_file,
@@ -73,7 +105,7 @@ def test_get_filled_appstack_with_bare(monkeypatch, mock_appstack_file,
 
     mock_expand_appstack.assert_called_once_with(appstack_path, artifacts_path,
                                                  expanded_appstack_path)
-    mock_fill_appstack.assert_called_once_with(expanded_appstack_path, fetcher_conf_path)
+    mock_fill_appstack.assert_called_once_with(expanded_appstack_path, fetcher_conf_path, False)
 
 
 def test_get_filled_appstack_with_none(monkeypatch):
@@ -82,6 +114,67 @@ def test_get_filled_appstack_with_none(monkeypatch):
         _get_filled_appstack(None, None, None, None, None)
 
 
+@pytest.fixture
+def changed_config(monkeypatch):
+    monkeypatch.setattr('apployer.variable_index.load_variable_digests',
+                        lambda path: {'a_var': 'old', 'global_var': 'same'})
+    monkeypatch.setattr('apployer.variable_index.load_variable_index', lambda path: {
+        'a_var': ['apps/app_a/app_properties/env/A'],
+        'global_var': ['domain'],
+    })
+    digests = {'a_var': 'new', 'global_var': 'same'}
+    mock_get_filled = MagicMock(return_value=(AppStack(
+        [AppConfig('app_a'), AppConfig('app_b')]), digests))
+    monkeypatch.setattr('apployer.main._get_filled_appstack', mock_get_filled)
+    return digests
+
+
+def test_get_changed_appstack(changed_config):
+    full_appstack, changed_appstack, digests = _get_changed_appstack(
+        appstack_path, expanded_appstack_path, fetcher_conf_path, artifacts_path)
+    assert [app.name for app in full_appstack.apps] == ['app_a', 'app_b']
+    assert [app.name for app in changed_appstack.apps] == ['app_a']
+    assert digests is changed_config
+
+
+def test_get_changed_appstack_with_global_change(changed_config):
+    changed_config['global_var'] = 'changed'
+    full_appstack, changed_appstack, _ = _get_changed_appstack(
+        appstack_path, expanded_appstack_path, fetcher_conf_path, artifacts_path)
+    assert changed_appstack is full_appstack
+
+
+def test_get_changed_appstack_without_previous(monkeypatch):
+    monkeypatch.setattr('apployer.variable_index.load_variable_digests', lambda path: None)
+    with pytest.raises(ApployerArgumentError):
+        _get_changed_appstack(appstack_path, expanded_appstack_path, fetcher_conf_path,
+                              artifacts_path)
+
+
+@pytest.mark.parametrize('options, deployment_error, digests_saved', [
+    ([], None, True),
+    ([], DeploymentFailedError('Failed to deploy: app_a'), False),
+    (['--only', 'app_a'], None, False),
+    (['--dry-run'], None, False),
+])
+def test_deploy_saves_digests_when_deployed(monkeypatch, options, deployment_error, digests_saved):
+    digests = {'a_var': 'new'}
+    monkeypatch.setattr('apployer.main._get_filled_appstack',
+                        MagicMock(return_value=(AppStack([AppConfig('app_a')]), digests)))
+    monkeypatch.setattr('apployer.deployer.deploy_appstack',
+                        MagicMock(side_effect=deployment_error))
+    save_variable_digests = MagicMock()
+    monkeypatch.setattr('apployer.variable_index.save_variable_digests', save_variable_digests)
+
+    CliRunner().invoke(cli, ['deploy', 'artifacts', 'https://cf-api.example.com',
+                             '-p', 'password'] + options)
+
+    if digests_saved:
+        save_variable_digests.assert_called_once_with(digests, 'filled_expanded_appstack.yml')
+    else:
+        assert not save_variable_digests.called
+
+
 @pytest.mark.parametrize('string, seconds', [
     ('0:02:03', 123.3),
     ('0:12:13', 733),
@@ -89,3 +182,55 @@ def test_get_filled_appstack_with_none(monkeypatch):
 ])
 def test_seconds_to_time(string, seconds):
     assert string == _seconds_to_time(seconds)
+
+
+def test_select_apps():
+    appstack = AppStack([AppConfig('app_a'), AppConfig('app_b'), AppConfig('app_c')])
+    selected_appstack = _select_apps(appstack, 'app_a, app_c', False, False)
+    assert [app.name for app in selected_appstack.apps] == ['app_a', 'app_c']
+
+
+@pytest.mark.parametrize('with_dependencies, with_dependents, selected_names', [
+    (False, False, ['app_b']),
+    (True, False, ['app_a', 'app_b']),
+    (False, True, ['app_b', 'app_c']),
+    (True, True, ['app_a', 'app_b', 'app_c']),
+])
+def test_select_apps_with_closure(with_dependencies, with_dependents, selected_names):
+    # app_b is registered in app_a, app_c uses a service of app_b
+    appstack = AppStack([AppConfig('app_a'),
+                         AppConfig('app_b', register_in='app_a',
+                                   user_provided_services=[UserProvidedService('b_upsi', {})]),
+                         AppConfig('app_c', app_properties={'services': ['b_upsi']}),
+                         AppConfig('app_d')])
+
+    selected_appstack = _select_apps(appstack, 'app_b', with_dependencies, with_dependents)
+    assert [app.name for app in selected_appstack.apps] == selected_names
+
+
+@pytest.mark.parametrize('options', [
+    ['--with-dependencies'],
+    ['--with-dependents'],
+    ['--only', 'app_a', '--only-changed'],
+])
+def test_deploy_with_wrong_options(options):
+    result = CliRunner().invoke(cli, ['deploy', 'artifacts', 'https://cf-api.example.com',
+                                      '-p', 'password'] + options)
+    assert isinstance(result.exception, ApployerArgumentError)
+
+
+def test_select_unknown_apps():
+    with pytest.raises(ApployerArgumentError):
+        _select_apps(AppStack([AppConfig('app_a')]), 'app_a,app_x', False, False)
+
+
+def test_cli_startup():
+    # The CLI is started in a fresh interpreter, because the tests import the heavy libraries.
+    listing_script = (
+        'import json, sys\n'
+        'import apployer.main\n'
+        'print(json.dumps(sorted(set(name.split(".")[0] for name in sys.modules))))\n')
+
+    startup_modules = json.loads(subprocess.check_output([sys.executable, '-c', listing_script]))
+
+    assert not set(HEAVY_MODULES) & set(startup_modules)
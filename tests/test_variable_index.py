@@ -0,0 +1,89 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import stat
+
+import pytest
+
+from apployer import variable_index
+
+APPSTACK_DICT = {
+    'domain': '{{ domain }}',
+    'apps': [
+        {'name': 'app-a',
+         'app_properties': {'env': {'HOST': '{{ nn_host }}:{{ nn_port }}', 'PLAIN': 'value'}},
+         'user_provided_services': [{'name': 'a-upsi', 'credentials': {'pass': '{{ a_pass }}'}}]},
+        {'name': 'app-b', 'app_properties': {'env': {'HOST': '{{ nn_host }}'}}},
+    ],
+    'user_provided_services': [{'name': 'global-upsi', 'credentials': {'url': '{{ url }}'}}],
+    'brokers': [{'name': 'broker', 'auth_pass': '{% if kerberos %}x{% endif %}'}],
+    'unnamed': ['{{ listed }}'],
+}
+
+
+def test_build_variable_index():
+    index = variable_index.build_variable_index(APPSTACK_DICT)
+
+    assert index == {
+        'domain': ['domain'],
+        'nn_host': ['apps/app-a/app_properties/env/HOST', 'apps/app-b/app_properties/env/HOST'],
+        'nn_port': ['apps/app-a/app_properties/env/HOST'],
+        'a_pass': ['apps/app-a/user_provided_services/a-upsi/credentials/pass'],
+        'url': ['user_provided_services/global-upsi/credentials/url'],
+        'kerberos': ['brokers/broker/auth_pass'],
+        'listed': ['unnamed/0'],
+    }
+
+
+@pytest.mark.parametrize('changed_variables, affected_elements', [
+    ([], {'apps': set(), 'user_provided_services': set(), 'brokers': set()}),
+    (['nn_host'], {'apps': {'app-a', 'app-b'}, 'user_provided_services': set(),
+                   'brokers': set()}),
+    (['a_pass', 'kerberos', 'unused'], {'apps': {'app-a'}, 'user_provided_services': set(),
+                                        'brokers': {'broker'}}),
+    (['url'], {'apps': set(), 'user_provided_services': {'global-upsi'}, 'brokers': set()}),
+    (['url', 'domain'], None),
+    (['listed'], None),
+])
+def test_get_affected_elements(changed_variables, affected_elements):
+    index = variable_index.build_variable_index(APPSTACK_DICT)
+    assert variable_index.get_affected_elements(index, changed_variables) == affected_elements
+
+
+def test_get_changed_variables():
+    names = ['same', 'changed', 'removed']
+    previous_digests = variable_index.get_variable_digests(
+        {'same': 'a', 'changed': {'x': 1}, 'removed': 'c'}, names)
+    digests = variable_index.get_variable_digests(
+        {'same': 'a', 'changed': {'x': 2}, 'added': 'd'}, names + ['added'])
+
+    assert variable_index.get_changed_variables(previous_digests, digests) == \
+        ['added', 'changed', 'removed']
+
+
+def test_save_and_load(tmpdir):
+    appstack_path = tmpdir.join('appstack.yml').strpath
+    assert variable_index.load_variable_index(appstack_path) is None
+    assert variable_index.load_variable_digests(appstack_path) is None
+
+    variable_index.save_variable_index({'var': ['apps/app-a']}, appstack_path)
+    variable_index.save_variable_digests({'var': 'digest'}, appstack_path)
+
+    assert variable_index.load_variable_index(appstack_path) == {'var': ['apps/app-a']}
+    assert variable_index.load_variable_digests(appstack_path) == {'var': 'digest'}
+    digests_mode = os.stat(appstack_path + variable_index.VARIABLE_DIGESTS_SUFFIX).st_mode
+    assert stat.S_IMODE(digests_mode) == 0600
@@ -0,0 +1,35 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+import yaml
+
+from apployer import yaml_codec
+
+
+def test_dump_and_load():
+    data = {'applications': [{'name': u'app', 'env': {'VERSION': '0.1.2', 'PORT': 8080}}]}
+
+    dumped = yaml_codec.dump(data)
+
+    assert '!!python' not in dumped
+    assert yaml_codec.load(dumped) == data
+
+
+def test_load_is_safe():
+    with pytest.raises(yaml.YAMLError):
+        yaml_codec.load('!!python/object/apply:os.system ["echo bla"]')
+